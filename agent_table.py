@@ -0,0 +1,382 @@
+import pickle
+
+import numpy as np
+from scipy import sparse
+
+from influence import BEHAVIOURS, RELATIONSHIPS
+from incidence import SEX_INDEX
+from population import Agent_Store
+from checkpoint import NEIGHBOUR_SETS, Missing, agent_arrays, load_agent_class
+
+# Compact agents: the attributes of all agents kept in typed parallel arrays
+# indexed by the agents' stable ids, instead of one __dict__ per agent.
+# 	levels			int8 (behaviours, agents), the rows in the order of BEHAVIOURS
+# 	next_levels		second buffer of the levels, see swap_levels
+# 	columns[name]		the other plain attributes, e.g. age (int16), cv_chance (float64);
+# 				strings such as sex are stored as codes into categories[name]
+# 	objects[name]		object arrays for everything else, e.g. attributes the agents'
+# 				methods set that are not plain scalars
+# 	spouse			int32 id of the spouse, -1 for none
+# 	<set>_indptr/indices	household, workplace and friends as the rows of a CSR matrix
+# 	alive			mask of the living agents, dead agents are never removed
+#
+# The table is built from the flat arrays of checkpoint.agent_arrays, so agents,
+# checkpoints and cached networks all convert to it, and it writes the same
+# arrays back. Code that wants one agent at a time gets a view: an object with
+# __slots__ holding only the table and the id, whose attributes read and write
+# the arrays and whose methods are those of the agent class (next_*_level,
+# update_risk_levels, ...). Neighbours of a view are views of the living
+# neighbours, as sets like population.neighbour_sets makes them, and are read
+# only. Methods that call super() without arguments do not work on views.
+
+# the smallest types holding the values of the model's attributes
+COMPACT_TYPES = {'age': np.int16, 'imd': np.int8, 'intervention': np.int8}
+LEVEL_ROWS = {behaviour + '_level': b for b, behaviour in enumerate(BEHAVIOURS)}
+
+
+class Agent_View:
+	__slots__ = ('table', 'uid')
+
+	def __init__(self, table, uid):
+		object.__setattr__(self, 'table', table)
+		object.__setattr__(self, 'uid', uid)
+
+	def __setattr__(self, name, value):
+		if name in self.table.attributes:
+			object.__setattr__(self, name, value)
+		else:
+			self.table.set_object(name, self.uid, value)
+
+	def __repr__(self):
+		return "<" + type(self).__name__ + " " + str(self.uid) + ">"
+
+
+# the properties of a view read and write the arrays through memoryviews
+# (see Agent_Table.scalar_views), which index to plain Python numbers much
+# faster than numpy arrays do
+def level_property(b):
+	def get(self):
+		return self.table.level_views[b][self.uid]
+
+	def set(self, value):
+		self.table.level_views[b][self.uid] = value
+	return property(get, set)
+
+
+def column_property(name):
+	def get(self):
+		return self.table.column_views[name][self.uid]
+
+	def set(self, value):
+		self.table.column_views[name][self.uid] = value
+	return property(get, set)
+
+
+def object_property(name):
+	def get(self):
+		value = self.table.objects[name][self.uid]
+		if value is Missing:
+			raise AttributeError(type(self).__name__ + " has no attribute " + name)
+		return value
+
+	def set(self, value):
+		self.table.objects[name][self.uid] = value
+	return property(get, set)
+
+
+def category_property(name):
+	def get(self):
+		return self.table.categories[name][self.table.columns[name][self.uid]]
+
+	def set(self, value):
+		self.table.columns[name][self.uid] = self.table.category_code(name, value)
+	return property(get, set)
+
+
+def spouse_property():
+	def get(self):
+		spouse = self.table.spouse[self.uid]
+		if spouse < 0 or not self.table.alive[spouse]:
+			return None
+		return self.table.view(spouse)
+
+	def set(self, value):
+		self.table.spouse[self.uid] = -1 if value is None else value.uid
+	return property(get, set)
+
+
+def neighbours_property(name):
+	def get(self):
+		return self.table.neighbours(name, self.uid)
+	return property(get)
+
+
+# view class for the agents of a table: the methods and class attributes of the
+# agent class, with properties over the arrays of the table for the attributes
+def view_class(table):
+	namespace = dict()
+	for cls in reversed(table.agent_class.__mro__[:-1]):
+		for name, value in vars(cls).items():
+			if not (name.startswith('__') and name.endswith('__')):
+				namespace[name] = value
+
+	for name, b in LEVEL_ROWS.items():
+		namespace[name] = level_property(b)
+	for name in table.columns:
+		namespace[name] = category_property(name) if name in table.categories else column_property(name)
+	for name in table.objects:
+		namespace[name] = object_property(name)
+	namespace['spouse'] = spouse_property()
+	for name in NEIGHBOUR_SETS:
+		namespace[name] = neighbours_property(name)
+	namespace['__slots__'] = ()
+
+	return type(table.agent_class.__name__ + '_View', (Agent_View,), namespace)
+
+
+# sequence of the views of a table by id, None for the dead agents, standing in
+# for the slots of an Agent_Store
+class View_Slots:
+	def __init__(self, table):
+		self.table = table
+
+	def __len__(self):
+		return len(self.table.alive)
+
+	def __getitem__(self, uid):
+		return self.table[uid]
+
+	def __iter__(self):
+		for uid in range(len(self.table.alive)):
+			yield self.table[uid]
+
+
+class Agent_Table:
+	compact = True
+
+	# arrays is the output of checkpoint.agent_arrays
+	def __init__(self, arrays):
+		n = int(arrays['slots'])
+		uids = arrays['uid'].astype(np.intp)
+		self.agent_class = load_agent_class(arrays)
+
+		self.alive = np.zeros(n, dtype=bool)
+		self.alive[uids] = True
+		self.size = len(uids)
+
+		self.levels = np.zeros((len(BEHAVIOURS), n), dtype=np.int8)
+		self.next_levels = np.zeros_like(self.levels)
+		self.columns = dict()
+		self.categories = dict()
+		for key in arrays:
+			if not key.startswith('attr_'):
+				continue
+			name = key[len('attr_'):]
+			values = arrays[key]
+			if name in LEVEL_ROWS:
+				self.levels[LEVEL_ROWS[name], uids] = values
+			elif values.dtype.kind == 'U':
+				categories, codes = np.unique(values, return_inverse=True)
+				self.categories[name] = categories.tolist()
+				self.columns[name] = np.zeros(n, dtype=np.int16)
+				self.columns[name][uids] = codes
+			else:
+				self.columns[name] = np.zeros(n, dtype=COMPACT_TYPES.get(name, values.dtype))
+				self.columns[name][uids] = values
+
+		self.objects = dict()
+		for name, values in pickle.loads(arrays['objects'].tobytes()).items():
+			self.objects[name] = np.full(n, Missing, dtype=object)
+			for uid, value in zip(uids.tolist(), values):
+				self.objects[name][uid] = value
+
+		self.spouse = np.full(n, -1, dtype=np.int32)
+		self.spouse[uids] = arrays['spouse']
+
+		# the neighbour sets by id rather than in the order of the living agents
+		self.indptr = dict()
+		self.indices = dict()
+		for name in NEIGHBOUR_SETS:
+			counts = np.diff(arrays[name + '_indptr'])
+			rows = np.repeat(uids, counts)
+			order = np.argsort(rows, kind='stable')
+			self.indptr[name] = np.concatenate([[0], np.cumsum(np.bincount(rows, minlength=n))]).astype(np.int64)
+			self.indices[name] = arrays[name + '_indices'][order].astype(np.int32)
+
+		self.make_views()
+
+	# the memoryviews and the view class of the arrays of the table
+	def make_views(self):
+		self.scalar_views()
+		self.views = [None] * len(self.alive)
+		self.view_type = view_class(self)
+		self.attributes = set(name for cls in self.view_type.__mro__ for name in vars(cls)
+			if isinstance(vars(cls)[name], property))
+
+	# memoryviews of the level rows and the numeric columns, for the properties
+	# of the views. To be called again when an array is replaced.
+	def scalar_views(self):
+		self.level_views = [memoryview(row) for row in self.levels]
+		self.column_views = {name: memoryview(column) for name, column in self.columns.items()}
+
+	# make the next levels the current levels. The levels are double buffered:
+	# an array rule writes the levels of the next timestep of all agents into
+	# next_levels while every agent still reads the current ones, and the two
+	# buffers are then exchanged at once, without copying. What was the current
+	# buffer becomes scratch space for the next timestep.
+	def swap_levels(self):
+		self.levels, self.next_levels = self.next_levels, self.levels
+		self.scalar_views()
+
+	# age of every agent, for risk rules (see scenarios.Array_Rule)
+	def ages(self):
+		return self.columns['age'].astype(np.intp)
+
+	# the table of a list of agents or an Agent_Store
+	@staticmethod
+	def from_agents(agents):
+		if not isinstance(agents, Agent_Store):
+			agents = Agent_Store(agents)
+		return Agent_Table(agent_arrays(agents))
+
+	# the table over arrays of table_arrays, which are used as they are, without
+	# converting or copying them. With arrays memory-mapped copy-on-write
+	# (np.load with mmap_mode='c', see network_cache) every table cloned from
+	# the same files shares their pages until it writes to one. Only the object
+	# columns are unpickled.
+	@staticmethod
+	def from_table_arrays(arrays):
+		table = Agent_Table.__new__(Agent_Table)
+		table.agent_class = load_agent_class(arrays)
+		table.alive = arrays['alive']
+		table.size = int(np.count_nonzero(table.alive))
+		table.levels = arrays['levels']
+		table.next_levels = np.zeros_like(table.levels)
+		table.columns = {key[len('column_'):]: arrays[key] for key in arrays if key.startswith('column_')}
+		table.categories = pickle.loads(arrays['categories'].tobytes())
+		table.objects = pickle.loads(arrays['objects'].tobytes())
+		table.spouse = arrays['spouse']
+		table.indptr = {name: arrays['indptr_' + name] for name in NEIGHBOUR_SETS}
+		table.indices = {name: arrays['indices_' + name] for name in NEIGHBOUR_SETS}
+		table.make_views()
+		return table
+
+	# the arrays of the table in its own layout, see from_table_arrays
+	def table_arrays(self):
+		arrays = dict()
+		arrays['agent_class'] = np.array(self.agent_class.__module__ + ':' + self.agent_class.__qualname__)
+		arrays['alive'] = self.alive
+		arrays['levels'] = self.levels
+		for name, column in self.columns.items():
+			arrays['column_' + name] = column
+		arrays['categories'] = np.frombuffer(pickle.dumps(self.categories, pickle.HIGHEST_PROTOCOL), dtype=np.uint8)
+		arrays['objects'] = np.frombuffer(pickle.dumps(self.objects, pickle.HIGHEST_PROTOCOL), dtype=np.uint8)
+		arrays['spouse'] = self.spouse
+		for name in NEIGHBOUR_SETS:
+			arrays['indptr_' + name] = self.indptr[name]
+			arrays['indices_' + name] = self.indices[name]
+		return arrays
+
+	def __len__(self):
+		return self.size
+
+	def __iter__(self):
+		for uid in np.flatnonzero(self.alive).tolist():
+			yield self.view(uid)
+
+	def __contains__(self, agent):
+		return isinstance(agent, Agent_View) and agent.table is self and bool(self.alive[agent.uid])
+
+	# view of an agent by id, None if the agent has died
+	def __getitem__(self, uid):
+		if not self.alive[uid]:
+			return None
+		return self.view(uid)
+
+	@property
+	def slots(self):
+		return View_Slots(self)
+
+	# the view of an agent, there is one view per agent so views can be compared with is
+	def view(self, uid):
+		view = self.views[uid]
+		if view is None:
+			view = self.view_type(self, uid)
+			self.views[uid] = view
+		return view
+
+	def remove(self, agent):
+		if agent not in self:
+			raise ValueError("agent " + str(getattr(agent, 'uid', None)) + " is not in the table")
+		self.alive[agent.uid] = False
+		self.size = self.size - 1
+
+	# set of the views of the living neighbours of an agent in one of NEIGHBOUR_SETS
+	def neighbours(self, name, uid):
+		indices = self.indices[name][self.indptr[name][uid]:self.indptr[name][uid + 1]]
+		return set(self.view(j) for j in indices[self.alive[indices]].tolist())
+
+	def category_code(self, name, value):
+		categories = self.categories[name]
+		if value not in categories:
+			categories.append(value)
+		return categories.index(value)
+
+	# store an attribute that is not a column, in a new object column with a
+	# property on the views if the agents did not have it yet
+	def set_object(self, name, uid, value):
+		if name not in self.objects:
+			self.objects[name] = np.full(len(self.alive), Missing, dtype=object)
+			setattr(self.view_type, name, object_property(name))
+			self.attributes.add(name)
+		self.objects[name][uid] = value
+
+	# sex of every agent as an index into incidence.SEXES
+	def sex_index(self):
+		lookup = np.array([SEX_INDEX[sex] for sex in self.categories['sex']], dtype=np.intp)
+		return lookup[self.columns['sex']]
+
+	# one CSR matrix per relationship type where row i lists the agents that
+	# influence agent i, over all agents: dead agents are masked with alive
+	def adjacency(self):
+		n = len(self.alive)
+		adjacency = dict()
+		married = np.flatnonzero(self.spouse >= 0)
+		adjacency['Spouse'] = sparse.csr_matrix((np.ones(len(married)), (married, self.spouse[married])), shape=(n, n))
+		for rel, name in zip(['Household', 'Workplace', 'Friendship'], NEIGHBOUR_SETS):
+			adjacency[rel] = sparse.csr_matrix((np.ones(len(self.indices[name])), self.indices[name], self.indptr[name]),
+				shape=(n, n))
+		return {rel: adjacency[rel] for rel in RELATIONSHIPS}
+
+	# the arrays of checkpoint.agent_arrays for the living agents
+	def arrays(self):
+		uids = np.flatnonzero(self.alive)
+		arrays = dict()
+		arrays['slots'] = np.array(len(self.alive))
+		arrays['uid'] = uids.astype(np.int64)
+		arrays['agent_class'] = np.array(self.agent_class.__module__ + ':' + self.agent_class.__qualname__)
+
+		for name, b in LEVEL_ROWS.items():
+			arrays['attr_' + name] = self.levels[b, uids].astype(np.int64)
+		for name, column in self.columns.items():
+			if name in self.categories:
+				arrays['attr_' + name] = np.array(self.categories[name])[column[uids]]
+			else:
+				arrays['attr_' + name] = column[uids]
+		objects = {name: column[uids].tolist() for name, column in self.objects.items()}
+		arrays['objects'] = np.frombuffer(pickle.dumps(objects, pickle.HIGHEST_PROTOCOL), dtype=np.uint8)
+
+		spouse = self.spouse[uids].astype(np.int64)
+		spouse[(spouse >= 0) & ~self.alive[np.maximum(spouse, 0)]] = -1
+		arrays['spouse'] = spouse
+		for name in NEIGHBOUR_SETS:
+			indices = self.indices[name]
+			rows = np.repeat(np.arange(len(self.alive)), np.diff(self.indptr[name]))
+			keep = self.alive[rows] & self.alive[indices]
+			rows = rows[keep]
+			cols = indices[keep]
+			order = np.lexsort((cols, rows))
+			arrays[name + '_indptr'] = np.concatenate([[0], np.cumsum(np.bincount(rows, minlength=len(self.alive))[uids])]).astype(np.int64)
+			arrays[name + '_indices'] = cols[order].astype(np.int64)
+
+		return arrays
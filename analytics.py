@@ -0,0 +1,93 @@
+import argparse
+
+# Schedule of the analytics computed during a simulation. Every metric is
+# registered with a function computing it from the model and a cadence:
+# 	'step'	every timestep (and for the initial population)
+# 	N	every N timesteps, counted from the initial population
+# 	'end'	only for the last timestep of the run
+# 	'off'	never
+# Metrics that are not off are always computed for the last timestep, so the
+# end of run numbers are available whatever the cadence.
+
+STEP = 'step'
+END = 'end'
+OFF = 'off'
+
+
+# cadence from its command line form: step, end, off or a number of timesteps
+def parse_cadence(cadence):
+	if cadence in (STEP, END, OFF):
+		return cadence
+	try:
+		every = int(cadence)
+	except ValueError:
+		every = 0
+	if every < 1:
+		raise ValueError("cadence must be step, end, off or a positive number of timesteps, not " + str(cadence))
+	return every
+
+
+# (name, cadence) from a NAME=CADENCE string, e.g. 'avg_cvd=10'
+def parse_cadence_option(option):
+	name, separator, cadence = option.partition('=')
+	if separator == '':
+		raise ValueError("expected NAME=CADENCE, not " + option)
+	return name, parse_cadence(cadence)
+
+
+# dictionary of cadences from NAME=CADENCE strings, e.g. ['prevalence=end', 'avg_cvd=10']
+def parse_cadences(options):
+	return dict(parse_cadence_option(option) for option in options)
+
+
+# argparse type of NAME=CADENCE options for the metrics in names. Unknown
+# metrics and bad cadences are reported by argparse while the command line is
+# parsed, before anything is run. Gives (name, cadence) pairs, dict() of them
+# is the analytics argument of Spread_Model.
+def cadence_option(names):
+	def parse(option):
+		try:
+			name, cadence = parse_cadence_option(option)
+		except ValueError as error:
+			raise argparse.ArgumentTypeError(str(error))
+		if name not in names:
+			raise argparse.ArgumentTypeError("unknown metric " + name + ", known metrics are " + ', '.join(names))
+		return name, cadence
+	return parse
+
+
+class Analytics_Schedule:
+	def __init__(self):
+		# metrics[name] = [function(model, i), cadence]
+		self.metrics = dict()
+
+	def __contains__(self, name):
+		return name in self.metrics
+
+	# register a metric, replacing a metric of the same name
+	def register(self, name, function, cadence=STEP):
+		self.metrics[name] = [function, parse_cadence(cadence)]
+
+	def set_cadence(self, name, cadence):
+		if name not in self.metrics:
+			raise KeyError("unknown metric " + name + ", known metrics are " + ', '.join(self.metrics))
+		self.metrics[name][1] = parse_cadence(cadence)
+
+	# is a metric due after timestep i (-1 for the initial population)
+	def due(self, name, i, final=False):
+		cadence = self.metrics[name][1]
+		if cadence == OFF:
+			return False
+		if final or cadence == STEP:
+			return True
+		if cadence == END:
+			return False
+		return (i + 1) % cadence == 0
+
+	# compute the metrics due after timestep i, returns a dictionary of their values
+	def run(self, model, i, final=False):
+		values = dict()
+		for name, (function, cadence) in self.metrics.items():
+			if self.due(name, i, final):
+				values[name] = function(model, i)
+		return values
@@ -0,0 +1,23 @@
+import numpy as np
+
+# Vectorised level rules for the synthetic agents of the benchmarks and tests
+# (see synthetic.py), for scenarios.Array_Rule, which describes the form of a
+# level rule. They only stand in for Synthetic_Agent.next_*_level; the model's
+# own agents keep their per-agent rules.
+
+
+# adopt level l with probability inc[l] / (total influence + resistance), keep
+# the current level otherwise or without any incoming influence
+def proportional_rule(resistance=1.0):
+	def rule(inc, levels, uniforms, out=None):
+		total = inc.sum(axis=-1)
+		draw = uniforms[None] * (total + resistance)
+		# number of cumulative thresholds the draw has passed, LEVELS if none was reached
+		chosen = (draw[..., None] >= np.cumsum(inc, axis=-1)).sum(axis=-1)
+		keep = (chosen == inc.shape[-1]) | (total <= 0)
+		if out is None:
+			return np.where(keep, levels, chosen).astype(levels.dtype)
+		np.copyto(out, chosen, casting='unsafe')
+		np.copyto(out, levels, where=keep)
+		return out
+	return rule
@@ -0,0 +1,344 @@
+import argparse
+import json
+import logging
+import platform
+import resource
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+BENCHMARK_FOLDER = Path(__file__).resolve().parent
+sys.path.insert(0, str(BENCHMARK_FOLDER.parent))
+sys.path.insert(0, str(BENCHMARK_FOLDER))
+
+from synthetic import load_config, synthetic_population, synthetic_risk, CONFIG_FILE
+
+# Benchmarks of Spread_Model.simulation on synthetic populations (see
+# synthetic.py), so they run without the parameter csv files. Every size runs
+# in a fresh process, which reports the time to build the population and set
+# up the model, the throughput in agent-steps per second, the peak resident
+# memory and the time of every phase of the simulation (see timing).
+#
+# Baselines are kept in baselines.json by host and benchmark, e.g.
+# 	python benchmarks/run_benchmarks.py --sizes 1000 10000 --save-baseline
+# 	python benchmarks/run_benchmarks.py --sizes 1000 10000 --compare
+# A benchmark is a regression when its throughput is more than tolerance below
+# the baseline or its peak memory more than tolerance above it.
+#
+# With --imports, the time and memory to import the entry modules are measured
+# instead, each in a fresh interpreter. An import is a regression when it takes
+# more than tolerance longer than its baseline or when it pulls in one of the
+# optional plotting packages, which are only to be imported on request (see plotting).
+# 	python benchmarks/run_benchmarks.py --imports --compare
+#
+# With --worker-scaling, every size runs on the array engine with one
+# influence worker and then with each of the given numbers of workers (see
+# sharding), and the speed-up of the influence step and of the whole run over
+# the single worker is reported. Sharding only pays off with enough cores and
+# agents to outweigh starting the workers and filling the shared memory.
+# 	python benchmarks/run_benchmarks.py --sizes 100000 1000000 --worker-scaling 2 4 8
+
+SIZES = [1000, 10000, 100000, 1000000]
+IMPORT_MODULES = ['intervention', 'scenarios']
+OPTIONAL_MODULES = ['matplotlib', 'networkx']
+BASELINE_FILE = BENCHMARK_FOLDER / "baselines.json"
+
+logger = logging.getLogger(__name__)
+
+
+# name of a benchmark in the baselines
+def benchmark_name(size, array_engine, batch_cvd, scenarios=0, compact=False, array_rule=False, influence_workers=1):
+	name = "n-" + str(size)
+	if scenarios > 0:
+		return name + "_scenarios-" + str(scenarios)
+	if array_engine:
+		name = name + "_array-engine"
+	if batch_cvd:
+		name = name + "_batch-cvd"
+	if compact:
+		name = name + "_compact"
+	if array_rule:
+		name = name + "_array-rule"
+	if influence_workers > 1:
+		name = name + "_workers-" + str(influence_workers)
+	return name
+
+
+# peak resident memory of this process in MB (ru_maxrss is in kB on linux, bytes on mac)
+def peak_rss_mb():
+	rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	if sys.platform == 'darwin':
+		return rss / 2**20
+	return rss / 2**10
+
+
+# build a population of size agents and run steps timesteps, returns the measurements.
+# With array_rule the levels and risks come from the array rules of the synthetic
+# agents (see scenarios.Array_Rule), which run on the compact table.
+def run_benchmark(size, steps, seed, array_engine=False, batch_cvd=False, config_file=CONFIG_FILE, compact=False,
+		array_rule=False, influence_workers=1):
+	from intervention import Spread_Model
+	from scenarios import Array_Rule
+	from level_rules import proportional_rule
+	from random_streams import Random_Streams
+	from reporting import Progress_Reporter, quiet_logging
+
+	config = load_config(config_file)
+	streams = Random_Streams(seed)
+
+	start = time.perf_counter()
+	agents = synthetic_population(size, config, streams.generator('network'))
+	build_seconds = time.perf_counter() - start
+
+	rule = Array_Rule(proportional_rule(config['resistance']), synthetic_risk(config)) if array_rule else None
+	streams.seed_global('agents')
+	with quiet_logging():
+		start = time.perf_counter()
+		model = Spread_Model(agents, config['inf_by_rel'], config['inf_by_rel'], "benchmark", array_engine=array_engine,
+			keep_history=False, rng=streams.generator('model'), batch_cvd=batch_cvd, timing=True,
+			progress=Progress_Reporter(float('inf')), compact=compact, rule=rule,
+			influence_workers=influence_workers)
+		setup_seconds = time.perf_counter() - start
+
+		start = time.perf_counter()
+		model.simulation(steps)
+		run_seconds = time.perf_counter() - start
+
+	return {'size': size, 'steps': steps, 'seed': seed, 'array_engine': array_engine, 'batch_cvd': batch_cvd, 'compact': compact,
+		'array_rule': array_rule, 'influence_workers': influence_workers, 'build_seconds': build_seconds, 'setup_seconds': setup_seconds, 'run_seconds': run_seconds,
+		'throughput': model.timer.throughput(), 'peak_rss_mb': peak_rss_mb(),
+		'phases': model.timer.seconds, 'counters': model.timer.counters}
+
+
+# run scenarios scenarios of a population of size agents together for steps
+# timesteps (see scenarios.Scenario_Batch), on the array rules of the synthetic
+# agents. The scenarios after the first have their workplace weights scaled up
+# for a third of the agents. Throughput counts every agent in every scenario.
+def run_scenario_benchmark(size, steps, seed, scenarios, config_file=CONFIG_FILE):
+	import copy
+	import numpy as np
+	from scenarios import Scenario, Scenario_Batch, Array_Rule
+	from level_rules import proportional_rule
+	from random_streams import Random_Streams
+
+	config = load_config(config_file)
+	streams = Random_Streams(seed)
+
+	start = time.perf_counter()
+	agents = synthetic_population(size, config, streams.generator('network'))
+	build_seconds = time.perf_counter() - start
+
+	start = time.perf_counter()
+	groups = (streams.generator('intervention').random(size) < 1 / 3).astype(np.intp)
+	batch_scenarios = [Scenario('baseline', groups=np.zeros(size, dtype=np.intp))]
+	for s in range(1, scenarios):
+		weights = copy.deepcopy(config['inf_by_rel'])
+		for table in weights['Workplace'].values():
+			for levels in table.values():
+				for level in levels:
+					levels[level] = levels[level] * (1 + s)
+		batch_scenarios.append(Scenario('workplace-' + str(s), [weights], groups))
+	rule = Array_Rule(proportional_rule(config['resistance']), synthetic_risk(config))
+	batch = Scenario_Batch(agents, config['inf_by_rel'], batch_scenarios, rule, streams.generator('model'))
+	setup_seconds = time.perf_counter() - start
+
+	start = time.perf_counter()
+	batch.run(steps)
+	run_seconds = time.perf_counter() - start
+
+	agent_steps = sum(sum(population) for population in batch.population)
+	return {'size': size, 'steps': steps, 'seed': seed, 'scenarios': scenarios,
+		'build_seconds': build_seconds, 'setup_seconds': setup_seconds, 'run_seconds': run_seconds,
+		'throughput': agent_steps / run_seconds, 'peak_rss_mb': peak_rss_mb(),
+		'phases': {'run': run_seconds}, 'counters': {'agents': agent_steps}}
+
+
+# import module and return the time it took, the peak memory and the optional
+# packages it imported. Only meaningful in a fresh interpreter.
+def run_import_benchmark(module):
+	import importlib
+
+	start = time.perf_counter()
+	importlib.import_module(module)
+	import_seconds = time.perf_counter() - start
+
+	return {'module': module, 'import_seconds': import_seconds, 'peak_rss_mb': peak_rss_mb(),
+		'optional_imported': [name for name in OPTIONAL_MODULES if name in sys.modules]}
+
+
+def import_in_process(module):
+	command = [sys.executable, __file__, '--worker', '--import-module', module]
+	output = subprocess.run(command, check=True, stdout=subprocess.PIPE, text=True).stdout
+	return json.loads(output.strip().splitlines()[-1])
+
+
+# run a benchmark in a fresh process, so the peak memory is its own
+def run_in_process(size, steps, seed, array_engine, batch_cvd, config_file, scenarios=0, compact=False, array_rule=False,
+		influence_workers=1):
+	command = [sys.executable, __file__, '--worker', '--sizes', str(size), '--steps', str(steps), '--seed', str(seed),
+		'--config', str(config_file), '--scenarios', str(scenarios), '--influence-workers', str(influence_workers)]
+	if array_engine:
+		command.append('--array-engine')
+	if batch_cvd:
+		command.append('--batch-cvd')
+	if compact:
+		command.append('--compact')
+	if array_rule:
+		command.append('--array-rule')
+	output = subprocess.run(command, check=True, stdout=subprocess.PIPE, text=True).stdout
+	return json.loads(output.strip().splitlines()[-1])
+
+
+def read_baselines(path):
+	path = Path(path)
+	if not path.is_file():
+		return dict()
+	with open(path) as file:
+		return json.load(file)
+
+
+def write_baselines(baselines, path):
+	with open(path, 'w') as file:
+		json.dump(baselines, file, indent=1, sort_keys=True)
+
+
+# regressions of a result against its baseline, as messages
+def regressions(result, baseline, tolerance):
+	messages = list()
+	if 'import_seconds' in result:
+		if result['import_seconds'] > baseline['import_seconds'] * (1 + tolerance):
+			messages.append("import %.3f s, baseline %.3f s" % (result['import_seconds'], baseline['import_seconds']))
+		if len(result['optional_imported']) > 0:
+			messages.append("imports " + ', '.join(result['optional_imported']))
+		return messages
+	if result['throughput'] < baseline['throughput'] * (1 - tolerance):
+		messages.append("throughput %.0f agent-steps/s, baseline %.0f" % (result['throughput'], baseline['throughput']))
+	if result['peak_rss_mb'] > baseline['peak_rss_mb'] * (1 + tolerance):
+		messages.append("peak RSS %.1f MB, baseline %.1f MB" % (result['peak_rss_mb'], baseline['peak_rss_mb']))
+	return messages
+
+
+# seconds of the influence step of a run, with the next levels of the array
+# rules, which the influence workers compute along with the influence
+def influence_seconds(result):
+	return result['phases'].get('influence', 0) + result['phases'].get('next_levels', 0)
+
+
+# log the speed-up of a run with influence workers over the same run with one worker
+def log_speedup(name, result, single):
+	logger.info("%-32s speed-up over 1 worker: influence %5.2fx  run %5.2fx", name,
+		influence_seconds(single) / influence_seconds(result), single['run_seconds'] / result['run_seconds'])
+
+
+def log_result(name, result):
+	if 'import_seconds' in result:
+		logger.info("%-32s import %7.3f s  peak RSS %8.1f MB  optional packages imported: %s", name,
+			result['import_seconds'], result['peak_rss_mb'], ', '.join(result['optional_imported']) or 'none')
+		return
+	logger.info("%-32s build %7.2f s  setup %7.2f s  run %8.2f s  %10.0f agent-steps/s  peak RSS %8.1f MB", name,
+		result['build_seconds'], result['setup_seconds'], result['run_seconds'], result['throughput'], result['peak_rss_mb'])
+	phases = ', '.join("%s %.3f" % (phase, seconds) for phase, seconds in result['phases'].items())
+	logger.info("%-32s phases (s): %s", '', phases)
+
+
+def main():
+	parser = argparse.ArgumentParser(description="Benchmarks of the spread model on synthetic populations")
+	parser.add_argument('--sizes', type=int, nargs='+', default=SIZES, help="population sizes")
+	parser.add_argument('--steps', type=int, default=5, help="timesteps of every run")
+	parser.add_argument('--seed', type=int, default=12345)
+	parser.add_argument('--array-engine', action='store_true')
+	parser.add_argument('--batch-cvd', action='store_true')
+	parser.add_argument('--compact', action='store_true', help="keep the agents in an Agent_Table")
+	parser.add_argument('--array-rule', action='store_true',
+		help="run the array rules of the synthetic agents on double buffered levels (implies --compact)")
+	parser.add_argument('--influence-workers', type=int, default=1,
+		help="split the influence step of every run over this many processes (see sharding)")
+	parser.add_argument('--worker-scaling', type=int, nargs='+', metavar='WORKERS',
+		help="run every size with one influence worker and with each of these numbers of workers on the array engine, "
+		"and report the speed-ups")
+	parser.add_argument('--scenarios', type=int, default=0,
+		help="run this many scenarios together on the array rules instead of Spread_Model")
+	parser.add_argument('--imports', action='store_true',
+		help="measure the import of " + ', '.join(IMPORT_MODULES) + " instead of simulation runs")
+	parser.add_argument('--config', default=str(CONFIG_FILE), help="synthetic configuration")
+	parser.add_argument('--baseline-file', default=str(BASELINE_FILE))
+	parser.add_argument('--host', default=platform.node(), help="name of this machine in the baselines")
+	parser.add_argument('--save-baseline', action='store_true', help="store the results as the baselines of this host")
+	parser.add_argument('--compare', action='store_true', help="compare with the baselines of this host, exit 1 on a regression")
+	parser.add_argument('--tolerance', type=float, default=0.2, help="allowed relative change before a regression")
+	parser.add_argument('--json', help="also write the results to this file")
+	parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+	parser.add_argument('--import-module', help=argparse.SUPPRESS)
+	args = parser.parse_args()
+
+	if args.worker and args.import_module is not None:
+		print(json.dumps(run_import_benchmark(args.import_module)))
+		return 0
+	if args.worker and args.scenarios > 0:
+		result = run_scenario_benchmark(args.sizes[0], args.steps, args.seed, args.scenarios, args.config)
+		print(json.dumps(result))
+		return 0
+	if args.worker:
+		result = run_benchmark(args.sizes[0], args.steps, args.seed, args.array_engine, args.batch_cvd, args.config,
+			args.compact, args.array_rule, args.influence_workers)
+		print(json.dumps(result))
+		return 0
+
+	logging.basicConfig(level=logging.INFO, format="%(message)s", stream=sys.stdout)
+
+	results = dict()
+	for module in IMPORT_MODULES if args.imports else []:
+		name = "import_" + module
+		results[name] = import_in_process(module)
+		log_result(name, results[name])
+	for size in [] if args.imports else args.sizes:
+		if args.worker_scaling is not None:
+			single = None
+			for workers in [1] + [workers for workers in args.worker_scaling if workers > 1]:
+				name = benchmark_name(size, True, args.batch_cvd, 0, args.compact, args.array_rule, workers)
+				results[name] = run_in_process(size, args.steps, args.seed, True, args.batch_cvd, args.config,
+					0, args.compact, args.array_rule, workers)
+				log_result(name, results[name])
+				if single is None:
+					single = results[name]
+				else:
+					log_speedup(name, results[name], single)
+			continue
+		name = benchmark_name(size, args.array_engine, args.batch_cvd, args.scenarios, args.compact, args.array_rule,
+			args.influence_workers)
+		results[name] = run_in_process(size, args.steps, args.seed, args.array_engine, args.batch_cvd, args.config,
+			args.scenarios, args.compact, args.array_rule, args.influence_workers)
+		log_result(name, results[name])
+
+	if args.json:
+		with open(args.json, 'w') as file:
+			json.dump(results, file, indent=1)
+
+	status = 0
+	baselines = read_baselines(args.baseline_file)
+	if args.compare:
+		host = baselines.get(args.host, dict())
+		for name, result in results.items():
+			if name not in host:
+				logger.info("%s: no baseline for host %s", name, args.host)
+				continue
+			if host[name].get('steps') != result.get('steps') or host[name].get('seed') != result.get('seed'):
+				logger.info("%s: baseline ran %d steps with seed %d, not comparable", name, host[name]['steps'], host[name]['seed'])
+				continue
+			for message in regressions(result, host[name], args.tolerance):
+				logger.warning("REGRESSION %s: %s", name, message)
+				status = 1
+		if status == 0:
+			logger.info("No regressions against the baselines of %s", args.host)
+
+	if args.save_baseline:
+		baselines.setdefault(args.host, dict()).update(results)
+		write_baselines(baselines, args.baseline_file)
+		logger.info("Baselines of %s saved to %s", args.host, args.baseline_file)
+
+	return status
+
+
+if __name__ == "__main__":
+	sys.exit(main())
@@ -0,0 +1,170 @@
+import json
+import random
+from pathlib import Path
+
+import numpy as np
+
+# Synthetic populations for the benchmarks, so they run without the parameter
+# csv files. Synthetic_Agent implements what Spread_Model needs from an agent;
+# its behaviour and risk rules are simple stand-ins, not the model's own.
+
+CONFIG_FILE = Path(__file__).parent / "synthetic_config.json"
+
+BEHAVIOURS = ['smoking', 'alcohol', 'diet', 'inactivity']
+
+
+# the synthetic configuration, with the levels of inf_by_rel as ints
+def load_config(path=CONFIG_FILE):
+	with open(path) as file:
+		config = json.load(file)
+	config['inf_by_rel'] = int_levels(config['inf_by_rel'])
+	return config
+
+
+def int_levels(table):
+	if all(key.isdigit() for key in table):
+		return {int(key): value for key, value in table.items()}
+	return {key: int_levels(value) for key, value in table.items()}
+
+
+class Synthetic_Agent:
+	# behaviour and risk parameters shared by all agents, see configure
+	resistance = 1.0
+	base_risk = 0.0004
+	risk_per_year = 0.00006
+	level_risk = [1.0, 1.15, 1.35]
+
+	@classmethod
+	def configure(cls, config):
+		cls.resistance = config['resistance']
+		cls.base_risk = config['base_risk']
+		cls.risk_per_year = config['risk_per_year']
+		cls.level_risk = config['level_risk']
+
+	def __init__(self, age, sex, imd, workplace_type, levels):
+		self.age = age
+		self.sex = sex
+		self.imd = imd
+		self.workplace_type = workplace_type
+		self.intervention = False
+		self.smoking_level, self.alcohol_level, self.diet_level, self.inactivity_level = levels
+		self.next_levels = list(levels)
+
+		self.spouse = None
+		self.household = list()
+		self.workplace = list()
+		self.friends = list()
+
+		self.update_cv_chance()
+
+	# adopt level l with probability inc_inf[l] / (total influence + resistance)
+	def next_level(self, b, current, inc_inf):
+		total = inc_inf[0] + inc_inf[1] + inc_inf[2]
+		if total <= 0:
+			self.next_levels[b] = current
+			return
+		draw = random.random() * (total + self.resistance)
+		for level in range(3):
+			draw = draw - inc_inf[level]
+			if draw < 0:
+				self.next_levels[b] = level
+				return
+		self.next_levels[b] = current
+
+	def next_smoking_level(self, inc_inf):
+		self.next_level(0, self.smoking_level, inc_inf)
+
+	def next_alcohol_level(self, inc_inf):
+		self.next_level(1, self.alcohol_level, inc_inf)
+
+	def next_diet_level(self, inc_inf):
+		self.next_level(2, self.diet_level, inc_inf)
+
+	def next_inactivity_level(self, inc_inf):
+		self.next_level(3, self.inactivity_level, inc_inf)
+
+	def update_cv_chance(self):
+		risk = self.base_risk + self.risk_per_year * (self.age - 25)
+		for level in (self.smoking_level, self.alcohol_level, self.diet_level, self.inactivity_level):
+			risk = risk * self.level_risk[level]
+		self.cv_chance = risk
+
+	# move to the next levels and update the cvd risk
+	def update_risk_levels(self):
+		self.smoking_level, self.alcohol_level, self.diet_level, self.inactivity_level = self.next_levels
+		self.update_cv_chance()
+
+	def test_for_cv(self):
+		return random.random() < self.cv_chance
+
+	def age_up(self):
+		self.age = self.age + 1
+
+
+# the cvd chances of Synthetic_Agent.update_cv_chance for the levels of a
+# scenarios.Scenario_Batch, a risk rule for scenarios.Array_Rule. The matching
+# level rule is proportional_rule(config['resistance']) of level_rules.py.
+def synthetic_risk(config):
+	level_risk = np.array(config['level_risk'])
+
+	def rule(levels, batch):
+		risk = config['base_risk'] + config['risk_per_year'] * (batch.ages() - 25)
+		return risk[None] * level_risk[levels].prod(axis=1)
+	return rule
+
+
+# n agents with households, spouses, workplaces and friendships, drawn from rng
+def synthetic_population(n, config, rng):
+	low, high = config['age_range']
+	ages = rng.integers(low, high + 1, n).tolist()
+	sexes = rng.choice(['M', 'F'], n).tolist()
+	imds = rng.integers(1, 6, n).tolist()
+
+	types = list(config['workplace_types'])
+	type_weights = np.array([config['workplace_types'][t] for t in types])
+	levels = np.stack([rng.choice(3, n, p=config['prevalence'][behaviour]) for behaviour in BEHAVIOURS], axis=1).tolist()
+
+	Synthetic_Agent.configure(config)
+	agents = [Synthetic_Agent(ages[k], sexes[k], imds[k], None, levels[k]) for k in range(n)]
+
+	# households of consecutive agents, the first two of a household may be spouses
+	sizes = np.array([int(size) for size in config['household_sizes']])
+	size_weights = np.array(list(config['household_sizes'].values()))
+	drawn = rng.choice(sizes, n, p=size_weights / size_weights.sum())
+	start = 0
+	for size in drawn.tolist():
+		if start >= n:
+			break
+		household = agents[start:start + size]
+		for agent in household:
+			agent.household = [other for other in household if other is not agent]
+		if len(household) >= 2 and rng.random() < config['spouse_probability']:
+			household[0].spouse = household[1]
+			household[1].spouse = household[0]
+		start = start + size
+
+	# workplaces of the agents below retirement age, in random groups
+	workers = [agent for agent in agents if agent.age < config['retirement_age']]
+	order = rng.permutation(len(workers)).tolist()
+	size = config['workplace_size']
+	for start in range(0, len(order), size):
+		workplace = [workers[k] for k in order[start:start + size]]
+		workplace_type = types[rng.choice(len(types), p=type_weights / type_weights.sum())]
+		for agent in workplace:
+			agent.workplace_type = workplace_type
+			agent.workplace = [other for other in workplace if other is not agent]
+	for agent in agents:
+		if agent.workplace_type is None:
+			agent.workplace_type = types[0]
+
+	# friendships between random pairs of agents
+	pairs = rng.integers(0, n, (n * config['friends'] // 2, 2))
+	friends = [set() for k in range(n)]
+	for a, b in pairs.tolist():
+		if a != b and b not in friends[a]:
+			friends[a].add(b)
+			friends[b].add(a)
+	for k, agent in enumerate(agents):
+		agent.friends = [agents[f] for f in sorted(friends[k])]
+
+	return agents
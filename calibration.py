@@ -0,0 +1,327 @@
+import argparse
+import copy
+import csv
+import logging
+import os
+import random
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+from pathlib import Path
+
+import numpy as np
+from scipy import optimize
+
+from intervention import Spread_Model, load_parameters, replicate_seeds, score_threshold
+from population import Agent_Store
+from checkpoint import agent_arrays, agents_from_arrays
+from network_cache import network_arrays
+from random_streams import Random_Streams
+from reporting import configure_logging, quiet_logging
+import results_store
+
+# Calibration of the influence weights in inf_by_rel against the
+# Hippisley-Cox et al., 2017 incidence rates, using the model score of
+# Spread_Model.eval_params (lower is better).
+#
+# Every weight of inf_by_rel is one dimension of the search space. Candidates
+# are run across a pool of worker processes. Each worker generates the network
+# once and rebuilds a fresh copy of it from flat arrays for every run, and every
+# candidate is run with the same replicate seeds, so candidates are compared on
+# common random numbers. Scores of parameter vectors that were already
+# evaluated are taken from a cache. Candidates are first run for one replicate
+# only, and the remaining replicates are skipped for candidates scoring worse
+# than reject_factor times the best score so far. Runs whose running score
+# goes above that threshold are stopped early, from min_timesteps timesteps on
+# (see Spread_Model.running_score).
+
+METHODS = ['lhs', 'random', 'nelder-mead']
+
+logger = logging.getLogger(__name__)
+
+# state of a worker process, set up once by init_worker
+worker_state = dict()
+
+
+# paths of the weights in an inf_by_rel style dictionary, e.g.
+# ('Spouse', 'Smoking', 0) or ('Workplace', <workplace type>, 'Smoking', 0)
+def weight_keys(inf_by_rel, prefix=()):
+	keys = list()
+	for key, value in inf_by_rel.items():
+		if isinstance(value, dict):
+			keys.extend(weight_keys(value, prefix + (key,)))
+		else:
+			keys.append(prefix + (key,))
+	return keys
+
+
+# weights of an inf_by_rel style dictionary as a vector, in the order of keys
+def weights_to_vector(inf_by_rel, keys):
+	vector = np.zeros(len(keys))
+	for k, key in enumerate(keys):
+		value = inf_by_rel
+		for part in key:
+			value = value[part]
+		vector[k] = value
+	return vector
+
+
+# copy of the template dictionary with the weights taken from a vector
+def vector_to_weights(vector, keys, template):
+	inf_by_rel = copy.deepcopy(template)
+	for key, value in zip(keys, vector):
+		target = inf_by_rel
+		for part in key[:-1]:
+			target = target[part]
+		target[key[-1]] = float(value)
+	return inf_by_rel
+
+
+# samples points of a Latin hypercube in [lower, upper]^dim
+def latin_hypercube(samples, lower, upper, rng):
+	dim = len(lower)
+	strata = np.array([rng.permutation(samples) for d in range(dim)]).T
+	unit = (strata + rng.random((samples, dim))) / samples
+	return lower + unit * (upper - lower)
+
+
+# samples uniformly random points in [lower, upper]^dim
+def random_points(samples, lower, upper, rng):
+	return lower + rng.random((samples, len(lower))) * (upper - lower)
+
+
+# generate the network of a worker once, stored as flat arrays so a fresh copy
+# can be rebuilt cheaply for every run. With network_cache the arrays are
+# memory-mapped from the network cache instead.
+def init_worker(parameter_folder, target_size, timestep, network_seed, keys, template, array_engine, batch_cvd,
+		network_cache=False, min_timesteps=1):
+	param = load_parameters(parameter_folder)
+	with open(os.devnull, 'w') as devnull, redirect_stdout(devnull), quiet_logging():
+		if network_cache:
+			worker_state['network'] = network_arrays(parameter_folder, param, target_size, network_seed)
+		else:
+			from network import Network
+
+			random.seed(network_seed)
+			worker_state['network'] = agent_arrays(Agent_Store(Network(param).generate_agents(target_size)))
+
+	worker_state['timestep'] = timestep
+	worker_state['keys'] = keys
+	worker_state['template'] = template
+	worker_state['array_engine'] = array_engine
+	worker_state['batch_cvd'] = batch_cvd
+	worker_state['min_timesteps'] = min_timesteps
+
+
+# run one replicate of a candidate on the network of this worker, stopping
+# early once its running score is above stop_score. Returns the score
+# (eval_params, or the running score of a run stopped early) and the number of
+# timesteps completed.
+def run_candidate(vector, seed, stop_score=float('inf')):
+	inf_by_rel = vector_to_weights(vector, worker_state['keys'], worker_state['template'])
+	agents = agents_from_arrays(worker_state['network'])
+
+	streams = Random_Streams(seed)
+	spreader = Spread_Model(agents, inf_by_rel, inf_by_rel, "calibration", array_engine=worker_state['array_engine'],
+		keep_history=False, rng=streams.generator('model'), batch_cvd=worker_state['batch_cvd'],
+		analytics={'avg_cvd': 'off', 'prevalence': 'off'})
+	streams.seed_global('agents')
+
+	with quiet_logging():
+		timesteps = spreader.simulation(worker_state['timestep'],
+			score_callback=score_threshold(stop_score, worker_state['min_timesteps']))
+	if timesteps < worker_state['timestep']:
+		return spreader.running_score(), timesteps
+	return spreader.eval_params(), timesteps
+
+
+class Calibration:
+	def __init__(self, parameter_folder, target_size, timestep, replicates=1, workers=1, root_seed=None,
+			reject_factor=2.0, array_engine=False, batch_cvd=False, network_cache=False, min_timesteps=1):
+		self.template = load_parameters(parameter_folder).get_inf_by_rel()
+		self.keys = weight_keys(self.template)
+		self.replicates = replicates
+		self.timestep = timestep
+		self.reject_factor = reject_factor
+
+		# the network, the replicate seeds and the samplers all come from the root seed
+		self.streams = Random_Streams(root_seed)
+		logger.info("Calibration seed: %d", self.streams.seed)
+		self.seeds = replicate_seeds(self.streams.int_seed('agents'), replicates)
+		self.rng = self.streams.generator('model')
+
+		init_args = (parameter_folder, target_size, timestep, self.streams.int_seed('network'), self.keys, self.template,
+			array_engine, batch_cvd, network_cache, min_timesteps)
+		self.executor = None
+		if workers > 1:
+			# fill the cache once here, so the workers do not all generate the network
+			if network_cache:
+				network_arrays(parameter_folder, load_parameters(parameter_folder), target_size, init_args[3])
+			self.executor = ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=init_args)
+		else:
+			init_worker(*init_args)
+
+		# cache[vector as a tuple] = (mean score, number of replicates run, fewest timesteps completed by a replicate)
+		self.cache = dict()
+		self.best_score = float('inf')
+		self.best_vector = None
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
+
+	def close(self):
+		if self.executor is not None:
+			self.executor.shutdown()
+			self.executor = None
+
+	# run (vector, seed) tasks across the pool, stopping runs early once their
+	# running score is above stop_score. Returns (model score, timesteps completed) pairs
+	def run(self, tasks, stop_score):
+		if self.executor is None:
+			results = [run_candidate(vector, seed, stop_score) for vector, seed in tasks]
+		else:
+			vectors, seeds = zip(*tasks)
+			results = list(self.executor.map(run_candidate, vectors, seeds, [stop_score] * len(tasks)))
+		return [(score[0], timesteps) for score, timesteps in results]
+
+	# mean model score of each vector, taken from the cache where possible
+	def evaluate(self, vectors):
+		vectors = [tuple(float(value) for value in vector) for vector in vectors]
+		new = list(dict.fromkeys(vector for vector in vectors if vector not in self.cache))
+
+		if len(new) > 0:
+			# first replicate of every new candidate
+			first = self.run([(vector, self.seeds[0]) for vector in new], self.reject_factor * self.best_score)
+			scores = {vector: [score] for vector, (score, timesteps) in zip(new, first)}
+			completed = {vector: timesteps for vector, (score, timesteps) in zip(new, first)}
+			full_scores = [scores[vector][0] for vector in new if completed[vector] == self.timestep]
+			threshold = self.reject_factor * min([self.best_score] + full_scores)
+
+			# remaining replicates only for the candidates that are not clearly bad
+			tasks = [(vector, seed) for vector in new if scores[vector][0] <= threshold for seed in self.seeds[1:]]
+			if len(tasks) > 0:
+				for (vector, seed), (score, timesteps) in zip(tasks, self.run(tasks, threshold)):
+					scores[vector].append(score)
+					completed[vector] = min(completed[vector], timesteps)
+
+			for vector in new:
+				mean = float(np.mean(scores[vector]))
+				self.cache[vector] = (mean, len(scores[vector]), completed[vector])
+				complete = len(scores[vector]) == self.replicates and completed[vector] == self.timestep
+				if complete and mean < self.best_score:
+					self.best_score = mean
+					self.best_vector = vector
+
+		return [self.cache[vector][0] for vector in vectors]
+
+	# Nelder-Mead from x0 within the bounds. Every objective call runs the
+	# replicates of one candidate in parallel.
+	def nelder_mead(self, x0, lower, upper, max_evaluations):
+		objective = lambda x: self.evaluate([np.clip(x, lower, upper)])[0]
+		return optimize.minimize(objective, x0, method='Nelder-Mead', bounds=list(zip(lower, upper)),
+			options={'maxfev': max_evaluations})
+
+	# best weights found so far as an inf_by_rel style dictionary
+	def best_weights(self):
+		if self.best_vector is None:
+			return None
+		return vector_to_weights(self.best_vector, self.keys, self.template)
+
+	# write every evaluated candidate to a csv file, best first
+	def save(self, path):
+		path = Path(path)
+		path.parent.mkdir(parents=True, exist_ok=True)
+		with open(path, 'w', newline='') as file:
+			writer = csv.writer(file)
+			writer.writerow(['score', 'replicates', 'timesteps'] + ['/'.join(str(part) for part in key) for key in self.keys])
+			for vector, (score, replicates, timesteps) in sorted(self.cache.items(), key=lambda item: item[1][0]):
+				writer.writerow([score, replicates, timesteps] + list(vector))
+
+
+def main():
+	parser = argparse.ArgumentParser(description="calibration - search the influence weights against the CVD incidence rates.")
+	parser.add_argument(dest='parameter_folder',
+		help='folder of csv files with parameter specifications')
+
+	parser.add_argument('-n', '--size', action='store',
+		default=3500, type=int, help='target population size')
+
+	parser.add_argument('-t', '--timestep', action='store',
+		default=10, type=int, help='select number of timesteps for simulation')
+
+	parser.add_argument('-e', '--exp_id', default='None',
+		help='experiment ID for output file prefix')
+
+	parser.add_argument('--method', choices=METHODS, default='lhs',
+		help='Latin hypercube sampling, random search or Nelder-Mead from the weights in the parameter folder')
+
+	parser.add_argument('--samples', action='store', default=32, type=int,
+		help='number of candidates (maximum number of evaluations for nelder-mead)')
+
+	parser.add_argument('--replicates', action='store', default=1, type=int,
+		help='number of replicates each candidate is scored on')
+
+	parser.add_argument('--workers', action='store', default=1, type=int,
+		help='number of worker processes')
+
+	parser.add_argument('--seed', action='store', default=None, type=int,
+		help='seed of the calibration (random if not given)')
+
+	parser.add_argument('--reject-factor', dest='reject_factor', action='store', default=2.0, type=float,
+		help='skip the remaining replicates of candidates scoring worse than this times the best score')
+
+	parser.add_argument('--min-timesteps', dest='min_timesteps', action='store', default=1, type=int,
+		help='number of timesteps a candidate runs before it can be stopped early')
+
+	parser.add_argument('--lower', action='store', default=0.0, type=float,
+		help='lower bound of every weight')
+
+	parser.add_argument('--upper', action='store', default=1.0, type=float,
+		help='upper bound of every weight')
+
+	parser.add_argument('--array-engine', dest='array_engine', action='store_true',
+		help='compute influence with the array-backed engine (numpy/scipy)')
+
+	parser.add_argument('--batch-cvd', dest='batch_cvd', action='store_true',
+		help='draw the cvd events of all agents at once from the model random stream')
+
+	parser.add_argument('--network-cache', dest='network_cache', action='store_true',
+		help='reuse the network generated for the same parameters, size and seed from ./networks/')
+
+	parser.add_argument('-q', '--quiet', action='store_true',
+		help='only report warnings and errors')
+
+	args = parser.parse_args()
+	configure_logging(args.quiet)
+	config_name = os.path.basename(os.path.normpath(args.parameter_folder))
+	base_filename = "calibration_n-" + str(args.size) + "_t-" + str(args.timestep) + "_config-" + config_name
+	if args.exp_id != 'None':
+		base_filename = "expID-" + args.exp_id + "_" + base_filename
+
+	with Calibration(args.parameter_folder, args.size, args.timestep, replicates=args.replicates, workers=args.workers,
+			root_seed=args.seed, reject_factor=args.reject_factor, array_engine=args.array_engine,
+			batch_cvd=args.batch_cvd, network_cache=args.network_cache, min_timesteps=args.min_timesteps) as calibration:
+		lower = np.full(len(calibration.keys), args.lower)
+		upper = np.full(len(calibration.keys), args.upper)
+		logger.info("Calibrating %d weights with %s", len(calibration.keys), args.method)
+
+		if args.method == 'lhs':
+			calibration.evaluate(latin_hypercube(args.samples, lower, upper, calibration.rng))
+		elif args.method == 'random':
+			calibration.evaluate(random_points(args.samples, lower, upper, calibration.rng))
+		else:
+			x0 = np.clip(weights_to_vector(calibration.template, calibration.keys), lower, upper)
+			calibration.nelder_mead(x0, lower, upper, args.samples)
+
+	output_file = results_store.RESULTS_FOLDER / (base_filename + ".csv")
+	calibration.save(output_file)
+	logger.info("Candidates evaluated: %d", len(calibration.cache))
+	logger.info("Best score: %s", calibration.best_score)
+	logger.info("Best weights: %s", calibration.best_weights())
+	logger.info("Output file: %s", output_file)
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,221 @@
+import importlib
+import os
+import pickle
+import random
+from pathlib import Path
+
+import numpy as np
+
+from influence import BEHAVIOURS, LEVELS
+from sinks import Death_Record, CVD_METRICS
+
+# Checkpoints of a running Spread_Model, stored as a single .npz file of flat
+# arrays rather than a pickle of the agent object graph:
+# 	- the plain int/float/bool/str attributes of the agents as one column each
+# 	- the relationships as stable ids: a spouse column and an (indptr, indices)
+# 	  pair per neighbour set, like the rows of a CSR matrix
+# 	- the cvd and person years histograms, counters, the global RNG state and
+# 	  the state of the model's numpy Generator
+# 	- the analytics and death records collected so far
+# Agent attributes that are not plain scalars are pickled together in one
+# blob, so objects shared between agents are only stored once.
+
+NEIGHBOUR_SETS = ['household', 'workplace', 'friends']
+RELATIONSHIPS = ['spouse'] + NEIGHBOUR_SETS
+SCALAR_TYPES = (bool, int, float, str)
+
+
+# marks an attribute an agent does not have in a column of another agents' attributes
+class Missing:
+	pass
+
+
+# column of one agent attribute, as a numpy array if every value is a plain scalar of the same type
+def attribute_column(values):
+	kind = type(values[0]) if len(values) > 0 else None
+	if kind in SCALAR_TYPES and all(type(value) is kind for value in values):
+		try:
+			return np.array(values)
+		except OverflowError:
+			return None
+	return None
+
+
+# flat arrays describing the agents of a store and their relationships. An
+# agent_table.Agent_Table already holds them and writes its own.
+def agent_arrays(store):
+	if getattr(store, 'compact', False):
+		return store.arrays()
+
+	living = list(store)
+	arrays = dict()
+	arrays['slots'] = np.array(len(store.slots))
+	arrays['uid'] = np.array([agent.uid for agent in living], dtype=np.int64)
+
+	agent_class = type(living[0]) if len(living) > 0 else object
+	arrays['agent_class'] = np.array(agent_class.__module__ + ':' + agent_class.__qualname__)
+
+	names = list()
+	for agent in living:
+		for name in vars(agent):
+			if name not in names and name not in RELATIONSHIPS and name != 'uid':
+				names.append(name)
+
+	objects = dict()
+	for name in names:
+		values = [vars(agent).get(name, Missing) for agent in living]
+		column = attribute_column(values)
+		if column is not None:
+			arrays['attr_' + name] = column
+		else:
+			objects[name] = values
+	arrays['objects'] = np.frombuffer(pickle.dumps(objects, pickle.HIGHEST_PROTOCOL), dtype=np.uint8)
+
+	arrays['spouse'] = np.array([agent.spouse.uid if agent.spouse is not None else -1 for agent in living], dtype=np.int64)
+	for name in NEIGHBOUR_SETS:
+		neighbours = [sorted(nb.uid for nb in getattr(agent, name)) for agent in living]
+		arrays[name + '_indptr'] = np.cumsum([0] + [len(nbs) for nbs in neighbours], dtype=np.int64)
+		arrays[name + '_indices'] = np.array([uid for nbs in neighbours for uid in nbs], dtype=np.int64)
+
+	return arrays
+
+
+# class of the agents in agent_arrays
+def load_agent_class(arrays):
+	module_name, class_name = str(arrays['agent_class']).split(':')
+	agent_class = importlib.import_module(module_name)
+	for part in class_name.split('.'):
+		agent_class = getattr(agent_class, part)
+	return agent_class
+
+
+# rebuild the agents from agent_arrays, returns the slots of an Agent_Store
+# (None for the agents that were dead at the time of the checkpoint)
+def agents_from_arrays(arrays):
+	agent_class = load_agent_class(arrays)
+
+	uids = arrays['uid'].tolist()
+	slots = [None] * int(arrays['slots'])
+	for uid in uids:
+		slots[uid] = agent_class.__new__(agent_class)
+
+	columns = {key[len('attr_'):]: arrays[key].tolist() for key in arrays if key.startswith('attr_')}
+	columns.update(pickle.loads(arrays['objects'].tobytes()))
+	for name, values in columns.items():
+		for uid, value in zip(uids, values):
+			if value is not Missing:
+				setattr(slots[uid], name, value)
+
+	for k, uid in enumerate(uids):
+		agent = slots[uid]
+		spouse = int(arrays['spouse'][k])
+		agent.spouse = slots[spouse] if spouse >= 0 else None
+
+	for name in NEIGHBOUR_SETS:
+		indptr = arrays[name + '_indptr']
+		indices = arrays[name + '_indices'].tolist()
+		for k, uid in enumerate(uids):
+			setattr(slots[uid], name, set(slots[nb] for nb in indices[indptr[k]:indptr[k + 1]]))
+
+	return slots
+
+
+# flat arrays of the counters, RNG states and analytics of a model
+def model_arrays(model):
+	arrays = dict()
+	arrays['timestep'] = np.array(model.timestep)
+	arrays['total_deaths'] = np.array(model.total_deaths)
+	arrays['cvd_sum'] = np.array(model.cvd_sum)
+	arrays['cvd_counts'] = model.cvd_hist.counts
+	arrays['person_years_counts'] = model.person_years_hist.counts
+
+	version, internal, gauss = random.getstate()
+	arrays['random_version'] = np.array(version)
+	arrays['random_internal'] = np.array(internal, dtype=np.int64)
+	arrays['random_gauss'] = np.array(np.nan if gauss is None else gauss)
+	arrays['model_rng'] = np.frombuffer(pickle.dumps(model.rng.bit_generator.state), dtype=np.uint8)
+
+	arrays['population'] = np.array(list(model.population), dtype=np.int64)
+	arrays['avg_cvd'] = np.array(list(model.avg_cvd), dtype=np.float64)
+	arrays['behaviour_prevalence'] = np.array([[prevalence[behaviour] for behaviour in BEHAVIOURS]
+		for prevalence in model.behaviour_prevalence], dtype=np.float64).reshape(-1, len(BEHAVIOURS), LEVELS)
+	arrays['cvd_demographics'] = np.array([[demographics.get(metric, 0) for metric in CVD_METRICS]
+		for demographics in model.cvd_demographics], dtype=np.float64).reshape(-1, len(CVD_METRICS))
+
+	records = [record for t in model.deceased for record in model.deceased[t]]
+	for f, field in enumerate(Death_Record._fields):
+		arrays['deceased_' + field] = np.array([record[f] for record in records])
+
+	return arrays
+
+
+# restore the counters, RNG states and analytics of model_arrays into a freshly built model
+def restore_model(model, arrays):
+	model.timestep = int(arrays['timestep'])
+	model.total_deaths = int(arrays['total_deaths'])
+	# the running sum of the cvd chances differs from a fresh sum in the last
+	# digits, older checkpoints without it get the fresh sum
+	model.recount()
+	if 'cvd_sum' in arrays:
+		model.cvd_sum = float(arrays['cvd_sum'])
+	model.cvd_hist.counts[:] = arrays['cvd_counts']
+	model.person_years_hist.counts[:] = arrays['person_years_counts']
+
+	gauss = float(arrays['random_gauss'])
+	random.setstate((int(arrays['random_version']), tuple(arrays['random_internal'].tolist()),
+		None if np.isnan(gauss) else gauss))
+	model.rng.bit_generator.state = pickle.loads(arrays['model_rng'].tobytes())
+
+	model.population.extend(arrays['population'].tolist())
+	model.avg_cvd.extend(arrays['avg_cvd'].tolist())
+	for prevalence in arrays['behaviour_prevalence'].tolist():
+		model.behaviour_prevalence.append(dict(zip(BEHAVIOURS, prevalence)))
+	for row in arrays['cvd_demographics'].tolist():
+		demographics = dict(zip(CVD_METRICS, row))
+		for metric in CVD_METRICS:
+			if metric != 'avg_age':
+				demographics[metric] = int(demographics[metric])
+		model.cvd_demographics.append(demographics)
+
+	columns = [arrays['deceased_' + field].tolist() for field in Death_Record._fields]
+	for values in zip(*columns):
+		record = Death_Record(*values)
+		model.deceased.setdefault(record.t, list()).append(record)
+
+
+# write a checkpoint of a model. The file is written under a temporary name and
+# renamed into place, so a crash while writing never leaves a broken checkpoint.
+def write_checkpoint(model, path):
+	path = Path(path)
+	path.parent.mkdir(parents=True, exist_ok=True)
+
+	arrays = agent_arrays(model.agents)
+	arrays.update(model_arrays(model))
+
+	tmp_file = path.parent / ("." + path.name + ".tmp")
+	with open(tmp_file, 'wb') as file:
+		np.savez(file, **arrays)
+	os.replace(tmp_file, path)
+
+
+# read a checkpoint, returns the agent slots and the arrays to pass to restore_model
+def read_checkpoint(path):
+	with np.load(path) as checkpoint:
+		arrays = {key: checkpoint[key] for key in checkpoint.files}
+	return agents_from_arrays(arrays), arrays
+
+
+# file name of the checkpoint written after a timestep
+def checkpoint_path(folder, timestep):
+	return Path(folder) / ("step-" + str(timestep).zfill(6) + ".npz")
+
+
+# most recent checkpoint in a folder, None if there is none
+def latest_checkpoint(folder):
+	folder = Path(folder)
+	if not folder.is_dir():
+		return None
+	checkpoints = sorted(path for path in folder.glob("step-*.npz"))
+	if len(checkpoints) == 0:
+		return None
+	return checkpoints[-1]
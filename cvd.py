@@ -0,0 +1,43 @@
+import numpy as np
+
+from incidence import SEX_INDEX
+
+# Column arrays of the attributes the yearly cvd sweep needs, for the living
+# agents in store order. The batch path of Spread_Model.simulation builds
+# these once per timestep, updates the risk of all agents, draws every cvd
+# event with a single comparison against an array of uniforms and applies
+# the deaths in bulk.
+class Cvd_Columns:
+	def __init__(self, agents):
+		# an agent_table.Agent_Table already holds the columns
+		if getattr(agents, 'compact', False):
+			living = np.flatnonzero(agents.alive)
+			self.uids = living
+			self.agents = [agents.view(uid) for uid in living.tolist()]
+			self.sex = agents.sex_index()[living]
+			self.age = agents.columns['age'][living].astype(np.intp)
+			self.imd = agents.columns['imd'][living].astype(np.intp)
+			self.cv_chance = np.zeros(len(living))
+			return
+
+		self.agents = list(agents)
+		n = len(self.agents)
+		self.sex = np.fromiter((SEX_INDEX[agent.sex] for agent in self.agents), dtype=np.intp, count=n)
+		self.age = np.fromiter((agent.age for agent in self.agents), dtype=np.intp, count=n)
+		self.imd = np.fromiter((agent.imd for agent in self.agents), dtype=np.intp, count=n)
+		self.cv_chance = np.zeros(n)
+
+	def __len__(self):
+		return len(self.agents)
+
+	# update the risk levels of every agent with update(agent) and read back
+	# their cvd chance. The risk model itself belongs to the agents, so it is
+	# still applied one agent at a time.
+	def update_risk(self, update):
+		for agent in self.agents:
+			update(agent)
+		self.cv_chance = np.fromiter((agent.cv_chance for agent in self.agents), dtype=np.float64, count=len(self.agents))
+
+	# boolean mask of the agents that have a cvd event, the batch version of Agent.test_for_cv
+	def draw_events(self, rng):
+		return rng.random(len(self.agents)) < self.cv_chance
@@ -0,0 +1,73 @@
+import numpy as np
+
+# age groups and sexes used to present CVD incidence in the form of Hippisley-Cox et al., 2017
+AGE_BINS = ['25-29', '30-34', '35-39', '40-44', '45-49', '50-54',
+	'55-59', '60-64', '65-69', '70-74', '75-79', '80-84']
+SEXES = ['M', 'F']
+SEX_INDEX = {sex: s for s, sex in enumerate(SEXES)}
+
+# lookup from age in years to age bin, -1 for ages outside of the table.
+# ages above the end of the lookup are clipped to its last entry, which is -1.
+MAX_AGE = 150
+AGE_BIN_LOOKUP = np.full(MAX_AGE + 1, -1, dtype=np.intp)
+for k in range(len(AGE_BINS)):
+	AGE_BIN_LOOKUP[25 + 5 * k:30 + 5 * k] = k
+
+
+# age bin of a single age, -1 if the age is not tracked
+def age_bin(age):
+	return AGE_BIN_LOOKUP[min(age, MAX_AGE)]
+
+
+# Histogram of counts by sex and age bin, stored as an integer array of
+# shape (sexes, age bins). Used for the number of CVD events and the number
+# of person years in the simulation.
+class Age_Histogram:
+	def __init__(self):
+		self.counts = np.zeros((len(SEXES), len(AGE_BINS)), dtype=np.int64)
+
+	# count a single agent
+	def add(self, sex, age):
+		k = age_bin(age)
+		if k >= 0:
+			self.counts[SEX_INDEX[sex], k] += 1
+
+	# count a whole population at once from arrays of sex indices and ages
+	def add_population(self, sexes, ages):
+		bins = AGE_BIN_LOOKUP[np.minimum(ages, MAX_AGE)]
+		tracked = bins >= 0
+		flat = sexes[tracked] * len(AGE_BINS) + bins[tracked]
+		self.counts += np.bincount(flat, minlength=self.counts.size).reshape(self.counts.shape)
+
+	# total over all age bins for one sex
+	def total(self, sex):
+		return int(self.counts[SEX_INDEX[sex]].sum())
+
+	# nested dictionary [sex][age bin] of plain ints, the layout used before the histogram
+	def as_dict(self):
+		result = dict()
+		for s, sex in enumerate(SEXES):
+			result[sex] = dict(zip(AGE_BINS, self.counts[s].tolist()))
+		return result
+
+
+# rows of the incidence table of a run: per age bin and in total, the incidents,
+# person years and rate per 1000 person years of women and of men
+def incidence_rows(cvd_hist, person_years_hist):
+	incidents = cvd_hist.counts.tolist()
+	years = person_years_hist.counts.tolist()
+	f = SEX_INDEX['F']
+	m = SEX_INDEX['M']
+
+	rows = list()
+	for k, age in enumerate(AGE_BINS):
+		rows.append([age, incidents[f][k], years[f][k], (incidents[f][k] / (years[f][k] / 1000)),
+			incidents[m][k], years[m][k], (incidents[m][k] / (years[m][k] / 1000))])
+
+	total_incidents_f = cvd_hist.total('F')
+	total_person_years_f = person_years_hist.total('F')
+	total_incidents_m = cvd_hist.total('M')
+	total_person_years_m = person_years_hist.total('M')
+	rows.append(["total", total_incidents_f, total_person_years_f, (total_incidents_f / (total_person_years_f / 1000)),
+		total_incidents_m, total_person_years_m, (total_incidents_m / (total_person_years_m / 1000))])
+	return rows
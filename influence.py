@@ -0,0 +1,225 @@
+import numpy as np
+from scipy import sparse
+
+# relationship types and behaviours in the order used by the engine arrays.
+# behaviour names are the lower case keys of inc_inf, the inf_by_rel keys
+# are the capitalised versions.
+RELATIONSHIPS = ['Spouse', 'Household', 'Workplace', 'Friendship']
+BEHAVIOURS = ['smoking', 'alcohol', 'diet', 'inactivity']
+LEVELS = 3
+
+# positions of the relationships and behaviours in the weight tables
+SPOUSE, HOUSEHOLD, WORKPLACE, FRIENDSHIP = range(len(RELATIONSHIPS))
+SMOKING, ALCOHOL, DIET, INACTIVITY = range(len(BEHAVIOURS))
+
+
+# map each workplace type that occurs in the population to a column of the weight tables.
+# only agents with colleagues ever read workplace weights, so only their types are needed.
+def workplace_index(agents):
+	index = dict()
+	for agent in agents:
+		if len(agent.workplace) > 0 and agent.workplace_type not in index:
+			index[agent.workplace_type] = len(index)
+	return index
+
+
+# Compile an inf_by_rel style dictionary into a dense weight table indexed by
+# [relationship][workplace type][behaviour][level]. Only the workplace weights
+# depend on the workplace type, the other relationships are repeated across it.
+def compile_weights(inf_by_rel, wp_index):
+	weights = np.zeros((len(RELATIONSHIPS), max(len(wp_index), 1), len(BEHAVIOURS), LEVELS))
+
+	for r, rel in enumerate(RELATIONSHIPS):
+		if rel == 'Workplace':
+			tables = [(w, inf_by_rel[rel][wtype]) for wtype, w in wp_index.items()]
+		else:
+			tables = [(w, inf_by_rel[rel]) for w in range(weights.shape[1])]
+
+		for w, rel_table in tables:
+			for b, behaviour in enumerate(BEHAVIOURS):
+				for l in range(LEVELS):
+					weights[r, w, b, l] = rel_table[behaviour.capitalize()][l]
+
+	return weights
+
+
+# Compile the weights of the influence groups into one table indexed by
+# [group][relationship][workplace type][behaviour][level]. Group 0 is inf_by_rel,
+# the agents outside any intervention, and groups 1, 2, ... are the intervention
+# groups in the order given.
+def compile_groups(inf_by_rel, groups, wp_index):
+	return np.stack([compile_weights(table, wp_index) for table in [inf_by_rel] + list(groups)])
+
+
+# group of every agent by id, from agent.intervention: False/0 for no intervention,
+# True/1 for the first intervention group, k for the k-th. Removed agents are in group 0.
+def group_index(agents, group_count):
+	groups = np.zeros(len(agents.slots), dtype=np.intp)
+	for agent in agents:
+		group = int(agent.intervention or 0)
+		if group < 0 or group >= group_count:
+			raise ValueError("agent " + str(agent.uid) + " is in intervention group " + str(group)
+				+ " but there are " + str(group_count - 1) + " intervention groups")
+		groups[agent.uid] = group
+	return groups
+
+
+# Build one CSR matrix per relationship type from the agent neighbour lists, where
+# row i lists the agents that influence agent i. agents is indexed by the agents'
+# stable ids, and only the rows of the living agents are filled.
+def build_adjacency(agents, alive):
+	n = len(agents)
+	adjacency = dict()
+
+	for rel in RELATIONSHIPS:
+		rows = []
+		cols = []
+		for i in np.flatnonzero(alive):
+			agent = agents[i]
+			if rel == 'Spouse':
+				neighbours = [agent.spouse] if agent.spouse is not None else []
+			elif rel == 'Household':
+				neighbours = agent.household
+			elif rel == 'Workplace':
+				neighbours = agent.workplace
+			else:
+				neighbours = agent.friends
+
+			for nb in neighbours:
+				rows.append(i)
+				cols.append(nb.uid)
+
+		data = np.ones(len(rows), dtype=np.float64)
+		adjacency[rel] = sparse.csr_matrix((data, (rows, cols)), shape=(n, n))
+
+	return adjacency
+
+
+# bits of the neighbour level patterns used in the contingency tables
+AT_LEVEL = [1 << l for l in range(LEVELS)]
+
+# Contingency table of "which levels do the agent's neighbours have" against
+# "own level" for one relationship and one behaviour, over the living agents.
+# table[pattern, own] counts the agents at level own whose neighbours cover the
+# levels in pattern, where bit l of pattern (AT_LEVEL[l]) is set if at least one
+# neighbour is at level l. Agents without living neighbours have pattern 0.
+def neighbour_contingency(adjacency, levels, alive):
+	n = len(levels)
+	indicators = np.zeros((n, LEVELS))
+	indicators[np.arange(n), levels] = 1.0
+	indicators[~alive] = 0.0
+
+	present = (adjacency @ indicators) > 0
+	pattern = present @ np.array(AT_LEVEL)
+
+	table = np.bincount(pattern[alive] * LEVELS + levels[alive], minlength=(1 << LEVELS) * LEVELS)
+	return table.reshape(1 << LEVELS, LEVELS)
+
+
+# number of agents in a contingency table whose neighbour level pattern satisfies
+# the condition and whose own level is one of own
+def table_count(table, condition, own=range(LEVELS)):
+	total = 0
+	for pattern in range(table.shape[0]):
+		if condition(pattern):
+			total = total + int(table[pattern, list(own)].sum())
+	return total
+
+
+# Array view of a population: the behaviour levels of the agents as int8
+# columns (one row per behaviour), the relationship network as one CSR
+# adjacency matrix per relationship type, and a mask of the living agents.
+# Agents keep the row given by their stable id for the whole run, dead agents
+# are masked out rather than removed from the matrices.
+class Population_Arrays:
+	def __init__(self, agents):
+
+		# agents is an Agent_Store or an agent_table.Agent_Table, whose arrays
+		# are shared rather than copied
+		self.shared = getattr(agents, 'compact', False)
+		if self.shared:
+			self.table = agents
+			self.agents = agents.slots
+			self.alive = agents.alive
+			self.levels = agents.levels
+			self.adjacency = agents.adjacency()
+			return
+
+		self.agents = list(agents.slots)
+		n = len(self.agents)
+
+		self.alive = np.fromiter((agent is not None for agent in self.agents), dtype=bool, count=n)
+		self.levels = np.zeros((len(BEHAVIOURS), n), dtype=np.int8)
+		self.sync_levels()
+
+		self.adjacency = build_adjacency(self.agents, self.alive)
+
+	# copy the current behaviour levels of the living agents into the level
+	# columns, or follow the current level buffer of a shared table
+	def sync_levels(self):
+		if self.shared:
+			self.levels = self.table.levels
+			return
+		living = np.flatnonzero(self.alive)
+		for b, behaviour in enumerate(BEHAVIOURS):
+			attr = behaviour + '_level'
+			self.levels[b, living] = np.fromiter((getattr(self.agents[i], attr) for i in living),
+				dtype=np.int8, count=len(living))
+
+	# remove an agent from the network, its row and column are masked out
+	def remove(self, agent):
+		self.alive[agent.uid] = False
+
+	# agents that are still alive, in their original order
+	def living_agents(self):
+		return [self.agents[i] for i in np.flatnonzero(self.alive)]
+
+	# one-hot encoding of the current levels, shape (n, behaviours * levels).
+	# dead agents have an all-zero row so they exert no influence.
+	def level_indicators(self):
+		n = len(self.agents)
+		indicators = np.zeros((n, len(BEHAVIOURS) * LEVELS))
+		for b in range(len(BEHAVIOURS)):
+			indicators[np.arange(n), b * LEVELS + self.levels[b]] = 1.0
+		indicators[~self.alive] = 0.0
+		return indicators
+
+	# contingency table of neighbour levels against own level for one relationship
+	# and behaviour, see neighbour_contingency
+	def contingency(self, rel, behaviour):
+		return neighbour_contingency(self.adjacency[rel], self.levels[BEHAVIOURS.index(behaviour)], self.alive)
+
+
+# Array-backed replacement for the per-agent neighbour walk in Spread_Model.simulation.
+# The incoming influence of all agents is a sparse matrix product per relationship type:
+# 	inc[i, b, l] = sum over rel of (number of rel-neighbours of i at level l in b) * weight[rel][b][l]
+# which gives the same totals as the inc_inf dictionaries built in the loop.
+class Influence_Engine(Population_Arrays):
+	def __init__(self, agents, group_weights, groups, wp_index):
+		Population_Arrays.__init__(self, agents)
+		self.weights = self.build_weights(group_weights, groups, wp_index)
+
+	# gather the influence weight each agent receives per relationship, behaviour and level
+	# from the weight tables of the groups (see compile_groups), groups is the group of
+	# each agent by id (see group_index). weights[rel] has shape (n, behaviours * levels).
+	def build_weights(self, group_weights, groups, wp_index):
+		n = len(self.agents)
+		living = self.living_agents()
+		wtype = np.zeros(n, dtype=np.intp)
+		wtype[self.alive] = [wp_index.get(agent.workplace_type, 0) for agent in living]
+
+		# (n, relationships, behaviours, levels)
+		gathered = group_weights[groups, :, wtype]
+
+		weights = dict()
+		for r, rel in enumerate(RELATIONSHIPS):
+			weights[rel] = np.ascontiguousarray(gathered[:, r].reshape(n, len(BEHAVIOURS) * LEVELS))
+		return weights
+
+	# incoming influence for every agent, shape (n, behaviours, levels)
+	def incoming_influence(self):
+		indicators = self.level_indicators()
+		inc = np.zeros_like(indicators)
+		for rel in RELATIONSHIPS:
+			inc += (self.adjacency[rel] @ indicators) * self.weights[rel]
+		return inc.reshape(len(self.agents), len(BEHAVIOURS), LEVELS)
@@ -1,25 +1,78 @@
 import random
 import sys 
-import parameters as theparams
-import matplotlib as mpl
-import matplotlib.pyplot as plt
-from pathlib import Path
 import os
-import networkx as nx
 import argparse
+import importlib.util
 import csv
+import logging
 from pathlib import Path
-import pickle
-import parameters
-from agent import Agent
-from network import Network
+import numpy as np
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from influence import Influence_Engine, Population_Arrays, BEHAVIOURS, AT_LEVEL, compile_groups, group_index, workplace_index, table_count
+from influence import SPOUSE, HOUSEHOLD, WORKPLACE, FRIENDSHIP, SMOKING, ALCOHOL, DIET, INACTIVITY
+from incidence import Age_Histogram, AGE_BINS, SEXES, SEX_INDEX, incidence_rows
+from analytics import Analytics_Schedule, cadence_option
+from cvd import Cvd_Columns
+from population import Agent_Store, neighbour_sets, agent_levels
+from agent_table import Agent_Table
+import results_store
+from sinks import Output_Sink, death_record, open_sink
+from random_streams import Random_Streams
+from network_cache import cached_agents, cached_table
+from intervention_groups import read_weights, assign_workplaces
+from checkpoint import write_checkpoint, read_checkpoint, restore_model, checkpoint_path, latest_checkpoint
+from reporting import Progress_Reporter, configure_logging, open_progress
+from timing import Phase_Timer, Null_Timer, profile_run
+from sharding import Sharded_Influence
+
+logger = logging.getLogger(__name__)
+
+# metrics of the analytics schedule of Spread_Model, whose cadences can be set
+ANALYTICS_METRICS = ['avg_cvd', 'prevalence']
 
 class Spread_Model:
-	def __init__(self, agents, inf_by_rel, inter_inf, base_filename):
+	def __init__(self, agents, inf_by_rel, inter_inf, base_filename, array_engine=False, sink=None, keep_history=True, rng=None, batch_cvd=False,
+			analytics=None, progress=None, timing=False, compact=False, rule=None, influence_workers=1):
+
+		# get list of agents, kept in a store with stable ids so agents can be
+		# removed in O(1). Neighbour lists become sets for the same reason, on
+		# the agents themselves (see population.neighbour_sets).
+		# With compact the agents are kept in the typed arrays of an Agent_Table
+		# instead (see agent_table), which the influence step, the analytics and
+		# the metrics read directly; compact runs always use the array engine.
+		# rule is an optional scenarios.Array_Rule that replaces the agents' own
+		# next_*_level and update_risk_levels with vectorised rules. Its next
+		# levels go into the second level buffer of the table, so it needs compact.
+		# Only the synthetic agents of the benchmarks have such rules so far; the
+		# model's agents keep their own rules in compact runs too. Those are
+		# already simultaneous, as the influence is computed from the levels of
+		# all agents before any agent moves, so they do not need the buffer.
+		self.rule = rule
+		if compact or rule is not None or getattr(agents, 'compact', False):
+			self.agents = agents if getattr(agents, 'compact', False) else Agent_Table.from_agents(agents)
+		else:
+			self.agents = Agent_Store(agents)
+			neighbour_sets(self.agents)
+		self.compact = getattr(self.agents, 'compact', False)
+		array_engine = array_engine or self.compact or influence_workers > 1
+
+		# the analytics of every timestep are handed to the sink as soon as they
+		# are produced. Without keep_history only the latest timestep is kept in
+		# memory, which keeps the memory use of long runs bounded.
+		self.sink = sink if sink is not None else Output_Sink()
+		self.keep_history = keep_history
+
+		# numpy Generator for the random numbers the model draws itself, so they
+		# can be drawn in batches. See random_streams for how it is seeded.
+		self.rng = rng if rng is not None else np.random.default_rng()
 
-		# get list of agents
-		self.agents = agents
-		self.population = []
+		# draw the cvd events of all agents at once from self.rng instead of
+		# calling Agent.test_for_cv one agent at a time
+		self.batch_cvd = batch_cvd
+
+		self.population = self.history()
 
 		# inf_by_rel is a dictionary of dictionaries with
 		# following structure:
@@ -32,82 +85,91 @@ class Spread_Model:
 		# get list of influence relationships
 		self.inf_by_rel = inf_by_rel
 
-		# list of influence relationships for workplace intervention
-		self.inter_inf = inter_inf
+		# influence relationships of the intervention groups: one dictionary in
+		# the structure of inf_by_rel for a single group, a list of them for
+		# several groups or None for no intervention
+		if inter_inf is None:
+			self.inter_inf = list()
+		elif isinstance(inter_inf, dict):
+			self.inter_inf = [inter_inf]
+		else:
+			self.inter_inf = list(inter_inf)
+
+		# the influence dictionaries are compiled once into one dense weight table
+		# indexed by [group][relationship][workplace type][behaviour][level], as they
+		# do not change during a run (see compile_groups). Every agent reads the
+		# weights of its own group, given by agent.intervention, and workplace type.
+		self.workplace_index = workplace_index(self.agents)
+		self.group_weights = compile_groups(self.inf_by_rel, self.inter_inf, self.workplace_index)
+		self.groups = group_index(self.agents, len(self.group_weights))
+
+		# the per-agent loop reads nested list copies of the tables indexed
+		# [relationship][behaviour][level], one per agent by id, as indexing a list is
+		# cheaper than indexing into a numpy array one element at a time. Agents of
+		# the same group and workplace type share their table.
+		self.agent_weights = None
+		if not array_engine:
+			tables = self.group_weights.transpose(0, 2, 1, 3, 4).tolist()
+			self.agent_weights = [None] * len(self.agents.slots)
+			for agent in self.agents:
+				self.agent_weights[agent.uid] = tables[self.groups[agent.uid]][self.workplace_index.get(agent.workplace_type, 0)]
 
 		# base filename for output
 		self.base_filename = base_filename
 
-		# storing the list of dead agents
-		self.deceased = dict()
+		# optional array-backed engine that computes the incoming influence of
+		# all agents at once instead of walking the neighbours of each agent
+		self.engine = None
+		if array_engine:
+			self.engine = Influence_Engine(self.agents, self.group_weights, self.groups, self.workplace_index)
+
+		# array view of the population used for the neighbour metrics, the engine
+		# already is one
+		self.arrays = self.engine
+
+		# with more than one influence worker the influence step of every timestep
+		# is split over that many processes while simulation runs, see sharding
+		self.influence_workers = influence_workers
+		self.shards = None
 
-		self.avg_cvd = list()
-		self.behaviour_prevalence = list()
-		self.cvd_demographics = list()
-
-		# dictionary to track number of cvd events to enable presentation in the form of Hippisley-Cox et al., 2017
-		self.cvd_count = dict()
-
-		self.cvd_count['M'] = {}
-		self.cvd_count['F'] = {}
-
-		self.cvd_count['M']['25-29'] = 0
-		self.cvd_count['M']['30-34'] = 0
-		self.cvd_count['M']['35-39'] = 0
-		self.cvd_count['M']['40-44'] = 0
-		self.cvd_count['M']['45-49'] = 0
-		self.cvd_count['M']['50-54'] = 0
-		self.cvd_count['M']['55-59'] = 0
-		self.cvd_count['M']['60-64'] = 0
-		self.cvd_count['M']['65-69'] = 0
-		self.cvd_count['M']['70-74'] = 0
-		self.cvd_count['M']['75-79'] = 0
-		self.cvd_count['M']['80-84'] = 0
-
-		self.cvd_count['F']['25-29'] = 0
-		self.cvd_count['F']['30-34'] = 0
-		self.cvd_count['F']['35-39'] = 0
-		self.cvd_count['F']['40-44'] = 0
-		self.cvd_count['F']['45-49'] = 0
-		self.cvd_count['F']['50-54'] = 0
-		self.cvd_count['F']['55-59'] = 0
-		self.cvd_count['F']['60-64'] = 0
-		self.cvd_count['F']['65-69'] = 0
-		self.cvd_count['F']['70-74'] = 0
-		self.cvd_count['F']['75-79'] = 0
-		self.cvd_count['F']['80-84'] = 0
-
-		# dictionary to track number of person years in simulation to enable presentation in the form of Hippisley-Cox et al., 2017
-		self.person_years = dict()
-
-		self.person_years['M'] = {}
-		self.person_years['F'] = {}
-
-		self.person_years['M']['25-29'] = 0
-		self.person_years['M']['30-34'] = 0
-		self.person_years['M']['35-39'] = 0
-		self.person_years['M']['40-44'] = 0
-		self.person_years['M']['45-49'] = 0
-		self.person_years['M']['50-54'] = 0
-		self.person_years['M']['55-59'] = 0
-		self.person_years['M']['60-64'] = 0
-		self.person_years['M']['65-69'] = 0
-		self.person_years['M']['70-74'] = 0
-		self.person_years['M']['75-79'] = 0
-		self.person_years['M']['80-84'] = 0
-
-		self.person_years['F']['25-29'] = 0
-		self.person_years['F']['30-34'] = 0
-		self.person_years['F']['35-39'] = 0
-		self.person_years['F']['40-44'] = 0
-		self.person_years['F']['45-49'] = 0
-		self.person_years['F']['50-54'] = 0
-		self.person_years['F']['55-59'] = 0
-		self.person_years['F']['60-64'] = 0
-		self.person_years['F']['65-69'] = 0
-		self.person_years['F']['70-74'] = 0
-		self.person_years['F']['75-79'] = 0
-		self.person_years['F']['80-84'] = 0
+		# next timestep to run, so a simulation restored from a checkpoint carries on from there
+		self.timestep = 0
+
+		# storing lightweight records of the dead agents by timestep
+		self.deceased = dict()
+		self.total_deaths = 0
+
+		self.avg_cvd = self.history()
+		self.behaviour_prevalence = self.history()
+		self.cvd_demographics = self.history()
+
+		# metrics computed by analytics and how often, analytics is a dictionary
+		# of cadences by metric name overriding the defaults
+		self.schedule = Analytics_Schedule()
+		self.schedule.register('avg_cvd', Spread_Model.average_cvd_risk)
+		self.schedule.register('prevalence', Spread_Model.prevalence)
+		for name, cadence in (analytics or dict()).items():
+			self.schedule.set_cadence(name, cadence)
+		self.metric_history = dict()
+
+		# reports the progress of the simulation, see reporting
+		self.progress = progress if progress is not None else Progress_Reporter()
+
+		# per-phase wall clock time and counters of every timestep, see timing
+		self.timer = Phase_Timer() if timing else Null_Timer()
+
+		# running counts of the agents at each level [behaviour][level] and the sum
+		# of their cvd chances. They are updated when the levels or the risk of an
+		# agent change and when an agent dies, so prevalence and average cvd risk
+		# are read without going over the population.
+		self.level_counts = [[0] * 3 for behaviour in BEHAVIOURS]
+		self.cvd_sum = 0.0
+		self.recount()
+
+		# histograms [sex][age bin] of the number of cvd events and the number of person
+		# years in the simulation, to enable presentation in the form of Hippisley-Cox et al., 2017
+		self.cvd_hist = Age_Histogram()
+		self.person_years_hist = Age_Histogram()
 
 		# dictionary of the Hippisley-Cox et al., 2017 data
 		self.score_grid = dict()
@@ -140,12 +202,75 @@ class Spread_Model:
 		self.score_grid['F']['75-79'] = 351.1
 		self.score_grid['F']['80-84'] = 480.2
 
+		# score grid as an array in the layout of the histograms
+		self.score_array = np.array([[self.score_grid[sex][age] for age in AGE_BINS] for sex in SEXES])
+
+	# list for a per-timestep history, only holding the latest entry without keep_history
+	def history(self):
+		if self.keep_history:
+			return list()
+		return deque(maxlen=1)
+
+	# number of cvd events as a dictionary [sex][age bin]
+	@property
+	def cvd_count(self):
+		return self.cvd_hist.as_dict()
+
+	# number of person years as a dictionary [sex][age bin]
+	@property
+	def person_years(self):
+		return self.person_years_hist.as_dict()
+
 	# Method will remove the agent from our simulation
-	# we store the agent in a list, for use in analysis
-	# we also record some information of the dead agent for later use
+	# we store a record of the agent, for use in analysis
+	# we also record some information of the dead agent for later use.
+	# Must not be called while iterating over self.agents, see simulation.
 	def agent_death(self, agent, t, cvd_metrics):
+		self.remove_agent(agent, t)
+
+		cvd_metrics[agent.sex] = cvd_metrics[agent.sex] + 1
+
+		imd_level = 'imd' + str(agent.imd)
+		cvd_metrics[imd_level] = cvd_metrics[imd_level] + 1
+
+		cvd_metrics['avg_age'] = cvd_metrics['avg_age'] + agent.age
+
+		self.cvd_hist.add(agent.sex, agent.age)
+
+	# agent_death for many agents at once, with their sex indices, imds and
+	# ages as arrays (see cvd.Cvd_Columns)
+	def agent_deaths(self, agents, t, cvd_metrics, sexes, imds, ages):
+		for agent in agents:
+			self.remove_agent(agent, t)
+
+		for sex, count in zip(SEXES, np.bincount(sexes, minlength=len(SEXES)).tolist()):
+			cvd_metrics[sex] = cvd_metrics[sex] + count
+
+		for imd, count in enumerate(np.bincount(imds, minlength=6).tolist()):
+			if count > 0:
+				imd_level = 'imd' + str(imd)
+				cvd_metrics[imd_level] = cvd_metrics.get(imd_level, 0) + count
+
+		cvd_metrics['avg_age'] = cvd_metrics['avg_age'] + int(ages.sum())
+
+		self.cvd_hist.add_population(sexes, ages)
+
+	# remove a dead agent from the store, the array view and its neighbours,
+	# keeping a record of it
+	def remove_agent(self, agent, t):
 		self.agents.remove(agent)
-		self.deceased[t].append(agent)
+		for b, level in enumerate(agent_levels(agent)):
+			self.level_counts[b][level] = self.level_counts[b][level] - 1
+		self.cvd_sum = self.cvd_sum - agent.cv_chance
+		self.deceased[t].append(death_record(agent, t))
+		self.total_deaths = self.total_deaths + 1
+
+		if self.arrays is not None:
+			self.arrays.remove(agent)
+
+		# the neighbours of compact agents are masked by the table instead
+		if self.compact:
+			return
 
 		if agent.spouse is not None:
 			agent.spouse.spouse = None
@@ -159,478 +284,480 @@ class Spread_Model:
 		for f in agent.friends:
 			f.friends.remove(agent)
 
-		cvd_metrics[agent.sex] = cvd_metrics[agent.sex] + 1
-
-		imd_level = 'imd' + str(agent.imd)
-		cvd_metrics[imd_level] = cvd_metrics[imd_level] + 1
-
-		cvd_metrics['avg_age'] = cvd_metrics['avg_age'] + agent.age
-
-		if agent.age >= 25:
-			if agent.age <= 29:
-				self.cvd_count[agent.sex]['25-29'] = self.cvd_count[agent.sex]['25-29'] + 1
-			elif agent.age <= 34:
-				self.cvd_count[agent.sex]['30-34'] = self.cvd_count[agent.sex]['30-34'] + 1
-			elif agent.age <= 39:
-				self.cvd_count[agent.sex]['35-39'] = self.cvd_count[agent.sex]['35-39'] + 1
-			elif agent.age <= 44:
-				self.cvd_count[agent.sex]['40-44'] = self.cvd_count[agent.sex]['40-44'] + 1
-			elif agent.age <= 49:
-				self.cvd_count[agent.sex]['45-49'] = self.cvd_count[agent.sex]['45-49'] + 1
-			elif agent.age <= 54:
-				self.cvd_count[agent.sex]['50-54'] = self.cvd_count[agent.sex]['50-54'] + 1
-			elif agent.age <= 59:
-				self.cvd_count[agent.sex]['55-59'] = self.cvd_count[agent.sex]['55-59'] + 1
-			elif agent.age <= 64:
-				self.cvd_count[agent.sex]['60-64'] = self.cvd_count[agent.sex]['60-64'] + 1
-			elif agent.age <= 69:
-				self.cvd_count[agent.sex]['65-69'] = self.cvd_count[agent.sex]['65-69'] + 1
-			elif agent.age <= 74:
-				self.cvd_count[agent.sex]['70-74'] = self.cvd_count[agent.sex]['70-74'] + 1
-			elif agent.age <= 79:
-				self.cvd_count[agent.sex]['75-79'] = self.cvd_count[agent.sex]['75-79'] + 1
-			elif agent.age <= 84:
-				self.cvd_count[agent.sex]['80-84'] = self.cvd_count[agent.sex]['80-84'] + 1
-
 
 	def eval_params(self):
-		modelScore = 0
-		negScore = 0
-		posScore = 0
-
-		for g in self.cvd_count.keys():
-			for a in self.cvd_count[g].keys():
-				perThousandYear = (self.cvd_count[g][a] / self.person_years[g][a]) * 1000
-				diff = perThousandYear - self.score_grid[g][a]
-				modelScore = modelScore + abs(diff)
-				if diff < 0:
-					negScore = negScore + diff
-				else:
-					posScore = posScore + diff
-					
-
-		return [modelScore, negScore, posScore]
+		rates = (self.cvd_hist.counts / self.person_years_hist.counts) * 1000
+		return score_differences((rates - self.score_array).ravel().tolist())
+
+	# eval_params on the incidence of the timesteps run so far, for deciding
+	# whether a run is worth finishing. Age groups without any person years yet
+	# are left out.
+	def running_score(self):
+		tracked = self.person_years_hist.counts > 0
+		rates = (self.cvd_hist.counts[tracked] / self.person_years_hist.counts[tracked]) * 1000
+		return score_differences((rates - self.score_array[tracked]).tolist())
 
 	# Method to calculate request metrics between each time step - can be
 	# put into plots at the end of the simulation.
-	def analytics(self, i):
-
-		# average CVD risk for all currently living agents
+	# Only the metrics that are due after timestep i are computed, see
+	# analytics.Analytics_Schedule. Average CVD risk and behaviour prevalence
+	# are nan in the histories for the timesteps they are not computed, other
+	# registered metrics are kept in self.metric_history as (i, value) pairs.
+	def analytics(self, i, final=False):
+		logger.debug("Number of agents: %d", len(self.agents))
+		values = self.schedule.run(self, i, final)
+
+		self.avg_cvd.append(values.pop('avg_cvd', float('nan')))
+		self.behaviour_prevalence.append(values.pop('prevalence', {behaviour: [float('nan')] * 3 for behaviour in BEHAVIOURS}))
+
+		for name, value in values.items():
+			if name not in self.metric_history:
+				self.metric_history[name] = self.history()
+			self.metric_history[name].append((i, value))
+
+	# average CVD risk for all currently living agents
+	def average_cvd_risk(self, i=None):
+		return self.cvd_sum / len(self.agents)
+
+	# prevalence of each behaviour level, [behaviour][level]
+	def prevalence(self, i=None):
+		population = len(self.agents)
+		return {behaviour: [count / population for count in self.level_counts[b]] for b, behaviour in enumerate(BEHAVIOURS)}
+
+	# count the levels and sum the cvd chances of the whole population again,
+	# e.g. after the agents were changed outside of the simulation
+	def recount(self):
+		if self.compact:
+			alive = self.agents.alive
+			self.level_counts = [np.bincount(self.agents.levels[b, alive], minlength=3).tolist() for b in range(len(BEHAVIOURS))]
+			self.cvd_sum = sum(self.agents.columns['cv_chance'][alive].tolist())
+			return
+
+		self.level_counts = [[0] * 3 for behaviour in BEHAVIOURS]
 		cvd_total = 0
-
-		# tracking prevalence of specific behaviours in each time step
-		behaviour_count = {'smoking': [0,0,0], 'inactivity':[0,0,0], 'diet':[0,0,0], 'alcohol': [0,0,0]}
-
-		# track prevalence of each behaviour level
-		print("Number of agents: " + str(len(self.agents)))
 		for agent in self.agents:
+			for b, level in enumerate(agent_levels(agent)):
+				self.level_counts[b][level] = self.level_counts[b][level] + 1
 			cvd_total = cvd_total + agent.cv_chance
+		self.cvd_sum = cvd_total
 
-			behaviour_count['smoking'][agent.smoking_level] = behaviour_count['smoking'][agent.smoking_level] + 1
-			behaviour_count['inactivity'][agent.inactivity_level] = behaviour_count['inactivity'][agent.inactivity_level] + 1
-			behaviour_count['diet'][agent.diet_level] = behaviour_count['diet'][agent.diet_level] + 1
-			behaviour_count['alcohol'][agent.alcohol_level] = behaviour_count['alcohol'][agent.alcohol_level] + 1
+	# update the risk levels of an agent, which moves it to its next behaviour
+	# levels, and keep the running counts up to date
+	def update_risk(self, agent):
+		levels = agent_levels(agent)
+		cv_chance = agent.cv_chance
 
+		agent.update_risk_levels()
 
-		cvd_total = cvd_total / len(self.agents)
-		self.avg_cvd.append(cvd_total)
-
-		for i in range(3):
-			behaviour_count['smoking'][i] = behaviour_count['smoking'][i] / len(self.agents)
-			behaviour_count['inactivity'][i] = behaviour_count['inactivity'][i] / len(self.agents)
-			behaviour_count['diet'][i] = behaviour_count['diet'][i] / len(self.agents)
-			behaviour_count['alcohol'][i] = behaviour_count['alcohol'][i] / len(self.agents)
-
-		self.behaviour_prevalence.append(behaviour_count)
+		new_levels = agent_levels(agent)
+		if new_levels != levels:
+			for b in range(len(BEHAVIOURS)):
+				if new_levels[b] != levels[b]:
+					self.level_counts[b][levels[b]] = self.level_counts[b][levels[b]] - 1
+					self.level_counts[b][new_levels[b]] = self.level_counts[b][new_levels[b]] + 1
+		self.cvd_sum = self.cvd_sum + (agent.cv_chance - cv_chance)
 
 	# 
 	def print_cvd_incidence_rates(self):
 		print("x")
 
 
-	#record and save key metrics on behaviour prevalence for comparion to real world data
-	def save_behaviour_metrics(self):
-
-		lvl12_drink_lvl2_housemate = 0
-		lvl0_drink_lvl2_housemate = 0
-		lvl12_drink_lvl01_housemate = 0
-		lvl0_drink_lvl01_housemate = 0
-
-		ex_smoker_hm_quit = 0
-		ex_smoker_hm_smokes = 0
-		smoker_hm_quit = 0
-		smoker_hm_smokes = 0
-
-		lvl12_drink_lvl2_spouse = 0
-		lvl0_drink_lvl2_spouse = 0
-		lvl12_drink_lvl01_spouse = 0
-		lvl0_drink_lvl01_spouse = 0
-
-		ex_smoker_spouse_quit = 0
-		ex_smoker_spouse_smokes = 0
-		smoker_spouse_quit = 0
-		smoker_spouse_smokes = 0
-
-		ex_smoker_friend_quit = 0
-		ex_smoker_friend_smokes = 0
-		smoker_friend_quit = 0
-		smoker_friend_smokes = 0
-
-		active_spouse_exercises = 0
-		inactive_spouse_exercises = 0
-		active_spouse_inactive = 0
-		inactive_spouse_inactive = 0
-
-		active_friend_exercises = 0
-		inactive_friend_exercises = 0
-		active_friend_inactive = 0
-		inactive_friend_inactive = 0
-		
-		for agent in self.agents:
-
-			hm_lvl2_alc = False
-			hm_lvl1_smo = False
-			hm_lvl2_smo = False
-
-			for hm in agent.household:
-				if hm.alcohol_level == 2:
-					hm_lvl2_alc = True 
-
-				if hm.smoking_level == 1:
-					hm_lvl1_smo = True
-				elif hm.smoking_level == 2:
-					hm_lvl2_smo = True
-
-			if hm_lvl2_alc and agent.alcohol_level > 0:
-				lvl12_drink_lvl2_housemate = lvl12_drink_lvl2_housemate + 1
-			elif hm_lvl2_alc and agent.alcohol_level == 0:
-				lvl0_drink_lvl2_housemate = lvl0_drink_lvl2_housemate + 1
-			elif not hm_lvl2_alc and agent.alcohol_level > 0:
-				lvl12_drink_lvl01_housemate = lvl12_drink_lvl01_housemate + 1
-			else:
-				lvl0_drink_lvl01_housemate = lvl0_drink_lvl01_housemate + 1
-
-			if hm_lvl1_smo and agent.smoking_level == 1:
-				ex_smoker_hm_quit = ex_smoker_hm_quit + 1
-			elif hm_lvl1_smo and agent.smoking_level == 2:
-				ex_smoker_hm_smokes = ex_smoker_hm_smokes + 1
-			elif hm_lvl2_smo and agent.smoking_level == 1:
-				smoker_hm_quit = smoker_hm_quit + 1
-			elif hm_lvl2_smo and agent.smoking_level == 2:
-				smoker_hm_smokes = smoker_hm_smokes + 1
-
-			if agent.spouse is not None:
-				if agent.spouse.alcohol_level == 2 and agent.alcohol_level > 0:
-					lvl12_drink_lvl2_spouse = lvl12_drink_lvl2_spouse + 1
-				elif agent.spouse.alcohol_level == 2 and agent.alcohol_level == 0:
-					lvl0_drink_lvl2_spouse = lvl0_drink_lvl2_spouse + 1
-				elif agent.spouse.alcohol_level < 2 and agent.alcohol_level > 0:
-					lvl12_drink_lvl01_spouse = lvl12_drink_lvl01_spouse + 1
-				else:
-					lvl0_drink_lvl01_spouse = lvl0_drink_lvl01_spouse + 1
-
-				if agent.spouse.smoking_level == 1 and agent.smoking_level == 1:
-					ex_smoker_spouse_quit = ex_smoker_spouse_quit + 1
-				elif agent.spouse.smoking_level == 2 and agent.smoking_level == 1:
-					ex_smoker_spouse_smokes = ex_smoker_spouse_smokes + 1
-				elif agent.spouse.smoking_level == 1 and agent.smoking_level == 2:
-					smoker_spouse_quit = smoker_spouse_quit + 1
-				elif agent.spouse.smoking_level == 2 and agent.smoking_level == 2:
-					smoker_spouse_smokes = smoker_spouse_smokes + 1
-
-				if agent.spouse.inactivity_level < 2 and agent.inactivity_level < 2:
-					active_spouse_exercises = active_spouse_exercises + 1
-				elif agent.spouse.inactivity_level == 2 and agent.inactivity_level < 2:
-					active_spouse_inactive = active_spouse_inactive + 1
-				elif agent.spouse.inactivity_level < 2 and agent.inactivity_level == 2:
-					inactive_spouse_exercises = inactive_spouse_exercises + 1
-				elif agent.spouse.inactivity_level == 2 and agent.inactivity_level == 2:
-					inactive_spouse_exercises = inactive_spouse_inactive + 1
-			
-			friend_lvl1_smo = False
-			friend_lvl2_smo = False
-			friend_lvl2_act = False
-
-			for f in agent.friends:
-				if f.smoking_level == 1:
-					friend_lvl1_smo = True
-				elif f.smoking_level == 2:
-					friend_lvl2_smo = True
-
-				if f.inactivity_level == 2:
-					friend_lvl2_act = True
-
-			if friend_lvl1_smo and agent.smoking_level == 1:
-				ex_smoker_friend_quit = ex_smoker_friend_quit + 1
-			elif friend_lvl1_smo and agent.smoking_level == 2:
-				ex_smoker_friend_smokes = ex_smoker_friend_smokes + 1
-			elif friend_lvl2_smo and agent.smoking_level == 1:
-				smoker_friend_quit = smoker_friend_quit + 1
-			elif friend_lvl2_smo and agent.smoking_level == 2:
-				smoker_friend_smokes = smoker_friend_smokes + 1
-
-			if not friend_lvl2_act and agent.inactivity_level < 2:
-				active_friend_exercises = active_friend_exercises + 1
-			elif not friend_lvl2_act and agent.inactivity_level == 2:
-				inactive_friend_exercises = inactive_friend_exercises + 1
-			elif friend_lvl2_act and agent.inactivity_level < 2:
-				active_friend_inactive = active_friend_inactive + 1
-			elif friend_lvl2_act and agent.inactivity_level == 2:
-				inactive_friend_inactive = inactive_friend_inactive + 1
-
-
-		housemate_lvl2_drink_rate = lvl12_drink_lvl2_housemate / (lvl12_drink_lvl2_housemate + lvl0_drink_lvl2_housemate)
-		housemate_lvl0_drink_rate = lvl12_drink_lvl01_housemate / (lvl12_drink_lvl01_housemate + lvl0_drink_lvl01_housemate)
-		housemate_lvl2_abstain_rate = lvl0_drink_lvl2_housemate / (lvl12_drink_lvl2_housemate + lvl0_drink_lvl2_housemate)
-		housemate_lvl0_abstain_rate = lvl0_drink_lvl01_housemate / (lvl12_drink_lvl01_housemate + lvl0_drink_lvl01_housemate)
-
-		hm_quit_inf_quit = ex_smoker_hm_quit / (ex_smoker_hm_quit + ex_smoker_hm_smokes)
-		hm_smoke_inf_quit = ex_smoker_hm_smokes / (ex_smoker_hm_quit + ex_smoker_hm_smokes)
-		hm_quit_inf_smoke = smoker_hm_quit / (smoker_hm_quit + smoker_hm_smokes)
-		hm_smoke_inf_smoke = smoker_hm_smokes / (smoker_hm_quit + smoker_hm_smokes)
-
-		spouse_lvl2_drink_rate = lvl12_drink_lvl2_spouse / (lvl12_drink_lvl2_spouse + lvl0_drink_lvl2_spouse)
-		spouse_lvl0_drink_rate = lvl12_drink_lvl01_spouse / (lvl12_drink_lvl01_spouse + lvl0_drink_lvl01_spouse)
-		spouse_lvl2_abstain_rate = lvl0_drink_lvl2_spouse / (lvl12_drink_lvl2_spouse + lvl0_drink_lvl2_spouse)
-		spouse_lvl0_abstain_rate = lvl0_drink_lvl01_spouse / (lvl12_drink_lvl01_spouse + lvl0_drink_lvl01_spouse)
-
-		spouse_quit_inf_quit = ex_smoker_spouse_quit / (ex_smoker_spouse_quit + ex_smoker_spouse_smokes)
-		spouse_smoke_inf_quit = ex_smoker_spouse_smokes / (ex_smoker_spouse_quit + ex_smoker_spouse_smokes)
-		spouse_quit_inf_smoke = smoker_spouse_quit / (smoker_spouse_quit + smoker_spouse_smokes)
-		spouse_smoke_inf_smoke = smoker_spouse_smokes / (smoker_spouse_quit + smoker_spouse_smokes)
-
-		spouse_active_inf_active = active_spouse_exercises / (active_spouse_exercises + active_spouse_inactive)
-		spouse_active_inf_inactive = inactive_spouse_exercises / (inactive_spouse_exercises + inactive_spouse_inactive)
-		spouse_inactive_inf_active =  active_spouse_inactive / (active_spouse_exercises + active_spouse_inactive)
-		spouse_inactive_inf_inactive = inactive_spouse_inactive / (inactive_spouse_exercises + inactive_spouse_inactive)
-
-		friend_quit_inf_quit = ex_smoker_friend_quit / (ex_smoker_friend_quit + ex_smoker_friend_smokes)
-		friend_smoke_inf_quit = ex_smoker_friend_smokes / (ex_smoker_friend_quit + ex_smoker_friend_smokes)
-		friend_quit_inf_smoke = smoker_friend_quit / (smoker_friend_quit + smoker_friend_smokes)
-		friend_smoke_inf_smoke = smoker_friend_smokes / (smoker_friend_quit + smoker_friend_smokes)
-
-		friend_active_inf_active = active_friend_exercises / (active_friend_exercises + active_friend_inactive)
-		friend_active_inf_inactive = inactive_friend_exercises / (inactive_friend_exercises + inactive_friend_inactive)
-		friend_inactive_inf_active =  active_friend_inactive / (active_friend_exercises + active_friend_inactive)
-		friend_inactive_inf_inactive = inactive_friend_inactive / (inactive_friend_exercises + inactive_friend_inactive)
-
-		met_list = list()
+	# array view of the population and its network, shared with the array engine
+	# when it is used and built on first use otherwise
+	def population_arrays(self):
+		if self.arrays is None:
+			self.arrays = Population_Arrays(self.agents)
+		else:
+			self.arrays.sync_levels()
+		return self.arrays
+
+	# rates describing how agents' behaviour relates to that of their housemates,
+	# spouse and friends, as a list of (label, value) pairs. Computed from
+	# contingency tables of "any neighbour of type R at level L" against "own
+	# level", so it can be called at any timestep.
+	def neighbour_metrics(self):
+		arrays = self.population_arrays()
+
+		has_0 = lambda pattern: pattern & AT_LEVEL[0] != 0
+		has_1 = lambda pattern: pattern & AT_LEVEL[1] != 0
+		has_2 = lambda pattern: pattern & AT_LEVEL[2] != 0
+		# the precedence of the original per-agent checks: a level 1 neighbour wins over a level 2 one
+		only_2 = lambda pattern: has_2(pattern) and not has_1(pattern)
+		# a spouse is at most one neighbour, pattern 0 means no spouse
+		below_2 = lambda pattern: pattern != 0 and not has_2(pattern)
+		without_2 = lambda pattern: not has_2(pattern)
+
+		hm_alc = arrays.contingency('Household', 'alcohol')
+		lvl12_drink_lvl2_housemate = table_count(hm_alc, has_2, own=[1, 2])
+		lvl0_drink_lvl2_housemate = table_count(hm_alc, has_2, own=[0])
+		lvl12_drink_lvl01_housemate = table_count(hm_alc, without_2, own=[1, 2])
+		lvl0_drink_lvl01_housemate = table_count(hm_alc, without_2, own=[0])
+
+		hm_smo = arrays.contingency('Household', 'smoking')
+		ex_smoker_hm_quit = table_count(hm_smo, has_1, own=[1])
+		ex_smoker_hm_smokes = table_count(hm_smo, has_1, own=[2])
+		smoker_hm_quit = table_count(hm_smo, only_2, own=[1])
+		smoker_hm_smokes = table_count(hm_smo, only_2, own=[2])
+
+		spouse_alc = arrays.contingency('Spouse', 'alcohol')
+		lvl12_drink_lvl2_spouse = table_count(spouse_alc, has_2, own=[1, 2])
+		lvl0_drink_lvl2_spouse = table_count(spouse_alc, has_2, own=[0])
+		lvl12_drink_lvl01_spouse = table_count(spouse_alc, below_2, own=[1, 2])
+		lvl0_drink_lvl01_spouse = table_count(spouse_alc, below_2, own=[0])
+
+		spouse_smo = arrays.contingency('Spouse', 'smoking')
+		ex_smoker_spouse_quit = table_count(spouse_smo, has_1, own=[1])
+		ex_smoker_spouse_smokes = table_count(spouse_smo, has_2, own=[1])
+		smoker_spouse_quit = table_count(spouse_smo, has_1, own=[2])
+		smoker_spouse_smokes = table_count(spouse_smo, has_2, own=[2])
+
+		spouse_act = arrays.contingency('Spouse', 'inactivity')
+		active_spouse_exercises = table_count(spouse_act, below_2, own=[0, 1])
+		active_spouse_inactive = table_count(spouse_act, has_2, own=[0, 1])
+		inactive_spouse_exercises = table_count(spouse_act, below_2, own=[2])
+		inactive_spouse_inactive = table_count(spouse_act, has_2, own=[2])
+
+		friend_smo = arrays.contingency('Friendship', 'smoking')
+		ex_smoker_friend_quit = table_count(friend_smo, has_1, own=[1])
+		ex_smoker_friend_smokes = table_count(friend_smo, has_1, own=[2])
+		smoker_friend_quit = table_count(friend_smo, only_2, own=[1])
+		smoker_friend_smokes = table_count(friend_smo, only_2, own=[2])
+
+		friend_act = arrays.contingency('Friendship', 'inactivity')
+		active_friend_exercises = table_count(friend_act, without_2, own=[0, 1])
+		inactive_friend_exercises = table_count(friend_act, without_2, own=[2])
+		active_friend_inactive = table_count(friend_act, has_2, own=[0, 1])
+		inactive_friend_inactive = table_count(friend_act, has_2, own=[2])
+
+		housemate_lvl2_drink_rate = proportion(lvl12_drink_lvl2_housemate, lvl12_drink_lvl2_housemate + lvl0_drink_lvl2_housemate)
+		housemate_lvl0_drink_rate = proportion(lvl12_drink_lvl01_housemate, lvl12_drink_lvl01_housemate + lvl0_drink_lvl01_housemate)
+		housemate_lvl2_abstain_rate = proportion(lvl0_drink_lvl2_housemate, lvl12_drink_lvl2_housemate + lvl0_drink_lvl2_housemate)
+		housemate_lvl0_abstain_rate = proportion(lvl0_drink_lvl01_housemate, lvl12_drink_lvl01_housemate + lvl0_drink_lvl01_housemate)
+
+		hm_quit_inf_quit = proportion(ex_smoker_hm_quit, ex_smoker_hm_quit + ex_smoker_hm_smokes)
+		hm_smoke_inf_quit = proportion(ex_smoker_hm_smokes, ex_smoker_hm_quit + ex_smoker_hm_smokes)
+		hm_quit_inf_smoke = proportion(smoker_hm_quit, smoker_hm_quit + smoker_hm_smokes)
+		hm_smoke_inf_smoke = proportion(smoker_hm_smokes, smoker_hm_quit + smoker_hm_smokes)
+
+		spouse_lvl2_drink_rate = proportion(lvl12_drink_lvl2_spouse, lvl12_drink_lvl2_spouse + lvl0_drink_lvl2_spouse)
+		spouse_lvl0_drink_rate = proportion(lvl12_drink_lvl01_spouse, lvl12_drink_lvl01_spouse + lvl0_drink_lvl01_spouse)
+		spouse_lvl2_abstain_rate = proportion(lvl0_drink_lvl2_spouse, lvl12_drink_lvl2_spouse + lvl0_drink_lvl2_spouse)
+		spouse_lvl0_abstain_rate = proportion(lvl0_drink_lvl01_spouse, lvl12_drink_lvl01_spouse + lvl0_drink_lvl01_spouse)
+
+		spouse_quit_inf_quit = proportion(ex_smoker_spouse_quit, ex_smoker_spouse_quit + ex_smoker_spouse_smokes)
+		spouse_smoke_inf_quit = proportion(ex_smoker_spouse_smokes, ex_smoker_spouse_quit + ex_smoker_spouse_smokes)
+		spouse_quit_inf_smoke = proportion(smoker_spouse_quit, smoker_spouse_quit + smoker_spouse_smokes)
+		spouse_smoke_inf_smoke = proportion(smoker_spouse_smokes, smoker_spouse_quit + smoker_spouse_smokes)
+
+		spouse_active_inf_active = proportion(active_spouse_exercises, active_spouse_exercises + active_spouse_inactive)
+		spouse_active_inf_inactive = proportion(inactive_spouse_exercises, inactive_spouse_exercises + inactive_spouse_inactive)
+		spouse_inactive_inf_active = proportion(active_spouse_inactive, active_spouse_exercises + active_spouse_inactive)
+		spouse_inactive_inf_inactive = proportion(inactive_spouse_inactive, inactive_spouse_exercises + inactive_spouse_inactive)
+
+		friend_quit_inf_quit = proportion(ex_smoker_friend_quit, ex_smoker_friend_quit + ex_smoker_friend_smokes)
+		friend_smoke_inf_quit = proportion(ex_smoker_friend_smokes, ex_smoker_friend_quit + ex_smoker_friend_smokes)
+		friend_quit_inf_smoke = proportion(smoker_friend_quit, smoker_friend_quit + smoker_friend_smokes)
+		friend_smoke_inf_smoke = proportion(smoker_friend_smokes, smoker_friend_quit + smoker_friend_smokes)
+
+		friend_active_inf_active = proportion(active_friend_exercises, active_friend_exercises + active_friend_inactive)
+		friend_active_inf_inactive = proportion(inactive_friend_exercises, inactive_friend_exercises + inactive_friend_inactive)
+		friend_inactive_inf_active = proportion(active_friend_inactive, active_friend_exercises + active_friend_inactive)
+		friend_inactive_inf_inactive = proportion(inactive_friend_inactive, inactive_friend_exercises + inactive_friend_inactive)
+
+		metrics = list()
+
+		metrics.append(("Proportion of lvl1 or lvl2 alcohol with lvl2 housemates", housemate_lvl2_drink_rate))
+		metrics.append(("Proportion of lvl1 or lvl2 alcohol with lvl0 or lvl1 housemates", housemate_lvl0_drink_rate))
+		metrics.append(("Proportion of lvl0 alcohol with lvl2 housemates", housemate_lvl2_abstain_rate))
+		metrics.append(("Proportion of lvl0 alcohol with lvl0 or lvl1 housemates", housemate_lvl0_abstain_rate))
+
+		metrics.append(("Proportion of lvl1 or lvl2 alcohol with lvl2 spouse", spouse_lvl2_drink_rate))
+		metrics.append(("Proportion of lvl1 or lvl2 alcohol with lvl0 or lvl1 spouse", spouse_lvl0_drink_rate))
+		metrics.append(("Proportion of lvl0 alcohol with lvl2 spouse", spouse_lvl2_abstain_rate))
+		metrics.append(("Proportion of lvl0 alcohol with lvl0 or lvl1 spouse", spouse_lvl0_abstain_rate))
+
+		metrics.append(("Proportion of lvl1 smoking with lvl1 housemates", hm_quit_inf_quit))
+		metrics.append(("Proportion of lvl2 smoking with lvl1 housemates", hm_quit_inf_smoke))
+		metrics.append(("Proportion of lvl1 smoking with lvl2 housemates", hm_smoke_inf_quit))
+		metrics.append(("Proportion of lvl2 smoking with lvl2 housemates", hm_smoke_inf_smoke))
+
+		metrics.append(("Proportion of lvl1 smoking with lvl1 spouse", spouse_quit_inf_quit))
+		metrics.append(("Proportion of lvl2 smoking with lvl1 spouse", spouse_quit_inf_smoke))
+		metrics.append(("Proportion of lvl1 smoking with lvl2 spouse", spouse_smoke_inf_quit))
+		metrics.append(("Proportion of lvl2 smoking with lvl2 spouse", spouse_smoke_inf_smoke))
+
+		metrics.append(("Proportion of lvl1 smoking with lvl1 friend", friend_quit_inf_quit))
+		metrics.append(("Proportion of lvl2 smoking with lvl1 friend", friend_quit_inf_smoke))
+		metrics.append(("Proportion of lvl1 smoking with lvl2 friend", friend_smoke_inf_quit))
+		metrics.append(("Proportion of lvl2 smoking with lvl2 friend", friend_smoke_inf_smoke))
+
+		metrics.append(("Proportion of lvl0 or lv1 activity with lvl0 or lvl1 spouse", spouse_active_inf_active))
+		metrics.append(("Proportion of lvl2 activity with lvl0 or lvl1 spouse", spouse_active_inf_inactive))
+		metrics.append(("Proportion of lvl0 or lv1 activity with lvl2 spouse", spouse_inactive_inf_active))
+		metrics.append(("Proportion of lvl2 activity with lvl2 spouse", spouse_inactive_inf_inactive))
+
+		metrics.append(("Proportion of lvl0 or lv1 activity with lvl0 or lvl1 friend", friend_active_inf_active))
+		metrics.append(("Proportion of lvl2 activity with lvl0 or lvl1 friend", friend_active_inf_inactive))
+		metrics.append(("Proportion of lvl0 or lv1 activity with lvl2 friend", friend_inactive_inf_active))
+		metrics.append(("Proportion of lvl2 activity with lvl2 friend", friend_inactive_inf_inactive))
+
+		return metrics
+
+	# key metrics on behaviour prevalence for comparison to real world data,
+	# as a list of (label, value) pairs
+	def behaviour_metrics(self):
+		metrics = list()
+
+		metrics.append(("Population", len(self.agents)))
+		metrics.append(("Average CVD risk", self.avg_cvd[-1]))
+		metrics.append(("Proportion of lvl 2 smoking", self.behaviour_prevalence[-1]['smoking'][2]))
+		metrics.append(("Proportion of lvl 2 inactivity", self.behaviour_prevalence[-1]['inactivity'][2]))
+		metrics.append(("Proportion of lvl 2 alcohol", self.behaviour_prevalence[-1]['alcohol'][2]))
+		metrics.append(("Proportion of lvl 2 diet", self.behaviour_prevalence[-1]['diet'][2]))
+
+		return metrics + self.neighbour_metrics()
+
+	#record and save key metrics on behaviour prevalence for comparion to real world data.
+	# without append the run is not added to the results store, e.g. when it
+	# was already added before (see main)
+	def save_behaviour_metrics(self, append=True):
+		metrics = self.behaviour_metrics()
 
 		behaviour_metrics_file = "./results/" + self.base_filename + "_behaviour_metrics.txt"
 		with open(behaviour_metrics_file, 'w', newline='') as file:
-			file.write("Population:" + str(len(self.agents)) + "\n")
-			met_list.append(len(self.agents))
-			file.write("Average CVD risk:" + str(self.avg_cvd[-1]) + "\n")
-			met_list.append(self.avg_cvd[-1])
-			file.write("Proportion of lvl 2 smoking:" + str(self.behaviour_prevalence[-1]['smoking'][2]) + "\n")
-			met_list.append(self.behaviour_prevalence[-1]['smoking'][2])
-			file.write("Proportion of lvl 2 inactivity:" + str(self.behaviour_prevalence[-1]['inactivity'][2]) + "\n")
-			met_list.append(self.behaviour_prevalence[-1]['inactivity'][2])
-			file.write("Proportion of lvl 2 alcohol:" + str(self.behaviour_prevalence[-1]['alcohol'][2]) + "\n")
-			met_list.append(self.behaviour_prevalence[-1]['alcohol'][2])
-			file.write("Proportion of lvl 2 diet:" + str(self.behaviour_prevalence[-1]['diet'][2]) + "\n")
-			met_list.append(self.behaviour_prevalence[-1]['diet'][2])
-
-			file.write("Proportion of lvl1 or lvl2 alcohol with lvl2 housemates:" + str(housemate_lvl2_drink_rate) + "\n")
-			met_list.append(housemate_lvl2_drink_rate)
-			file.write("Proportion of lvl1 or lvl2 alcohol with lvl0 or lvl1 housemates:" + str(housemate_lvl0_drink_rate) + "\n")
-			met_list.append(housemate_lvl0_drink_rate)
-			file.write("Proportion of lvl0 alcohol with lvl2 housemates:" + str(housemate_lvl2_abstain_rate) + "\n")
-			met_list.append(housemate_lvl2_abstain_rate)
-			file.write("Proportion of lvl0 alcohol with lvl0 or lvl1 housemates:" + str(housemate_lvl0_abstain_rate) + "\n")
-			met_list.append(housemate_lvl0_abstain_rate)
-
-			file.write("Proportion of lvl1 or lvl2 alcohol with lvl2 spouse:" + str(spouse_lvl2_drink_rate) + "\n")
-			met_list.append(spouse_lvl2_drink_rate)
-			file.write("Proportion of lvl1 or lvl2 alcohol with lvl0 or lvl1 spouse:" + str(spouse_lvl0_drink_rate) + "\n")
-			met_list.append(spouse_lvl0_drink_rate)
-			file.write("Proportion of lvl0 alcohol with lvl2 spouse:" + str(spouse_lvl2_abstain_rate) + "\n")
-			met_list.append(spouse_lvl2_abstain_rate)
-			file.write("Proportion of lvl0 alcohol with lvl0 or lvl1 spouse:" + str(spouse_lvl0_abstain_rate) + "\n")
-			met_list.append(spouse_lvl0_abstain_rate)
-
-			file.write("Proportion of lvl1 smoking with lvl1 housemates:" + str(hm_quit_inf_quit) + "\n")
-			met_list.append(hm_quit_inf_quit)
-			file.write("Proportion of lvl2 smoking with lvl1 housemates:" + str(hm_quit_inf_smoke) + "\n")
-			met_list.append(hm_quit_inf_smoke)
-			file.write("Proportion of lvl1 smoking with lvl2 housemates:" + str(hm_smoke_inf_quit) + "\n")
-			met_list.append(hm_smoke_inf_quit)
-			file.write("Proportion of lvl2 smoking with lvl2 housemates:" + str(hm_smoke_inf_smoke) + "\n")
-			met_list.append(hm_smoke_inf_smoke)
-
-			file.write("Proportion of lvl1 smoking with lvl1 spouse:" + str(spouse_quit_inf_quit) + "\n")
-			met_list.append(spouse_quit_inf_quit)
-			file.write("Proportion of lvl2 smoking with lvl1 spouse:" + str(spouse_quit_inf_smoke) + "\n")
-			met_list.append(spouse_quit_inf_smoke)
-			file.write("Proportion of lvl1 smoking with lvl2 spouse:" + str(spouse_smoke_inf_quit) + "\n")
-			met_list.append(spouse_smoke_inf_quit)
-			file.write("Proportion of lvl2 smoking with lvl2 spouse:" + str(spouse_smoke_inf_smoke) + "\n")
-			met_list.append(spouse_smoke_inf_smoke)
-
-			file.write("Proportion of lvl1 smoking with lvl1 friend:" + str(friend_quit_inf_quit) + "\n")
-			met_list.append(friend_quit_inf_quit)
-			file.write("Proportion of lvl2 smoking with lvl1 friend:" + str(friend_quit_inf_smoke) + "\n")
-			met_list.append(friend_quit_inf_smoke)
-			file.write("Proportion of lvl1 smoking with lvl2 friend:" + str(friend_smoke_inf_quit) + "\n")
-			met_list.append(friend_smoke_inf_quit)
-			file.write("Proportion of lvl2 smoking with lvl2 friend:" + str(friend_smoke_inf_smoke) + "\n")
-			met_list.append(friend_smoke_inf_smoke)
-
-			file.write("Proportion of lvl0 or lv1 activity with lvl0 or lvl1 spouse:" + str(spouse_active_inf_active) + "\n")
-			met_list.append(spouse_active_inf_active)
-			file.write("Proportion of lvl2 activity with lvl0 or lvl1 spouse:" + str(spouse_active_inf_inactive) + "\n")
-			met_list.append(spouse_active_inf_inactive)
-			file.write("Proportion of lvl0 or lv1 activity with lvl2 spouse:" + str(spouse_inactive_inf_active) + "\n")
-			met_list.append(spouse_inactive_inf_active)
-			file.write("Proportion of lvl2 activity with lvl2 spouse:" + str(spouse_inactive_inf_inactive) + "\n")
-			met_list.append(spouse_inactive_inf_inactive)
-
-			file.write("Proportion of lvl0 or lv1 activity with lvl0 or lvl1 friend:" + str(friend_active_inf_active) + "\n")
-			met_list.append(friend_active_inf_active)
-			file.write("Proportion of lvl2 activity with lvl0 or lvl1 friend:" + str(friend_active_inf_inactive) + "\n")
-			met_list.append(friend_active_inf_inactive)
-			file.write("Proportion of lvl0 or lv1 activity with lvl2 friend:" + str(friend_inactive_inf_active) + "\n")
-			met_list.append(friend_inactive_inf_active)
-			file.write("Proportion of lvl2 activity with lvl2 friend:" + str(friend_inactive_inf_inactive) + "\n")
-			met_list.append(friend_inactive_inf_inactive)
-
-		results_folder = Path("./results/")
-		all_runs_file = results_folder / (self.base_filename + "behaviour_metrics_all.pkl")
-		if not os.path.isfile(all_runs_file):
-			result_list = list()
-			result_list.append(met_list)
-			with open(all_runs_file, 'wb') as pkl_file:
-				pickle.dump(result_list, pkl_file, pickle.HIGHEST_PROTOCOL)
-		else:
-			with open(all_runs_file, 'rb') as pkl_file:
-				result_list = pickle.load(pkl_file)
-			result_list.append(met_list)
-			with open(all_runs_file, 'wb') as pkl_file:
-				pickle.dump(result_list, pkl_file, pickle.HIGHEST_PROTOCOL)
+			for label, value in metrics:
+				file.write(label + ":" + str(value) + "\n")
 
+		if append:
+			append_behaviour_results(self.base_filename, [[value for label, value in metrics]])
 
 	# output summary of results
 	def print_simulation_metrics(self):
-		print("At the end of the simulation:")
-		print("Population:", len(self.agents))
-		print("Average CVD risk:", self.avg_cvd[-1])
-		print("Proportion of level 2 smoking:", self.behaviour_prevalence[-1]['smoking'][2])
-		print("Proportion of level 2 inactivity:", self.behaviour_prevalence[-1]['inactivity'][2])
-		print("Proportion of level 2 alcohol:", self.behaviour_prevalence[-1]['alcohol'][2])
-		print("Proportion of level 2 diet:", self.behaviour_prevalence[-1]['diet'][2])
-
-		total = 0
-		for d in self.deceased:
-			total = total + len(self.deceased[d])
-
-		print("Total deaths:", total)
-		print("Death metrics in final year: " + str(self.cvd_demographics[-1]))
-
-		print(self.cvd_count)
-		print(self.person_years)
-
-		age_bins = ['25-29', '30-34', '35-39', '40-44', '45-49', '50-54', \
-	      '55-59', '60-64', '65-69', '70-74', '75-79', '80-84']
-		
-		print('Women:')		
-		print('age group', '\t', 'incidents', '\t', 'person years', '\t', 'rate per 1000 person years')
-		for age in age_bins:
-			print(age, '\t\t', self.cvd_count['F'][age], '\t\t', self.person_years['F'][age], '\t\t', "{:.2f}".format((self.cvd_count['F'][age] / (self.person_years['F'][age] / 1000))))
-		total_incidents_f = sum(self.cvd_count['F'].values())
-		total_person_years_f = sum(self.person_years['F'].values())
-		print('total', '\t\t', total_incidents_f, '\t\t', total_person_years_f, '\t\t', "{:.2f}".format((total_incidents_f / (total_person_years_f / 1000))))
-		print()
-
-		print('Men:')		
-		print('age group', '\t', 'incidents', '\t', 'person years', '\t', 'rate per 1000 person years')
-		for age in age_bins:
-			print(age, '\t\t', self.cvd_count['M'][age], '\t\t', self.person_years['M'][age], '\t\t', "{:.2f}".format((self.cvd_count['M'][age] / (self.person_years['M'][age] / 1000))))
-		total_incidents_m = sum(self.cvd_count['M'].values())
-		total_person_years_m = sum(self.person_years['M'].values())
-		print('total', '\t\t', total_incidents_m, '\t\t', total_person_years_m, '\t\t', "{:.2f}".format((total_incidents_m / (total_person_years_m / 1000))))
-		print()
-
+		logger.info("At the end of the simulation:")
+		logger.info("Timesteps completed: %d", self.timestep)
+		logger.info("Population: %d", len(self.agents))
+		logger.info("Average CVD risk: %s", self.avg_cvd[-1])
+		logger.info("Proportion of level 2 smoking: %s", self.behaviour_prevalence[-1]['smoking'][2])
+		logger.info("Proportion of level 2 inactivity: %s", self.behaviour_prevalence[-1]['inactivity'][2])
+		logger.info("Proportion of level 2 alcohol: %s", self.behaviour_prevalence[-1]['alcohol'][2])
+		logger.info("Proportion of level 2 diet: %s", self.behaviour_prevalence[-1]['diet'][2])
+
+		logger.info("Total deaths: %d", self.total_deaths)
+		logger.info("Death metrics in final year: %s", self.cvd_demographics[-1])
+
+		if logger.isEnabledFor(logging.DEBUG):
+			logger.debug("%s", self.cvd_count)
+			logger.debug("%s", self.person_years)
+
+		if not logger.isEnabledFor(logging.INFO):
+			return
+
+		rates = self.cvd_hist.counts / (self.person_years_hist.counts / 1000)
+
+		for sex, title in [('F', 'Women:'), ('M', 'Men:')]:
+			s = SEX_INDEX[sex]
+			logger.info(title)
+			logger.info("age group \t incidents \t person years \t rate per 1000 person years")
+			for k, age in enumerate(AGE_BINS):
+				logger.info("%s \t\t %d \t\t %d \t\t %.2f", age, self.cvd_hist.counts[s, k], self.person_years_hist.counts[s, k], rates[s, k])
+			total_incidents = self.cvd_hist.total(sex)
+			total_person_years = self.person_years_hist.total(sex)
+			logger.info("total \t\t %d \t\t %d \t\t %.2f", total_incidents, total_person_years, total_incidents / (total_person_years / 1000))
+			logger.info("")
+
+
+	# rows of the incidence table, one per age bin plus the total:
+	# [age group, incidents (w), person years (w), rate (w), incidents (m), person years (m), rate (m)]
+	def incidence_rows(self):
+		return incidence_rows(self.cvd_hist, self.person_years_hist)
 
 	# save summary of results
-	def save_simulation_metrics(self):
-		age_bins = ['25-29', '30-34', '35-39', '40-44', '45-49', '50-54', \
-	      '55-59', '60-64', '65-69', '70-74', '75-79', '80-84']
-		metrics = ['f_incidents', 'f_years', 'f_rate', 'm_incidents', 'm_years', 'm_rate']
-
-		results_folder = Path("./results/")
-		latest_run_file = results_folder / (self.base_filename + "_latest.csv")
-		all_runs_file = results_folder / (self.base_filename + "_all.pkl")
-		print("Output file (latest run): ", latest_run_file)
-		print("Output file (all runs): ", all_runs_file)
-
-		# if the all runs file does not exist, create an empty template file
-		if not os.path.isfile(all_runs_file):
-			print("Creating output file (all runs): ", all_runs_file)
-			results = {}
-			for age in age_bins:
-				results[age] = {}
-				for metric in metrics:
-					results[age][metric] = []
-			results['total'] = {}
-			for metric in metrics:
-				results['total'][metric] = []
-			with open(all_runs_file, 'wb') as pkl_file:
-				pickle.dump(results, pkl_file, pickle.HIGHEST_PROTOCOL)
-
-		# append results to existing run results
-		with open(all_runs_file, 'rb') as pkl_file:
-			results = pickle.load(pkl_file)
-		for age in age_bins:
-			results[age]['f_incidents'].append(self.cvd_count['F'][age])
-			results[age]['f_years'].append(self.person_years['F'][age])
-			# results[age]['f_rate'].append("{:.2f}".format((self.cvd_count['F'][age] / (self.person_years['F'][age] / 1000))))
-			results[age]['f_rate'].append((self.cvd_count['F'][age] / (self.person_years['F'][age] / 1000)))
-			results[age]['m_incidents'].append(self.cvd_count['M'][age])
-			results[age]['m_years'].append(self.person_years['M'][age])
-			# results[age]['m_rate'].append("{:.2f}".format((self.cvd_count['M'][age] / (self.person_years['M'][age] / 1000))))
-			results[age]['m_rate'].append((self.cvd_count['M'][age] / (self.person_years['M'][age] / 1000)))
-		total_incidents_f = sum(self.cvd_count['F'].values())
-		total_person_years_f = sum(self.person_years['F'].values())
-		total_incidents_m = sum(self.cvd_count['M'].values())	
-		total_person_years_m = sum(self.person_years['M'].values())
-		results['total']['f_incidents'].append(total_incidents_f)
-		results['total']['f_years'].append(total_person_years_f)
-		# results['total']['f_rate'].append("{:.2f}".format((total_incidents_f / (total_person_years_f / 1000))))
-		results['total']['f_rate'].append((total_incidents_f / (total_person_years_f / 1000)))
-		results['total']['m_incidents'].append(total_incidents_m)
-		results['total']['m_years'].append(total_person_years_m)
-		# results['total']['m_rate'].append("{:.2f}".format((total_incidents_m / (total_person_years_m / 1000))))
-		results['total']['m_rate'].append((total_incidents_m / (total_person_years_m / 1000)))
-		with open(all_runs_file, 'wb') as pkl_file:
-			pickle.dump(results, pkl_file, pickle.HIGHEST_PROTOCOL)
-
-		# save (overwrite) the latest results to file
-		with open(latest_run_file, 'w', newline='') as file:
-			writer = csv.writer(file)
-			fields = ['age group', 'incidents (w)', 'person years (w)', 'rate per 1000 person years (w)',
-	     				'incidents (m)', 'person years (m)', 'rate per 1000 person years (m)']
-			writer.writerow(fields)
-			for age in age_bins:
-				writer.writerow([age, self.cvd_count['F'][age], self.person_years['F'][age], (self.cvd_count['F'][age] / (self.person_years['F'][age] / 1000)), 
-					self.cvd_count['M'][age], self.person_years['M'][age], (self.cvd_count['M'][age] / (self.person_years['M'][age] / 1000))])		
-			total_incidents_f = sum(self.cvd_count['F'].values())
-			total_person_years_f = sum(self.person_years['F'].values())
-			total_incidents_m = sum(self.cvd_count['M'].values())	
-			total_person_years_m = sum(self.person_years['M'].values())			
-			writer.writerow(["total", total_incidents_f, total_person_years_f, (total_incidents_f / (total_person_years_f / 1000)),
-		    	total_incidents_m, total_person_years_m, (total_incidents_m / (total_person_years_m / 1000))])
-
-	# define the main simulation
-	def simulation(self, maxLength):
-		for i in range(maxLength):
-			print("Beginning timestep : " + str(i))
-			print("Current population size: " + str(len(self.agents)))
-
-			self.population = self.population + [len(self.agents)]
+	def save_simulation_metrics(self, append=True):
+		rows = self.incidence_rows()
+		if append:
+			append_incidence_results(self.base_filename, [rows], [self.timestep])
+		write_latest_incidence(self.base_filename, rows)
+
+	# add one person year for every living agent to the person years histogram
+	def count_person_years(self):
+		if self.compact:
+			alive = self.agents.alive
+			self.person_years_hist.add_population(self.agents.sex_index()[alive], self.agents.columns['age'][alive])
+			return
+
+		n = len(self.agents)
+		sexes = np.fromiter((SEX_INDEX[agent.sex] for agent in self.agents), dtype=np.intp, count=n)
+		ages = np.fromiter((agent.age for agent in self.agents), dtype=np.intp, count=n)
+		self.person_years_hist.add_population(sexes, ages)
+
+	# compute the incoming influence for all agents with the array engine and
+	# pass it to the agents to calculate their next levels, same as the loop in
+	# simulation, or to the level rule of self.rule
+	def array_influence(self):
+		self.engine.sync_levels()
+		if self.shards is not None and self.rule is not None:
+			self.shards.next_levels(self.rng)
+			return
+		inc_all = self.shards.incoming_influence() if self.shards is not None else self.engine.incoming_influence()
+
+		self.timer.switch('next_levels')
+		if self.rule is not None:
+			self.buffered_levels(inc_all)
+			return
+		for row in self.engine.alive.nonzero()[0]:
+			agent = self.engine.agents[row]
+			inc_inf = dict()
+			for b, behaviour in enumerate(BEHAVIOURS):
+				inc_inf[behaviour] = dict(enumerate(inc_all[row, b].tolist()))
+
+			agent.next_smoking_level(inc_inf['smoking'])
+			agent.next_alcohol_level(inc_inf['alcohol'])
+			agent.next_diet_level(inc_inf['diet'])
+			agent.next_inactivity_level(inc_inf['inactivity'])
+
+	# the levels of the next timestep of all agents from the level rule, written
+	# into the next level buffer of the table while the current levels stay as
+	# they are, then swapped in at once. The levels of the dead agents are never
+	# read, so the rule runs over all rows. One uniform per behaviour and agent id
+	# is drawn from self.rng, as in scenarios.Array_Rule.
+	def buffered_levels(self, inc_all):
+		table = self.agents
+		uniforms = self.rng.random(table.levels.shape)
+		self.rule.level_rule(inc_all.transpose(1, 0, 2)[None], table.levels[None], uniforms, out=table.next_levels[None])
+		table.swap_levels()
+
+	# the cvd chances of the living agents from the risk rule of self.rule for the
+	# levels swapped in by buffered_levels, kept as they are without a risk rule.
+	# The running counts move by the changes only: after the swap the other
+	# level buffer holds the levels the counts are of, so the levels that
+	# differ between the buffers are taken out of the counts of their old level
+	# and added to their new one, and cvd_sum moves by the change of the cvd
+	# chances.
+	def array_risk(self):
+		table = self.agents
+		alive = table.alive
+		changed = (table.levels != table.next_levels) & alive
+		for b in range(len(BEHAVIOURS)):
+			rows = changed[b]
+			if rows.any():
+				moved = np.bincount(table.levels[b, rows], minlength=3) - np.bincount(table.next_levels[b, rows], minlength=3)
+				self.level_counts[b] = [count + delta for count, delta in zip(self.level_counts[b], moved.tolist())]
+
+		if self.rule.risk_rule is not None:
+			cv_chance = self.rule.risk_rule(table.levels[None], table)[0]
+			column = table.columns['cv_chance']
+			self.cvd_sum = self.cvd_sum + float((cv_chance[alive] - column[alive]).sum())
+			column[alive] = cv_chance[alive]
+
+	# the cvd part of a timestep on column arrays: person years, risk update,
+	# one uniform draw per agent from self.rng against the cvd chances, bulk
+	# deaths and aging of the survivors
+	def batch_cvd_sweep(self, i, cvd_metrics):
+		self.timer.switch('person_years')
+		columns = Cvd_Columns(self.agents)
+		self.person_years_hist.add_population(columns.sex, columns.age)
+
+		self.timer.switch('risk')
+		if self.rule is not None:
+			self.array_risk()
+			columns.cv_chance = self.agents.columns['cv_chance'][columns.uids]
+		else:
+			columns.update_risk(self.update_risk)
 
-			for agent in self.agents:
+		self.timer.switch('cvd_test')
+		events = columns.draw_events(self.rng)
+
+		self.timer.switch('deaths')
+		dying = events.nonzero()[0]
+		self.agent_deaths([columns.agents[k] for k in dying.tolist()], i, cvd_metrics,
+			columns.sex[dying], columns.imd[dying], columns.age[dying])
+
+		self.timer.switch('aging')
+		for k in (~events).nonzero()[0].tolist():
+			columns.agents[k].age_up()
 
-				if agent.intervention == False:
+	# number of neighbours whose levels are read in one influence step
+	def neighbour_visits(self):
+		if self.engine is not None:
+			alive = self.engine.alive
+			return sum(int((adjacency @ alive)[alive].sum()) for adjacency in self.engine.adjacency.values())
+
+		visits = 0
+		for agent in self.agents:
+			visits = visits + (agent.spouse is not None) + len(agent.household) + len(agent.workplace) + len(agent.friends)
+		return visits
+
+	# log the timing table of the run
+	def print_timing(self):
+		if self.timer.enabled:
+			logger.info("Timing by phase:")
+			for line in self.timer.table():
+				logger.info(line)
+
+	# hand the analytics and deaths of a finished timestep to the sink
+	def stream_timestep(self, i):
+		timestep = dict()
+		timestep['t'] = i
+		timestep['population'] = len(self.agents)
+		timestep['avg_cvd'] = self.avg_cvd[-1]
+		timestep['prevalence'] = self.behaviour_prevalence[-1]
+		timestep['cvd'] = self.cvd_demographics[-1]
+		self.sink.write_timestep(timestep)
+		self.sink.write_deaths(self.deceased[i])
+
+	# write a checkpoint of the simulation after the current timestep,
+	# only the latest checkpoint in the folder is kept
+	def save_checkpoint(self, folder):
+		path = checkpoint_path(folder, self.timestep)
+		write_checkpoint(self, path)
+		for old in Path(folder).glob("step-*.npz"):
+			if old != path:
+				old.unlink()
+		logger.info("Checkpoint written: %s", path)
+
+	# define the main simulation. Runs the timesteps up to maxLength, starting
+	# from self.timestep, and writes a checkpoint every checkpoint_every timesteps
+	# when a checkpoint folder is given.
+	# score_callback is called with the model after every timestep, the run is
+	# stopped early when it returns True (see score_threshold). Returns the
+	# number of timesteps completed, also kept in self.timestep.
+	def simulation(self, maxLength, checkpoint_every=0, checkpoint_folder=None, score_callback=None):
+		# the influence workers only live as long as the run
+		if self.influence_workers > 1 and self.shards is None:
+			with Sharded_Influence(self.engine, self.influence_workers, self.rule.level_rule if self.rule is not None else None,
+					self.agents) as self.shards:
+				try:
+					return self.simulation(maxLength, checkpoint_every, checkpoint_folder, score_callback)
+				finally:
+					self.shards = None
+
+		# the agents may have been changed since the model was built. A model that
+		# has run timesteps, here or before a checkpoint, keeps its running counts,
+		# so it goes on exactly like an uninterrupted run.
+		if self.timestep == 0:
+			self.recount()
+
+		for i in range(self.timestep, maxLength):
+			logger.debug("Beginning timestep : %d", i)
+			logger.debug("Current population size: %d", len(self.agents))
+
+			self.population.append(len(self.agents))
+
+			self.timer.count('agents', len(self.agents))
+			if self.timer.enabled:
+				self.timer.count('neighbours', self.neighbour_visits())
+
+			# in the per-agent loop the next_*_level calls are timed as part of the influence phase
+			self.timer.switch('influence')
+			if self.engine is not None:
+				self.array_influence()
+			else:
+				# one kernel for all agents, whatever their intervention group: the weights
+				# an agent receives were selected by group and workplace type in __init__
+				for agent in self.agents:
+
+					# influence weights for this agent, indexed [relationship][behaviour][level]
+					weights = self.agent_weights[agent.uid]
 
 					# set up data structure to store the incoming influence
 					inc_inf = dict()
@@ -646,22 +773,22 @@ class Spread_Model:
 						# determine input for smoking
 						inc_inf['smoking'][agent.spouse.smoking_level] = \
 						inc_inf['smoking'][agent.spouse.smoking_level] + \
-						self.inf_by_rel['Spouse']['Smoking'][agent.spouse.smoking_level]
+						weights[SPOUSE][SMOKING][agent.spouse.smoking_level]
 
 						# determine input for alcohol
 						inc_inf['alcohol'][agent.spouse.alcohol_level] = \
 						inc_inf['alcohol'][agent.spouse.alcohol_level] + \
-						self.inf_by_rel['Spouse']['Alcohol'][agent.spouse.alcohol_level]
+						weights[SPOUSE][ALCOHOL][agent.spouse.alcohol_level]
 
 						# determine input for diets
 						inc_inf['diet'][agent.spouse.diet_level] = \
 						inc_inf['diet'][agent.spouse.diet_level] + \
-						self.inf_by_rel['Spouse']['Diet'][agent.spouse.diet_level]
+						weights[SPOUSE][DIET][agent.spouse.diet_level]
 
 						# determine input for inactivity
 						inc_inf['inactivity'][agent.spouse.inactivity_level] = \
 						inc_inf['inactivity'][agent.spouse.inactivity_level] + \
-						self.inf_by_rel['Spouse']['Inactivity'][agent.spouse.inactivity_level]
+						weights[SPOUSE][INACTIVITY][agent.spouse.inactivity_level]
 
 					# add household influence to incoming influence for agent
 					for hm in agent.household:
@@ -669,44 +796,44 @@ class Spread_Model:
 						# determine input for smoking
 						inc_inf['smoking'][hm.smoking_level] = \
 						inc_inf['smoking'][hm.smoking_level] + \
-						self.inf_by_rel['Household']['Smoking'][hm.smoking_level]
+						weights[HOUSEHOLD][SMOKING][hm.smoking_level]
 
 						# determine input for alcohol
 						inc_inf['alcohol'][hm.alcohol_level] = \
 						inc_inf['alcohol'][hm.alcohol_level] + \
-						self.inf_by_rel['Household']['Alcohol'][hm.alcohol_level]
+						weights[HOUSEHOLD][ALCOHOL][hm.alcohol_level]
 
 						# determine input for diets
 						inc_inf['diet'][hm.diet_level] = \
 						inc_inf['diet'][hm.diet_level] + \
-						self.inf_by_rel['Household']['Diet'][hm.diet_level]
+						weights[HOUSEHOLD][DIET][hm.diet_level]
 
 						# determine input for inactivity
 						inc_inf['inactivity'][hm.inactivity_level] = \
 						inc_inf['inactivity'][hm.inactivity_level] + \
-						self.inf_by_rel['Household']['Inactivity'][hm.inactivity_level]
+						weights[HOUSEHOLD][INACTIVITY][hm.inactivity_level]
 
 					# add household influence to incoming influence for agent
 					for wm in agent.workplace:
 						# determine input for smoking
 						inc_inf['smoking'][wm.smoking_level] = \
 						inc_inf['smoking'][wm.smoking_level] + \
-						self.inf_by_rel['Workplace'][agent.workplace_type]['Smoking'][wm.smoking_level]
+						weights[WORKPLACE][SMOKING][wm.smoking_level]
 
 						# determine input for alcohol
 						inc_inf['alcohol'][wm.alcohol_level] = \
 						inc_inf['alcohol'][wm.alcohol_level] + \
-						self.inf_by_rel['Workplace'][agent.workplace_type]['Alcohol'][wm.alcohol_level]
+						weights[WORKPLACE][ALCOHOL][wm.alcohol_level]
 
 						# determine input for diets
 						inc_inf['diet'][wm.diet_level] = \
 						inc_inf['diet'][wm.diet_level] + \
-						self.inf_by_rel['Workplace'][agent.workplace_type]['Diet'][wm.diet_level]
+						weights[WORKPLACE][DIET][wm.diet_level]
 
 						# determine input for inactivity
 						inc_inf['inactivity'][wm.inactivity_level] = \
 						inc_inf['inactivity'][wm.inactivity_level] + \
-						self.inf_by_rel['Workplace'][agent.workplace_type]['Inactivity'][wm.inactivity_level]
+						weights[WORKPLACE][INACTIVITY][wm.inactivity_level]
 
 					# add incoming influence for friends in friendship network
 					for friend in agent.friends:
@@ -714,191 +841,282 @@ class Spread_Model:
 						# determine input for smoking
 						inc_inf['smoking'][friend.smoking_level] = \
 						inc_inf['smoking'][friend.smoking_level] + \
-						self.inf_by_rel['Friendship']['Smoking'][friend.smoking_level]
+						weights[FRIENDSHIP][SMOKING][friend.smoking_level]
 
 						# determine input for alcohol
 						inc_inf['alcohol'][friend.alcohol_level] = \
 						inc_inf['alcohol'][friend.alcohol_level] + \
-						self.inf_by_rel['Friendship']['Alcohol'][friend.alcohol_level]
+						weights[FRIENDSHIP][ALCOHOL][friend.alcohol_level]
 
 						# determine input for diets
 						inc_inf['diet'][friend.diet_level] = \
 						inc_inf['diet'][friend.diet_level] + \
-						self.inf_by_rel['Friendship']['Diet'][friend.diet_level]
+						weights[FRIENDSHIP][DIET][friend.diet_level]
 
 						# determine input for inactivity
 						inc_inf['inactivity'][friend.inactivity_level] = \
 						inc_inf['inactivity'][friend.inactivity_level] + \
-						self.inf_by_rel['Friendship']['Inactivity'][friend.inactivity_level]
-					
+						weights[FRIENDSHIP][INACTIVITY][friend.inactivity_level]
+				
 					# Calculate the new level for the agent based on the calculated incoming influence.
 					# These new levels are stored in temporary variables.
 					# We need to shift the levels of all agents at the same time, so save the temporary
-					# values for now and swap them over later. 
+					# values for now and swap them over later. Runs with an array rule keep both
+					# in double buffered arrays instead, see buffered_levels.
 					agent.next_smoking_level(inc_inf['smoking'])
 					agent.next_alcohol_level(inc_inf['alcohol'])
 					agent.next_diet_level(inc_inf['diet'])
 					agent.next_inactivity_level(inc_inf['inactivity'])
 
-				else: 
+			cvd_metrics = {'M': 0, 'F': 0, 'imd1': 0, 'imd2': 0, 'imd3': 0, 'imd4': 0, 'imd5': 0, 'avg_age': 0}
+			# update agent risk levels and CVD risk.
+			# Then, test for a CVD event and remove the agent in the event they have
+			# suffered a CVD event.
 
-					# set up data structure to store the incoming influence
-					inc_inf = dict()
-					inc_inf['smoking'] = {0: 0.0, 1: 0.0, 2: 0.0}
-					inc_inf['alcohol'] = {0: 0.0, 1: 0.0, 2: 0.0}
-					inc_inf['diet'] = {0: 0.0, 1: 0.0, 2: 0.0}
-					inc_inf['inactivity'] = {0: 0.0, 1: 0.0, 2: 0.0}
+			if not self.keep_history:
+				self.deceased.clear()
+			self.deceased[i] = list()
 
-					# check if agent has a spouse and include the
-					# spouse's influence upon the agent
-					if agent.spouse is not None:
+			if self.batch_cvd:
+				self.batch_cvd_sweep(i, cvd_metrics)
+			else:
+				# update tracking of person years for calculating final results
+				self.timer.switch('person_years')
+				self.count_person_years()
+
+				# the cvd tests and aging of this sweep are timed as part of the risk phase
+				self.timer.switch('risk')
+				if self.rule is not None:
+					self.array_risk()
+				dying = list()
+				for agent in self.agents:
+					# update cvd risk, check for cvd events, and increment age
+					if self.rule is None:
+						self.update_risk(agent)
+
+					if agent.test_for_cv():
+						dying.append(agent)
+					else:
+						agent.age_up()
+
+				# remove the agents after the sweep, so no agent is skipped
+				self.timer.switch('deaths')
+				for agent in dying:
+					self.agent_death(agent, i, cvd_metrics)
 
-						# determine input for smoking
-						inc_inf['smoking'][agent.spouse.smoking_level] = \
-						inc_inf['smoking'][agent.spouse.smoking_level] + \
-						self.inter_inf['Spouse']['Smoking'][agent.spouse.smoking_level]
+			if len(self.deceased[i]) > 0:
+				cvd_metrics['avg_age'] = cvd_metrics['avg_age'] / len(self.deceased[i])
+			cvd_metrics['total'] = len(self.deceased[i])
+			self.cvd_demographics.append(cvd_metrics)
+			self.timer.count('deaths', len(self.deceased[i]))
+
+			self.timestep = i + 1
+			self.timer.switch('scoring')
+			stop = score_callback is not None and self.timestep < maxLength and score_callback(self)
+
+			logger.debug("Timestep %d finished. Calculating analytics.", i)
+			self.timer.switch('analytics')
+			self.analytics(i, final=stop or self.timestep == maxLength)
+
+			self.timer.switch('output')
+			self.stream_timestep(i)
+			self.progress.timestep(self, i, maxLength)
+
+			if checkpoint_folder is not None and checkpoint_every > 0 and self.timestep % checkpoint_every == 0:
+				self.save_checkpoint(checkpoint_folder)
+			self.timer.end_step(i)
+
+			if stop:
+				logger.info("Stopped simulation early after %d of %d timesteps.", self.timestep, maxLength)
+				self.progress.finished(self, maxLength)
+				return self.timestep
+		logger.info("Finished running simulation.")
+		self.progress.finished(self, maxLength)
+		return self.timestep
+
+
+# [modelScore, negScore, posScore] of the differences between the simulated
+# and the Hippisley-Cox et al., 2017 incidence rates
+def score_differences(differences):
+	modelScore = 0
+	negScore = 0
+	posScore = 0
+
+	for diff in differences:
+		modelScore = modelScore + abs(diff)
+		if diff < 0:
+			negScore = negScore + diff
+		else:
+			posScore = posScore + diff
 
-						# determine input for alcohol
-						inc_inf['alcohol'][agent.spouse.alcohol_level] = \
-						inc_inf['alcohol'][agent.spouse.alcohol_level] + \
-						self.inter_inf['Spouse']['Alcohol'][agent.spouse.alcohol_level]
+	return [modelScore, negScore, posScore]
 
-						# determine input for diets
-						inc_inf['diet'][agent.spouse.diet_level] = \
-						inc_inf['diet'][agent.spouse.diet_level] + \
-						self.inter_inf['Spouse']['Diet'][agent.spouse.diet_level]
 
-						# determine input for inactivity
-						inc_inf['inactivity'][agent.spouse.inactivity_level] = \
-						inc_inf['inactivity'][agent.spouse.inactivity_level] + \
-						self.inter_inf['Spouse']['Inactivity'][agent.spouse.inactivity_level]
+# score_callback for Spread_Model.simulation that stops a run once its
+# running modelScore is above stop_score, from min_timesteps timesteps on
+def score_threshold(stop_score, min_timesteps=1):
+	def callback(model):
+		return model.timestep >= min_timesteps and model.running_score()[0] > stop_score
+	return callback
 
-					# add household influence to incoming influence for agent
-					for hm in agent.household:
 
-						# determine input for smoking
-						inc_inf['smoking'][hm.smoking_level] = \
-						inc_inf['smoking'][hm.smoking_level] + \
-						self.inter_inf['Household']['Smoking'][hm.smoking_level]
+# share of count in total, nan if the total is zero
+def proportion(count, total):
+	if total == 0:
+		return float('nan')
+	return count / total
 
-						# determine input for alcohol
-						inc_inf['alcohol'][hm.alcohol_level] = \
-						inc_inf['alcohol'][hm.alcohol_level] + \
-						self.inter_inf['Household']['Alcohol'][hm.alcohol_level]
 
-						# determine input for diets
-						inc_inf['diet'][hm.diet_level] = \
-						inc_inf['diet'][hm.diet_level] + \
-						self.inter_inf['Household']['Diet'][hm.diet_level]
+# add the incidence tables of one or more runs to the results store, with the
+# number of timesteps each ran. every run is written to its own shard, see results_store
+def append_incidence_results(base_filename, runs, timesteps):
+	logger.info("Output folder (all runs): %s", results_store.shard_folder(base_filename, 'incidence'))
+	for rows, length in zip(runs, timesteps):
+		results_store.write_incidence_run(base_filename, rows, length)
 
-						# determine input for inactivity
-						inc_inf['inactivity'][hm.inactivity_level] = \
-						inc_inf['inactivity'][hm.inactivity_level] + \
-						self.inter_inf['Household']['Inactivity'][hm.inactivity_level]
 
-					# add household influence to incoming influence for agent
-					for wm in agent.workplace:
-						# determine input for smoking
-						inc_inf['smoking'][wm.smoking_level] = \
-						inc_inf['smoking'][wm.smoking_level] + \
-						self.inter_inf['Workplace'][agent.workplace_type]['Smoking'][wm.smoking_level]
+# save (overwrite) the incidence table of the latest run
+def write_latest_incidence(base_filename, rows):
+	results_folder = Path("./results/")
+	latest_run_file = results_folder / (base_filename + "_latest.csv")
+	logger.info("Output file (latest run): %s", latest_run_file)
 
-						# determine input for alcohol
-						inc_inf['alcohol'][wm.alcohol_level] = \
-						inc_inf['alcohol'][wm.alcohol_level] + \
-						self.inter_inf['Workplace'][agent.workplace_type]['Alcohol'][wm.alcohol_level]
+	with open(latest_run_file, 'w', newline='') as file:
+		writer = csv.writer(file)
+		fields = ['age group', 'incidents (w)', 'person years (w)', 'rate per 1000 person years (w)',
+     				'incidents (m)', 'person years (m)', 'rate per 1000 person years (m)']
+		writer.writerow(fields)
+		for row in rows:
+			writer.writerow(row)
 
-						# determine input for diets
-						inc_inf['diet'][wm.diet_level] = \
-						inc_inf['diet'][wm.diet_level] + \
-						self.inter_inf['Workplace'][agent.workplace_type]['Diet'][wm.diet_level]
 
-						# determine input for inactivity
-						inc_inf['inactivity'][wm.inactivity_level] = \
-						inc_inf['inactivity'][wm.inactivity_level] + \
-						self.inter_inf['Workplace'][agent.workplace_type]['Inactivity'][wm.inactivity_level]
+# add the behaviour metric values of one or more runs to the results store
+def append_behaviour_results(base_filename, runs):
+	for values in runs:
+		results_store.write_behaviour_run(base_filename, values)
 
-					# add incoming influence for friends in friendship network
-					for friend in agent.friends:
 
-						# determine input for smoking
-						inc_inf['smoking'][friend.smoking_level] = \
-						inc_inf['smoking'][friend.smoking_level] + \
-						self.inter_inf['Friendship']['Smoking'][friend.smoking_level]
+# parameters loaded by this process, so each worker reads the parameter folder once
+# however many replicates it runs.
+# The parameters and network modules are imported where they are used, so
+# Spread_Model can also run on agents built elsewhere (e.g. the synthetic
+# populations in benchmarks/) without them.
+loaded_parameters = dict()
 
-						# determine input for alcohol
-						inc_inf['alcohol'][friend.alcohol_level] = \
-						inc_inf['alcohol'][friend.alcohol_level] + \
-						self.inter_inf['Friendship']['Alcohol'][friend.alcohol_level]
+def load_parameters(parameter_folder):
+	import parameters
 
-						# determine input for diets
-						inc_inf['diet'][friend.diet_level] = \
-						inc_inf['diet'][friend.diet_level] + \
-						self.inter_inf['Friendship']['Diet'][friend.diet_level]
+	if parameter_folder not in loaded_parameters:
+		loaded_parameters[parameter_folder] = parameters.Parameters(parameter_folder)
+	return loaded_parameters[parameter_folder]
 
-						# determine input for inactivity
-						inc_inf['inactivity'][friend.inactivity_level] = \
-						inc_inf['inactivity'][friend.inactivity_level] + \
-						self.inter_inf['Friendship']['Inactivity'][friend.inactivity_level]
-					
-					# Calculate the new level for the agent based on the calculated incoming influence.
-					# These new levels are stored in temporary variables.
-					# We need to shift the levels of all agents at the same time, so save the temporary
-					# values for now and swap them over later. 
-					agent.next_smoking_level(inc_inf['smoking'])
-					agent.next_alcohol_level(inc_inf['alcohol'])
-					agent.next_diet_level(inc_inf['diet'])
-					agent.next_inactivity_level(inc_inf['inactivity'])
 
-			cvd_metrics = {'M': 0, 'F': 0, 'imd1': 0, 'imd2': 0, 'imd3': 0, 'imd4': 0, 'imd5': 0, 'avg_age': 0}
-			# update agent risk levels and CVD risk.
-			# Then, test for a CVD event and remove the agent in the event they have
-			# suffered a CVD event.
+# independent seeds for a number of replicates, spawned from one root seed.
+# the same root seed always gives the same replicate seeds.
+def replicate_seeds(root_seed, replicates):
+	children = np.random.SeedSequence(root_seed).spawn(replicates)
+	return [int(child.generate_state(1, dtype=np.uint64)[0]) for child in children]
 
-			self.deceased[i] = list()
-			for agent in self.agents:
-				# update tracking of person years for calculating final results
-				if agent.age >= 25:
-					if agent.age <= 29:
-						self.person_years[agent.sex]['25-29'] = self.person_years[agent.sex]['25-29'] + 1
-					elif agent.age <= 34:
-						self.person_years[agent.sex]['30-34'] = self.person_years[agent.sex]['30-34'] + 1
-					elif agent.age <= 39:
-						self.person_years[agent.sex]['35-39'] = self.person_years[agent.sex]['35-39'] + 1
-					elif agent.age <= 44:
-						self.person_years[agent.sex]['40-44'] = self.person_years[agent.sex]['40-44'] + 1
-					elif agent.age <= 49:
-						self.person_years[agent.sex]['45-49'] = self.person_years[agent.sex]['45-49'] + 1
-					elif agent.age <= 54:
-						self.person_years[agent.sex]['50-54'] = self.person_years[agent.sex]['50-54'] + 1
-					elif agent.age <= 59:
-						self.person_years[agent.sex]['55-59'] = self.person_years[agent.sex]['55-59'] + 1
-					elif agent.age <= 64:
-						self.person_years[agent.sex]['60-64'] = self.person_years[agent.sex]['60-64'] + 1
-					elif agent.age <= 69:
-						self.person_years[agent.sex]['65-69'] = self.person_years[agent.sex]['65-69'] + 1
-					elif agent.age <= 74:
-						self.person_years[agent.sex]['70-74'] = self.person_years[agent.sex]['70-74'] + 1
-					elif agent.age <= 79:
-						self.person_years[agent.sex]['75-79'] = self.person_years[agent.sex]['75-79'] + 1
-					elif agent.age <= 84:
-						self.person_years[agent.sex]['80-84'] = self.person_years[agent.sex]['80-84'] + 1
-
-				# update cvd risk, check for cvd events, and increment age
-				agent.update_risk_levels()
-
-				if agent.test_for_cv():
-					self.agent_death(agent, i, cvd_metrics)
-				else:
-					agent.age_up()
 
-			cvd_metrics['avg_age'] = cvd_metrics['avg_age'] / len(self.deceased[i])
-			cvd_metrics['total'] = len(self.deceased[i])
-			self.cvd_demographics.append(cvd_metrics)
+# agents of the network for a run, generated from the 'network' stream or,
+# with network_cache, taken from the network cache (see network_cache). With
+# compact and network_cache, the Agent_Table is a copy-on-write clone of the
+# cached table arrays, without creating agent objects.
+def network_agents(parameter_folder, param, target_size, streams, network_cache=False, compact=False):
+	if network_cache and compact:
+		return cached_table(parameter_folder, param, target_size, streams.int_seed('network'))
+	if network_cache:
+		return cached_agents(parameter_folder, param, target_size, streams.int_seed('network'))
+
+	from network import Network
+
+	streams.seed_global('network')
+	n = Network(param)
+
+	return n.generate_agents(target_size)
 
-			print("Timestep " + str(i) + " finished. Calculating analytics.")
-			self.analytics(i)
-		print("Finished running simulation.")
+
+# run one replicate of the simulation and return its results.
+# The network, the agents and the model draw from independent streams spawned
+# from the replicate's seed, so every replicate can be reproduced on its own
+# by running it with --seed set to that seed.
+def run_replicate(parameter_folder, target_size, timestep, base_filename, seed, array_engine=False, mets=False,
+		batch_cvd=False, network_cache=False, progress_path=None, progress_interval=5.0, intervention_files=(),
+		intervention_share=None, compact=False, analytics=None, keep_history=True, stop_score=None, min_timesteps=1,
+		influence_workers=1):
+	streams = Random_Streams(seed)
+	param = load_parameters(parameter_folder)
+
+	agent_list = network_agents(parameter_folder, param, target_size, streams, network_cache, compact)
+	inf_by_rel = param.get_inf_by_rel()
+	inter_inf = intervention_weights(intervention_files, inf_by_rel)
+	if intervention_share is not None:
+		assign_workplaces(agent_list, len(inter_inf), intervention_share, streams.generator('intervention'))
+	progress = Progress_Reporter(progress_interval, open_progress(progress_path), run=seed)
+	spreader = Spread_Model(agent_list, inf_by_rel, inter_inf, base_filename, array_engine=array_engine,
+		rng=streams.generator('model'), batch_cvd=batch_cvd, progress=progress, compact=compact, analytics=analytics,
+		keep_history=keep_history, influence_workers=influence_workers)
+
+	streams.seed_global('agents')
+
+	spreader.analytics(-1)
+	spreader.cvd_demographics.append({'M': 0, 'F': 0, 'imd1': 0, 'imd2': 0, 'imd3': 0, 'imd4': 0, 'imd5': 0, 'avg_age': 0, 'total': 0})
+	score_callback = score_threshold(stop_score, min_timesteps) if stop_score is not None else None
+	spreader.simulation(timestep, score_callback=score_callback)
+	progress.close()
+
+	result = dict()
+	result['seed'] = seed
+	result['timesteps'] = spreader.timestep
+	result['incidence'] = spreader.incidence_rows()
+	result['score'] = spreader.eval_params()
+	if mets:
+		result['behaviour'] = [value for label, value in spreader.behaviour_metrics()]
+	return result
+
+
+# run a number of replicates of the same configuration across a pool of worker
+# processes. The results are collected here and written to the results files once.
+def run_replicates(parameter_folder, target_size, timestep, base_filename, replicates, workers,
+		root_seed=None, array_engine=False, mets=False, batch_cvd=False, network_cache=False,
+		progress_path=None, progress_interval=5.0, quiet=False, verbose=False, intervention_files=(),
+		intervention_share=None, compact=False, analytics=None, keep_history=True, stop_score=None, min_timesteps=1,
+		influence_workers=1):
+	root = np.random.SeedSequence(root_seed)
+	logger.info("Replicate root seed: %d", root.entropy)
+	seeds = replicate_seeds(root.entropy, replicates)
+
+	run = partial(run_replicate, parameter_folder, target_size, timestep, base_filename,
+		array_engine=array_engine, mets=mets, batch_cvd=batch_cvd, network_cache=network_cache,
+		progress_path=progress_path, progress_interval=progress_interval, intervention_files=intervention_files,
+		intervention_share=intervention_share, compact=compact, analytics=analytics, keep_history=keep_history,
+		stop_score=stop_score, min_timesteps=min_timesteps, influence_workers=influence_workers)
+	if workers == 1:
+		results = [run(seed) for seed in seeds]
+	else:
+		with ProcessPoolExecutor(max_workers=workers, initializer=configure_logging, initargs=(quiet, verbose)) as executor:
+			results = list(executor.map(run, seeds))
+
+	for r, result in enumerate(results):
+		logger.info("Replicate %d (seed %d) score: %s", r, result['seed'], result['score'])
+		if result['timesteps'] < timestep:
+			logger.info("Replicate %d was stopped early after %d of %d timesteps", r, result['timesteps'], timestep)
+
+	append_incidence_results(base_filename, [result['incidence'] for result in results],
+		[result['timesteps'] for result in results])
+	write_latest_incidence(base_filename, results[-1]['incidence'])
+	if mets:
+		append_behaviour_results(base_filename, [result['behaviour'] for result in results])
+
+	return results
+
+
+# influence weights of the intervention groups read from files (see intervention_groups),
+# without files every agent uses inf_by_rel, whatever its agent.intervention
+def intervention_weights(files, inf_by_rel):
+	if len(files) == 0:
+		return [inf_by_rel]
+	return [read_weights(path, inf_by_rel) for path in files]
 
 
 def default_rels():
@@ -932,44 +1150,214 @@ def main():
 
 	parser.add_argument('--metrics', dest='mets', action='store_true', help='store behaviour prevalence metrics')
 
-	# parser.add_argument('--plots', dest='plots',
-	# 	action='store_true', help='generate basic plots')
-	# parser.set_defaults(plots=False)
-	
+	parser.add_argument('--array-engine', dest='array_engine', action='store_true',
+		help='compute influence with the array-backed engine (numpy/scipy)')
+
+	parser.add_argument('--batch-cvd', dest='batch_cvd', action='store_true',
+		help='draw the cvd events of all agents at once from the model random stream')
+
+	parser.add_argument('--compact', action='store_true',
+		help='keep the agents in typed arrays (see agent_table) to save memory on large populations; implies --array-engine')
+
+	parser.add_argument('--network-cache', dest='network_cache', action='store_true',
+		help='reuse the network generated for the same parameters, size and seed from ./networks/')
+
+	parser.add_argument('--analytics', dest='analytics', action='append', default=[], metavar='NAME=CADENCE',
+		type=cadence_option(ANALYTICS_METRICS),
+		help='how often a metric (' + ', '.join(ANALYTICS_METRICS) + ') is computed: step, end, off or every N timesteps')
+
+	parser.add_argument('--stop-score', dest='stop_score', action='store', default=None, type=float,
+		help='stop the run early once its running model score is above this value')
+
+	parser.add_argument('--min-timesteps', dest='min_timesteps', action='store', default=1, type=int,
+		help='number of timesteps to run before --stop-score is checked')
+
+	parser.add_argument('--replicates', action='store', default=1, type=int,
+		help='number of replicates of the simulation to run')
+
+	parser.add_argument('--workers', action='store', default=1, type=int,
+		help='number of worker processes used to run the replicates')
+
+	parser.add_argument('--seed', action='store', default=None, type=int,
+		help='seed of the run (random if not given); replicates use independent seeds spawned from it')
+
+	parser.add_argument('--stream', action='store', default=None,
+		help='stream per-timestep analytics and deaths to this path (.jsonl, otherwise csv files with this prefix)')
+
+	parser.add_argument('--no-history', dest='keep_history', action='store_false',
+		help='only keep the latest timestep of the analytics in memory')
+
+	parser.add_argument('--checkpoint-every', dest='checkpoint_every', action='store', default=0, type=int,
+		help='write a checkpoint every K timesteps to ./checkpoints/<statistics base filename>/')
+
+	parser.add_argument('--resume', action='store_true',
+		help='resume from the latest checkpoint of this configuration if there is one')
+
+	parser.add_argument('-q', '--quiet', action='store_true',
+		help='only report warnings and errors')
+
+	parser.add_argument('-v', '--verbose', action='store_true',
+		help='report every timestep')
+
+	parser.add_argument('--progress', action='store', default=None,
+		help='append machine-readable progress (one JSON object per line) to this file, - for stderr')
+
+	parser.add_argument('--progress-interval', dest='progress_interval', action='store', default=5.0, type=float,
+		help='minimum number of seconds between progress messages')
+
+	parser.add_argument('--timing', action='store_true',
+		help='time the phases of every timestep and show a timing table at the end')
+
+	parser.add_argument('--timing-json', dest='timing_json', action='store', default=None,
+		help='write the timing of every phase and timestep to this JSON file (implies --timing)')
+
+	parser.add_argument('--profile', action='store', default=None, metavar='PREFIX',
+		help='profile the simulation, writing PREFIX.prof (cProfile) and PREFIX.folded (sampled stacks)')
+
+	parser.add_argument('--intervention', dest='interventions', action='append', default=[], metavar='WEIGHTS',
+		help='csv of the influence weights of an intervention group (see intervention_groups); repeat for several groups')
+
+	parser.add_argument('--intervention-share', dest='intervention_share', action='store', default=None, type=float,
+		help='share of the workplaces put in each intervention group (default: the groups set by the network)')
+
+	parser.add_argument('--influence-workers', dest='influence_workers', action='store', default=1, type=int,
+		help='split the influence step of a single run over this many processes (see sharding); implies --array-engine. '
+		'Pays off for large populations (about 100000 agents and up) with a free core per worker; for small runs '
+		'starting the workers and sharing the arrays costs more than it saves. '
+		'Measure with benchmarks/run_benchmarks.py --worker-scaling')
+
+	parser.add_argument('--plots', dest='plots', action='store_true',
+		help='plot the average CVD risk and behaviour prevalence from the saved results (needs matplotlib); '
+		'a single run streams its timesteps to ./results/<statistics base filename> unless --stream is given')
+
+	parser.add_argument('--export-graph', dest='export_graph', action='store', default=None, metavar='PATH',
+		help='write the network of the initial population to PATH (.graphml, .gexf or an edge list, needs networkx)')
+
 	args = parser.parse_args()
-	print("Using parameters from folder:", args.parameter_folder)
+	# fail before the run rather than after it when the optional packages are missing
+	for option, module in [('plots', 'matplotlib'), ('export_graph', 'networkx')]:
+		if getattr(args, option) not in (None, False) and importlib.util.find_spec(module) is None:
+			parser.error("--" + option.replace('_', '-') + " needs " + module + ", which is not installed")
+	configure_logging(args.quiet, args.verbose)
+	logger.info("Using parameters from folder: %s", args.parameter_folder)
 	target_size = args.size
-	print("Target population size: ", target_size)
+	logger.info("Target population size: %d", target_size)
 	exp_id = args.exp_id
-	print("Experiment ID: ", exp_id)
-	param = parameters.Parameters(args.parameter_folder)
+	logger.info("Experiment ID: %s", exp_id)
+	param = load_parameters(args.parameter_folder)
 	config_name = os.path.basename(os.path.normpath(args.parameter_folder))
 
 	stats_base_filename = "n-" + str(args.size) + "_t-" + str(args.timestep) + "_config-" + config_name
 	if exp_id != 'None':
 		stats_base_filename = "expID-" + exp_id + "_" + stats_base_filename
-	print("Statistics base filename: ", stats_base_filename)
+	if len(args.interventions) > 0:
+		stats_base_filename = stats_base_filename + "_inter-" + '+'.join(Path(path).stem for path in args.interventions)
+		if args.intervention_share is not None:
+			stats_base_filename = stats_base_filename + "-" + str(args.intervention_share)
+	logger.info("Statistics base filename: %s", stats_base_filename)
+
+	if args.replicates > 1 or args.workers > 1:
+		# options of a single run, the replicates have no stream, checkpoints or timing of their own
+		single_run = [('stream', args.stream is not None), ('checkpoint-every', args.checkpoint_every > 0),
+			('resume', args.resume), ('timing', args.timing), ('timing-json', args.timing_json is not None),
+			('profile', args.profile is not None), ('export-graph', args.export_graph is not None)]
+		for option, given in single_run:
+			if given:
+				parser.error("--" + option + " is only supported for a single run, not with --replicates or --workers")
+		logger.info("Running %d replicates on %d workers.", args.replicates, args.workers)
+		run_replicates(args.parameter_folder, target_size, args.timestep, stats_base_filename,
+			args.replicates, args.workers, root_seed=args.seed, array_engine=args.array_engine, mets=args.mets,
+			batch_cvd=args.batch_cvd, network_cache=args.network_cache, progress_path=args.progress,
+			progress_interval=args.progress_interval, quiet=args.quiet, verbose=args.verbose,
+			intervention_files=args.interventions, intervention_share=args.intervention_share, compact=args.compact,
+			analytics=dict(args.analytics), keep_history=args.keep_history, stop_score=args.stop_score,
+			min_timesteps=args.min_timesteps, influence_workers=args.influence_workers)
+		if args.plots:
+			from plotting import plot_replicates
+			path = plot_replicates(stats_base_filename, results_store.RESULTS_FOLDER / (stats_base_filename + "_replicates.png"))
+			if path is None:
+				logger.warning("No behaviour metrics to plot, replicates are only plotted with --metrics")
+			else:
+				logger.info("Plot written: %s", path)
+		return
 
+	streams = Random_Streams(args.seed)
+	logger.info("Seed: %d", streams.seed)
 
-	n = Network(param)
+	checkpoint_folder = Path("./checkpoints/") / stats_base_filename
+	checkpoint_file = latest_checkpoint(checkpoint_folder) if args.resume else None
 
-	agent_list = n.generate_agents(target_size)
+	if checkpoint_file is not None:
+		logger.info("Resuming from checkpoint: %s", checkpoint_file)
+		agent_list, checkpoint_arrays = read_checkpoint(checkpoint_file)
+	else:
+		agent_list = network_agents(args.parameter_folder, param, target_size, streams, args.network_cache, args.compact)
 
 	#makes an array of relationships with all values of 0.1
 	inf_by_rel = param.get_inf_by_rel()
+	inter_inf = intervention_weights(args.interventions, inf_by_rel)
+	# a resumed run keeps the groups stored with its agents
+	if args.intervention_share is not None and checkpoint_file is None:
+		assign_workplaces(agent_list, len(inter_inf), args.intervention_share, streams.generator('intervention'))
 
-	# spreader = Spread_Model(agent_list, inf_by_rel, graph)
-	spreader = Spread_Model(agent_list, inf_by_rel, stats_base_filename)
-
-	print("Beginning simulation.")
+	if args.plots and args.stream is None:
+		results_store.RESULTS_FOLDER.mkdir(exist_ok=True)
+		args.stream = str(results_store.RESULTS_FOLDER / stats_base_filename)
+	resume_timestep = int(checkpoint_arrays['timestep']) if checkpoint_file is not None else None
+	sink = open_sink(args.stream, append=checkpoint_file is not None, timestep=resume_timestep) if args.stream is not None else None
 
-	spreader.analytics(-1)
-	spreader.cvd_demographics.append({'M': 0, 'F': 0, 'imd1': 0, 'imd2': 0, 'imd3': 0, 'imd4': 0, 'imd5': 0, 'avg_age': 0, 'total': 0})
-	spreader.simulation(args.timestep)
+	# spreader = Spread_Model(agent_list, inf_by_rel, graph)
+	spreader = Spread_Model(agent_list, inf_by_rel, inter_inf, stats_base_filename, array_engine=args.array_engine,
+		sink=sink, keep_history=args.keep_history, rng=streams.generator('model'),
+		batch_cvd=args.batch_cvd, analytics=dict(args.analytics),
+		progress=Progress_Reporter(args.progress_interval, open_progress(args.progress), run=streams.seed),
+		timing=args.timing or args.timing_json is not None, compact=args.compact, influence_workers=args.influence_workers)
+
+	if args.export_graph is not None:
+		from plotting import export_graph
+		export_graph(spreader.agents, args.export_graph)
+
+	# a checkpoint of the last timestep is of a run that has finished, and was
+	# added to the results store then. Resuming it only writes the outputs that
+	# are replaced, not another copy of the run.
+	finished = False
+	if checkpoint_file is not None:
+		restore_model(spreader, checkpoint_arrays)
+		finished = spreader.timestep >= args.timestep
+		if finished:
+			logger.info("Checkpoint is of a finished run, it is not added to the results again")
+		else:
+			logger.info("Resuming simulation at timestep %d", spreader.timestep)
+	else:
+		streams.seed_global('agents')
+		logger.info("Beginning simulation.")
+
+		spreader.analytics(-1)
+		spreader.cvd_demographics.append({'M': 0, 'F': 0, 'imd1': 0, 'imd2': 0, 'imd3': 0, 'imd4': 0, 'imd5': 0, 'avg_age': 0, 'total': 0})
+	score_callback = score_threshold(args.stop_score, args.min_timesteps) if args.stop_score is not None else None
+	run = partial(spreader.simulation, args.timestep, checkpoint_every=args.checkpoint_every,
+		checkpoint_folder=checkpoint_folder, score_callback=score_callback)
+	if args.profile is not None:
+		timesteps, profile_lines = profile_run(run, args.profile)
+		for line in profile_lines:
+			logger.info(line)
+		logger.info("Profiles written: %s.prof, %s.folded", args.profile, args.profile)
+	else:
+		run()
+	spreader.sink.close()
+	spreader.progress.close()
 	spreader.print_simulation_metrics()
-	spreader.save_simulation_metrics()
+	spreader.print_timing()
+	if args.timing_json is not None:
+		spreader.timer.write_json(args.timing_json)
+		logger.info("Timing report: %s", args.timing_json)
+	spreader.save_simulation_metrics(append=not finished)
 	if args.mets:
-		spreader.save_behaviour_metrics()
+		spreader.save_behaviour_metrics(append=not finished)
+	if args.plots:
+		from plotting import plot_run
+		for path in plot_run(args.stream, results_store.RESULTS_FOLDER / stats_base_filename):
+			logger.info("Plot written: %s", path)
 
 
 if __name__ == "__main__":
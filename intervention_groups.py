@@ -0,0 +1,96 @@
+import copy
+import csv
+import logging
+
+from influence import RELATIONSHIPS, BEHAVIOURS, LEVELS
+
+# Intervention groups for the command line. The influence weights of a group
+# are read from a csv file of the weights that differ from the parameter
+# weights (inf_by_rel), one per row:
+#
+# 	relationship,workplace_type,behaviour,level,weight
+# 	Workplace,office,Smoking,2,0.05
+# 	Friendship,,Diet,*,0.2
+#
+# workplace_type is only read for Workplace rows, empty or * for all workplace
+# types, and level may be * for all levels. The agents of a group have
+# agent.intervention set to its number, 1 for the first group given, 2 for the
+# second and so on, either by the network or by assign_workplaces.
+
+COLUMNS = ['relationship', 'workplace_type', 'behaviour', 'level', 'weight']
+
+logger = logging.getLogger(__name__)
+
+
+# influence weights of an intervention group: a copy of inf_by_rel with the weights in the file at path
+def read_weights(path, inf_by_rel):
+	weights = copy.deepcopy(inf_by_rel)
+	relationships = {rel.lower(): rel for rel in RELATIONSHIPS}
+	behaviours = {behaviour: behaviour.capitalize() for behaviour in BEHAVIOURS}
+
+	with open(path, newline='') as file:
+		reader = csv.DictReader(file)
+		missing = [column for column in COLUMNS if column not in (reader.fieldnames or [])]
+		if len(missing) > 0:
+			raise ValueError(str(path) + ": missing columns " + ', '.join(missing))
+
+		for line, row in enumerate(reader, start=2):
+			rel = relationships.get(row['relationship'].strip().lower())
+			behaviour = behaviours.get(row['behaviour'].strip().lower())
+			if rel is None or behaviour is None:
+				raise ValueError(str(path) + ", line " + str(line) + ": unknown relationship or behaviour")
+
+			level = row['level'].strip()
+			levels = range(LEVELS) if level == '*' else [int(level)]
+
+			if rel == 'Workplace':
+				wtype = (row['workplace_type'] or '').strip()
+				if wtype in ('', '*'):
+					tables = list(weights[rel].values())
+				elif wtype in weights[rel]:
+					tables = [weights[rel][wtype]]
+				else:
+					raise ValueError(str(path) + ", line " + str(line) + ": unknown workplace type " + wtype)
+			else:
+				tables = [weights[rel]]
+
+			for table in tables:
+				for l in levels:
+					table[behaviour][l] = float(row['weight'])
+
+	return weights
+
+
+# the workplaces of a population as lists of agents, in the order of their first member
+def workplaces(agents):
+	seen = set()
+	found = list()
+	for agent in agents:
+		if len(agent.workplace) > 0 and id(agent) not in seen:
+			members = [agent] + list(agent.workplace)
+			seen.update(id(member) for member in members)
+			found.append(members)
+	return found
+
+
+# put every workplace in intervention group g (1 to group_count) with probability
+# share, and in no group otherwise, drawing from the numpy Generator rng. The agents
+# without a workplace are in no group. Returns the number of agents per group.
+def assign_workplaces(agents, group_count, share, rng):
+	if share < 0 or share * group_count > 1:
+		raise ValueError("the share of workplaces per intervention group must be between 0 and 1/" + str(group_count))
+
+	for agent in agents:
+		agent.intervention = 0
+
+	found = workplaces(agents)
+	groups = rng.choice(group_count + 1, size=len(found), p=[1 - share * group_count] + [share] * group_count)
+	sizes = [0] * (group_count + 1)
+	for members, group in zip(found, groups.tolist()):
+		for agent in members:
+			agent.intervention = group
+		sizes[group] = sizes[group] + len(members)
+
+	for group in range(1, group_count + 1):
+		logger.info("Intervention group %d: %d agents", group, sizes[group])
+	return sizes
@@ -0,0 +1,137 @@
+import hashlib
+import importlib.util
+import logging
+import os
+import random
+import shutil
+from pathlib import Path
+
+import numpy as np
+
+from population import Agent_Store
+from checkpoint import agent_arrays, agents_from_arrays
+from agent_table import Agent_Table
+
+# On-disk cache of generated networks, so runs that only differ in the
+# influence weights or the intervention do not generate the same network again.
+# A network is keyed by the target size, the seed of the 'network' stream it is
+# generated from (see random_streams) and a hash of what generates it: the
+# files in the parameter folder, the source of the generator modules and the
+# layout of the cache. It is stored as the flat arrays of
+# checkpoint.agent_arrays, one uncompressed .npy file per array, and as the
+# arrays of an Agent_Table (see Agent_Table.table_arrays) in a subfolder:
+#
+# 	networks/<config>_n-<size>_netseed-<network seed>_<hash>/<array>.npy
+# 	networks/<config>_n-<size>_netseed-<network seed>_<hash>/table/<array>.npy
+#
+# The flat arrays are memory-mapped read only, so processes using the same
+# cached network share its pages, and every Spread_Model gets its own agents
+# rebuilt from them. Compact runs skip the rebuilding: their table is made over
+# the table arrays memory-mapped copy-on-write, so it only gets its own copy of
+# the pages it changes. The cached network itself is never modified.
+
+NETWORK_FOLDER = Path("./networks/")
+
+# modules whose source decides the network generated from a seed
+GENERATOR_MODULES = ['network', 'agent']
+
+# version of the layout of the cached arrays, changed when it changes
+CACHE_FORMAT = 2
+
+logger = logging.getLogger(__name__)
+
+
+# hash of the names and contents of the files in a parameter folder
+def parameter_hash(parameter_folder):
+	digest = hashlib.sha256()
+	folder = Path(parameter_folder)
+	for path in sorted(folder.rglob('*')):
+		if path.is_file() and '__pycache__' not in path.parts:
+			digest.update(str(path.relative_to(folder)).encode())
+			with open(path, 'rb') as file:
+				digest.update(file.read())
+	return digest.hexdigest()
+
+
+# hash of the source files of the generator modules, found without importing them
+def generator_hash():
+	digest = hashlib.sha256()
+	for name in GENERATOR_MODULES:
+		digest.update(name.encode())
+		spec = importlib.util.find_spec(name)
+		if spec is not None and spec.origin is not None and os.path.isfile(spec.origin):
+			with open(spec.origin, 'rb') as file:
+				digest.update(file.read())
+	return digest.hexdigest()
+
+
+# folder of a cached network
+def network_path(folder, parameter_folder, target_size, network_seed):
+	config_name = os.path.basename(os.path.normpath(parameter_folder))
+	digest = hashlib.sha256()
+	for part in [parameter_hash(parameter_folder), generator_hash(), str(CACHE_FORMAT)]:
+		digest.update(part.encode())
+	name = config_name + "_n-" + str(target_size) + "_netseed-" + str(network_seed) + "_" + digest.hexdigest()[:16]
+	return Path(folder) / name
+
+
+# write the arrays of a network, and those of its table into the table
+# subfolder. They are written to a temporary folder that is renamed into place,
+# so a crash while writing never leaves a broken network. If another process
+# wrote the same network first, its copy is kept.
+def write_network(arrays, path):
+	path = Path(path)
+	path.parent.mkdir(parents=True, exist_ok=True)
+
+	tmp_folder = path.parent / ("." + path.name + "." + str(os.getpid()) + ".tmp")
+	(tmp_folder / "table").mkdir(parents=True)
+	for key, array in arrays.items():
+		np.save(tmp_folder / (key + ".npy"), array)
+	for key, array in Agent_Table(arrays).table_arrays().items():
+		np.save(tmp_folder / "table" / (key + ".npy"), array)
+	try:
+		os.rename(tmp_folder, path)
+	except OSError:
+		shutil.rmtree(tmp_folder)
+
+
+# memory-mapped arrays of a cached network, read only unless mmap_mode is 'c'
+# (copy-on-write)
+def read_network(path, mmap_mode='r'):
+	return {file.stem: np.load(file, mmap_mode=mmap_mode).view(np.ndarray) for file in sorted(Path(path).glob("*.npy"))}
+
+
+# folder of the network for a parameter folder, size and network seed,
+# generated and added to the cache if it is not there yet. The network is
+# generated with the global random module seeded with network_seed, which is
+# what Random_Streams.seed_global('network') does for an uncached run whose
+# streams give Random_Streams.int_seed('network') == network_seed.
+def cached_network(parameter_folder, param, target_size, network_seed, folder=NETWORK_FOLDER):
+	path = network_path(folder, parameter_folder, target_size, network_seed)
+	if not path.is_dir():
+		from network import Network
+
+		random.seed(network_seed)
+		store = Agent_Store(Network(param).generate_agents(target_size))
+		write_network(agent_arrays(store), path)
+		logger.info("Network cached: %s", path)
+	else:
+		logger.info("Using cached network: %s", path)
+	return path
+
+
+# arrays of a cached network, see cached_network
+def network_arrays(parameter_folder, param, target_size, network_seed, folder=NETWORK_FOLDER):
+	return read_network(cached_network(parameter_folder, param, target_size, network_seed, folder))
+
+
+# fresh agents of a cached network, see cached_network
+def cached_agents(parameter_folder, param, target_size, network_seed, folder=NETWORK_FOLDER):
+	return agents_from_arrays(network_arrays(parameter_folder, param, target_size, network_seed, folder))
+
+
+# Agent_Table of a cached network over its table arrays memory-mapped
+# copy-on-write, see cached_network
+def cached_table(parameter_folder, param, target_size, network_seed, folder=NETWORK_FOLDER):
+	path = cached_network(parameter_folder, param, target_size, network_seed, folder)
+	return Agent_Table.from_table_arrays(read_network(path / "table", mmap_mode='c'))
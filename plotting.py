@@ -0,0 +1,196 @@
+import argparse
+import csv
+import json
+import logging
+import sys
+from pathlib import Path
+
+from influence import BEHAVIOURS, LEVELS
+from sinks import Death_Record
+import results_store
+
+# Plots and graph export. matplotlib and networkx take longer to import than
+# the whole simulation, so the rest of the code only imports this module when
+# plots or a graph are asked for (--plots, --export-graph), and the functions
+# here only import the package they need: plots need matplotlib, the graph
+# export networkx.
+# Plots are drawn on matplotlib Figures without pyplot, so no display or GUI
+# backend is needed. They are made from the saved results, so a run can also
+# be plotted afterwards:
+#
+# 	python plotting.py results/n-1000_t-10_config-cfg_timesteps.csv
+# 	python plotting.py --replicates n-1000_t-10_config-cfg
+
+logger = logging.getLogger(__name__)
+
+# the values of the behaviour metric shards plotted for replicates, by position
+# (see Spread_Model.behaviour_metrics)
+REPLICATE_METRICS = [(1, "Average CVD risk"), (2, "Level 2 smoking"), (3, "Level 2 inactivity"),
+	(4, "Level 2 alcohol"), (5, "Level 2 diet")]
+
+
+# a value read from a .jsonl stream, nan for the null of a metric that was not computed
+def number(value):
+	return float('nan') if value is None else value
+
+
+# the timesteps streamed to a .jsonl file or to <prefix>_timesteps.csv by a
+# sink (see sinks), as a dictionary of lists: t, avg_cvd and prevalence[behaviour][level]
+def read_timesteps(path):
+	timesteps = {'t': [], 'avg_cvd': [], 'prevalence': {behaviour: [[] for l in range(LEVELS)] for behaviour in BEHAVIOURS}}
+
+	def add(t, avg_cvd, prevalence):
+		timesteps['t'].append(t)
+		timesteps['avg_cvd'].append(avg_cvd)
+		for behaviour in BEHAVIOURS:
+			for l in range(LEVELS):
+				timesteps['prevalence'][behaviour][l].append(prevalence(behaviour, l))
+
+	path = str(path)
+	if path.endswith('.jsonl'):
+		with open(path) as file:
+			for line in file:
+				record = json.loads(line)
+				if record['type'] == 'timestep':
+					add(record['t'], number(record['avg_cvd']), lambda behaviour, l: number(record['prevalence'][behaviour][l]))
+	else:
+		if not path.endswith('_timesteps.csv'):
+			path = path + "_timesteps.csv"
+		with open(path, newline='') as file:
+			for row in csv.DictReader(file):
+				add(int(row['t']), float(row['avg_cvd']), lambda behaviour, l: float(row[behaviour + '_' + str(l)]))
+
+	return timesteps
+
+
+# average CVD risk over the timesteps
+def plot_avg_cvd(timesteps, path):
+	from matplotlib.figure import Figure
+
+	figure = Figure(figsize=(6, 4))
+	axes = figure.subplots()
+	axes.plot(timesteps['t'], timesteps['avg_cvd'], marker='.')
+	axes.set_xlabel("Timestep")
+	axes.set_ylabel("Average CVD risk")
+	figure.tight_layout()
+	figure.savefig(path)
+	return path
+
+
+# prevalence of every level of every behaviour over the timesteps, one panel per behaviour
+def plot_prevalence(timesteps, path):
+	from matplotlib.figure import Figure
+
+	figure = Figure(figsize=(10, 7))
+	panels = figure.subplots(2, (len(BEHAVIOURS) + 1) // 2, sharex=True, sharey=True).ravel()
+	for axes, behaviour in zip(panels, BEHAVIOURS):
+		for l in range(LEVELS):
+			axes.plot(timesteps['t'], timesteps['prevalence'][behaviour][l], label="level " + str(l))
+		axes.set_title(behaviour.capitalize())
+		axes.set_xlabel("Timestep")
+		axes.set_ylabel("Proportion of agents")
+	panels[0].legend()
+	figure.tight_layout()
+	figure.savefig(path)
+	return path
+
+
+# plots of the timesteps of a run streamed to results_path, written to
+# <prefix>_avg_cvd.png and <prefix>_prevalence.png. Returns the paths written.
+def plot_run(results_path, prefix):
+	timesteps = read_timesteps(results_path)
+	if len(timesteps['t']) == 0:
+		raise ValueError("no timesteps in " + str(results_path))
+	return [plot_avg_cvd(timesteps, str(prefix) + "_avg_cvd.png"),
+		plot_prevalence(timesteps, str(prefix) + "_prevalence.png")]
+
+
+# distribution over the replicates of an experiment of the end of run average
+# CVD risk and level 2 prevalences, from the behaviour metric shards in the
+# results store (written with --metrics). Returns the path written, None
+# without any runs.
+def plot_replicates(base_filename, path):
+	runs = results_store.load_behaviour_results(base_filename)
+	if len(runs) == 0:
+		return None
+
+	from matplotlib.figure import Figure
+
+	figure = Figure(figsize=(10, 4))
+	panels = figure.subplots(1, len(REPLICATE_METRICS))
+	for axes, (position, label) in zip(panels, REPLICATE_METRICS):
+		axes.boxplot([values[position] for values in runs])
+		axes.set_title(label, fontsize='small')
+		axes.set_xticks([])
+	figure.suptitle(str(len(runs)) + " runs of " + base_filename, fontsize='small')
+	figure.tight_layout()
+	figure.savefig(path)
+	return path
+
+
+# the network of a population as a networkx graph: a node per agent id with
+# its age, sex, imd and behaviour levels, an edge per pair of related agents
+# with the relationship as its attribute (the closest one for agents related
+# in more than one way)
+def network_graph(agents):
+	import networkx as nx
+
+	graph = nx.Graph()
+	for agent in agents:
+		graph.add_node(agent.uid, age=agent.age, sex=agent.sex, imd=agent.imd,
+			**{field: getattr(agent, field) for field in Death_Record._fields if field.endswith('_level')})
+
+	for relationship, name in [('friendship', 'friends'), ('workplace', 'workplace'), ('household', 'household')]:
+		for agent in agents:
+			for other in getattr(agent, name):
+				graph.add_edge(agent.uid, other.uid, relationship=relationship)
+	for agent in agents:
+		if agent.spouse is not None:
+			graph.add_edge(agent.uid, agent.spouse.uid, relationship='spouse')
+	return graph
+
+
+# write the network of a population to path, GraphML for .graphml, GEXF for
+# .gexf and an edge list with the relationships otherwise
+def export_graph(agents, path):
+	import networkx as nx
+
+	graph = network_graph(agents)
+	suffix = Path(path).suffix
+	if suffix == '.graphml':
+		nx.write_graphml(graph, path)
+	elif suffix == '.gexf':
+		nx.write_gexf(graph, path)
+	else:
+		nx.write_edgelist(graph, path, data=['relationship'])
+	logger.info("Network of %d agents and %d relationships written to %s", graph.number_of_nodes(),
+		graph.number_of_edges(), path)
+	return path
+
+
+def main():
+	parser = argparse.ArgumentParser(description="Plot the saved results of spread simulations")
+	parser.add_argument('results', help="streamed timesteps of a run (.jsonl or csv prefix), or with --replicates "
+		"the statistics base filename of an experiment")
+	parser.add_argument('--replicates', action='store_true', help="plot the behaviour metrics of all runs of an experiment")
+	parser.add_argument('--output', default=None, help="prefix of the plot files (default: next to the results)")
+	args = parser.parse_args()
+	logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+	if args.replicates:
+		output = args.output or str(results_store.RESULTS_FOLDER / args.results)
+		path = plot_replicates(args.results, output + "_replicates.png")
+		if path is None:
+			logger.warning("No behaviour metrics saved for %s", args.results)
+			return 1
+		logger.info("Plot written: %s", path)
+		return 0
+
+	output = args.output or str(args.results).removesuffix('.jsonl').removesuffix('_timesteps.csv')
+	for path in plot_run(args.results, output):
+		logger.info("Plot written: %s", path)
+	return 0
+
+
+if __name__ == "__main__":
+	sys.exit(main())
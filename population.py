@@ -0,0 +1,60 @@
+from operator import attrgetter
+
+from influence import BEHAVIOURS
+
+# the behaviour levels of an agent as a tuple, in the order of BEHAVIOURS
+agent_levels = attrgetter(*[behaviour + '_level' for behaviour in BEHAVIOURS])
+
+
+# Store of the agents in a simulation. Every agent gets a stable integer id
+# (agent.uid) which is its slot in the store. Removing an agent leaves a
+# tombstone (None) in its slot, so removal is O(1) and the ids of the other
+# agents never change. Iterating the store yields the living agents in their
+# original order. Slots that are None when the store is created (e.g. when it
+# is restored from a checkpoint) are tombstones from the start.
+class Agent_Store:
+	def __init__(self, agents):
+		self.slots = list(agents)
+		self.size = 0
+
+		for uid, agent in enumerate(self.slots):
+			if agent is not None:
+				agent.uid = uid
+				self.size = self.size + 1
+
+	def __len__(self):
+		return self.size
+
+	def __iter__(self):
+		for agent in self.slots:
+			if agent is not None:
+				yield agent
+
+	def __contains__(self, agent):
+		uid = getattr(agent, 'uid', None)
+		return uid is not None and uid < len(self.slots) and self.slots[uid] is agent
+
+	# agent by id, None if the agent has been removed
+	def __getitem__(self, uid):
+		return self.slots[uid]
+
+	# remove an agent by leaving a tombstone in its slot
+	def remove(self, agent):
+		if agent not in self:
+			raise ValueError("agent " + str(getattr(agent, 'uid', None)) + " is not in the store")
+		self.slots[agent.uid] = None
+		self.size = self.size - 1
+
+
+# Convert the spouse/household/workplace/friend lists of the agents into sets,
+# so an agent can be removed from its neighbours in O(1) when it dies.
+# The order in which neighbours are visited does not change the incoming
+# influence, as every neighbour at the same level adds the same weight.
+# The agents are changed in place: a Spread_Model owns the agents it is given,
+# and already removes the dead from their neighbours, so callers that want the
+# population as it was must hand the model a copy.
+def neighbour_sets(agents):
+	for agent in agents:
+		agent.household = set(agent.household)
+		agent.workplace = set(agent.workplace)
+		agent.friends = set(agent.friends)
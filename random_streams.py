@@ -0,0 +1,48 @@
+import random
+
+import numpy as np
+
+# Independent random number streams for the parts of a simulation, all spawned
+# from one seed with numpy's SeedSequence. The same seed always gives the same
+# streams, and the streams of different seeds (e.g. the replicates spawned by
+# replicate_seeds) do not overlap, so runs can be reproduced and split across
+# processes safely.
+# 	network	builds the population and its relationships
+# 	agents	the behaviour and cvd draws made by the agents
+# 	model	draws made by Spread_Model itself, e.g. in batches over all agents
+# 	intervention	the workplaces put in the intervention groups
+# Network and Agent draw from the global random module, so their streams are
+# handed over by seeding it (seed_global) right before they are used.
+
+# new streams are added at the end, so the streams of a seed stay the same
+STREAMS = ['network', 'agents', 'model', 'intervention']
+
+
+class Random_Streams:
+	# seed is an int, a SeedSequence or None for fresh entropy from the OS
+	def __init__(self, seed=None):
+		if isinstance(seed, np.random.SeedSequence):
+			self.seed_sequence = seed
+		else:
+			self.seed_sequence = np.random.SeedSequence(seed)
+		self.children = dict(zip(STREAMS, self.seed_sequence.spawn(len(STREAMS))))
+		self.generators = dict()
+
+	# the seed these streams were spawned from, pass it as --seed to reproduce a run
+	@property
+	def seed(self):
+		return self.seed_sequence.entropy
+
+	# numpy Generator of a stream, created once and then shared
+	def generator(self, name):
+		if name not in self.generators:
+			self.generators[name] = np.random.default_rng(self.children[name])
+		return self.generators[name]
+
+	# integer seed derived from a stream, for code that takes a plain seed
+	def int_seed(self, name):
+		return int(self.children[name].generate_state(1, dtype=np.uint64)[0])
+
+	# seed the global random module from a stream
+	def seed_global(self, name):
+		random.seed(self.int_seed(name))
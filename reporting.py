@@ -0,0 +1,86 @@
+import json
+import logging
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+# Reporting for the simulations, built on the logging module. Messages about
+# every timestep are logged at DEBUG, so they cost nothing but a level check
+# unless --verbose is given. Progress is reported at INFO at most once every
+# interval seconds by a Progress_Reporter, which can also write a machine
+# readable progress stream of one JSON object per line for the parallel runners.
+
+logger = logging.getLogger(__name__)
+
+
+# log plain messages to stdout at INFO, WARNING when quiet and DEBUG when verbose
+def configure_logging(quiet=False, verbose=False):
+	if verbose:
+		level = logging.DEBUG
+	elif quiet:
+		level = logging.WARNING
+	else:
+		level = logging.INFO
+
+	handler = logging.StreamHandler(sys.stdout)
+	handler.setFormatter(logging.Formatter("%(message)s"))
+	root = logging.getLogger()
+	root.handlers[:] = [handler]
+	root.setLevel(level)
+
+
+# silence everything below WARNING for a while, e.g. for the runs of a calibration
+@contextmanager
+def quiet_logging():
+	previous = logging.root.manager.disable
+	logging.disable(logging.INFO)
+	try:
+		yield
+	finally:
+		logging.disable(previous)
+
+
+# file for a progress stream, '-' for stderr. The file is opened for appending
+# and written one whole line at a time, so several processes can share it.
+def open_progress(path):
+	if path is None:
+		return None
+	if path == '-':
+		return sys.stderr
+	return open(path, 'a', buffering=1)
+
+
+class Progress_Reporter:
+	# interval is the minimum number of seconds between progress messages,
+	# stream an open progress stream (see open_progress) and run an id for the
+	# run in the stream, e.g. the seed of a replicate
+	def __init__(self, interval=5.0, stream=None, run=None):
+		self.interval = interval
+		self.stream = stream
+		self.run = run
+		self.start = time.monotonic()
+		self.last = None
+
+	# write an event to the progress stream
+	def event(self, event, **fields):
+		if self.stream is not None:
+			record = dict(event=event, run=self.run, pid=os.getpid(), elapsed=round(time.monotonic() - self.start, 3))
+			record.update(fields)
+			self.stream.write(json.dumps(record) + "\n")
+
+	# report a finished timestep of a model running maxLength timesteps
+	def timestep(self, model, i, maxLength):
+		now = time.monotonic()
+		self.event('timestep', t=i, timesteps=maxLength, population=len(model.agents), deaths=len(model.deceased[i]))
+
+		if self.last is None or now - self.last >= self.interval or i + 1 == maxLength:
+			self.last = now
+			logger.info("Timestep %d of %d finished, population %d, %.1f s", i + 1, maxLength, len(model.agents), now - self.start)
+
+	def finished(self, model, maxLength):
+		self.event('finished', timesteps=model.timestep, max_timesteps=maxLength, population=len(model.agents))
+
+	def close(self):
+		if self.stream is not None and self.stream is not sys.stderr:
+			self.stream.close()
@@ -0,0 +1,126 @@
+import os
+import pickle
+import time
+import uuid
+from pathlib import Path
+
+import numpy as np
+
+from incidence import AGE_BINS
+
+# Append-only store for the results of many runs. Every run is written to its
+# own small .npz shard in a per-experiment folder, so adding a run never reads
+# or rewrites earlier runs and concurrent jobs writing the same base filename
+# cannot overwrite each other. Shards are written to a temporary name and
+# renamed into place, so readers never see a partial shard.
+#
+# 	results/<base_filename>_runs/incidence/<shard>.npz
+# 	results/<base_filename>_runs/behaviour/<shard>.npz
+
+# rows and columns of the incidence table stored in each incidence shard
+INCIDENCE_ROWS = AGE_BINS + ['total']
+INCIDENCE_METRICS = ['f_incidents', 'f_years', 'f_rate', 'm_incidents', 'm_years', 'm_rate']
+
+RESULTS_FOLDER = Path("./results/")
+
+
+# folder holding the shards of one kind of result for an experiment
+def shard_folder(base_filename, kind):
+	return RESULTS_FOLDER / (base_filename + "_runs") / kind
+
+
+# unique, time ordered shard name
+def shard_name():
+	return str(time.time_ns()).zfill(20) + "-" + str(os.getpid()) + "-" + uuid.uuid4().hex[:8] + ".npz"
+
+
+# write the arrays of one run as a new shard and return its path
+def write_shard(base_filename, kind, **arrays):
+	folder = shard_folder(base_filename, kind)
+	folder.mkdir(parents=True, exist_ok=True)
+
+	name = shard_name()
+	tmp_file = folder / ("." + name + ".tmp")
+	with open(tmp_file, 'wb') as file:
+		np.savez(file, **arrays)
+	os.replace(tmp_file, folder / name)
+	return folder / name
+
+
+# paths of all the shards of a kind, oldest first
+def shard_paths(base_filename, kind):
+	folder = shard_folder(base_filename, kind)
+	if not folder.is_dir():
+		return []
+	return sorted(path for path in folder.iterdir() if path.suffix == '.npz')
+
+
+# load the shards of a kind one at a time
+def iter_shards(base_filename, kind):
+	for path in shard_paths(base_filename, kind):
+		with np.load(path) as shard:
+			yield {key: shard[key] for key in shard.files}
+
+
+# store the incidence table of one run, rows as returned by Spread_Model.incidence_rows,
+# and the number of timesteps it ran, fewer than asked for when it was stopped early
+def write_incidence_run(base_filename, rows, timesteps):
+	table = np.array([row[1:] for row in rows], dtype=np.float64)
+	return write_shard(base_filename, 'incidence', table=table,
+		rows=np.array(INCIDENCE_ROWS), metrics=np.array(INCIDENCE_METRICS), timesteps=np.array(timesteps))
+
+
+# store the behaviour metric values of one run
+def write_behaviour_run(base_filename, values):
+	return write_shard(base_filename, 'behaviour', values=np.array(values, dtype=np.float64))
+
+
+# iterate over the incidence tables of all runs, each a (rows, metrics) array,
+# with the number of timesteps the run ran, None where it was not recorded.
+# runs from an old style _all.pkl file come first.
+def iter_incidence_runs(base_filename):
+	legacy_file = RESULTS_FOLDER / (base_filename + "_all.pkl")
+	if os.path.isfile(legacy_file):
+		with open(legacy_file, 'rb') as pkl_file:
+			legacy = pickle.load(pkl_file)
+		for r in range(len(legacy['total']['f_incidents'])):
+			yield np.array([[legacy[row][metric][r] for metric in INCIDENCE_METRICS] for row in INCIDENCE_ROWS]), None
+
+	for shard in iter_shards(base_filename, 'incidence'):
+		yield shard['table'], int(shard['timesteps']) if 'timesteps' in shard else None
+
+
+# iterate over the behaviour metric values of all runs, old style pickle first
+def iter_behaviour_runs(base_filename):
+	legacy_file = RESULTS_FOLDER / (base_filename + "behaviour_metrics_all.pkl")
+	if os.path.isfile(legacy_file):
+		with open(legacy_file, 'rb') as pkl_file:
+			for values in pickle.load(pkl_file):
+				yield list(values)
+
+	for shard in iter_shards(base_filename, 'behaviour'):
+		yield shard['values'].tolist()
+
+
+# merge all incidence runs into the layout of the old _all.pkl file:
+# results[age group or 'total'][metric] is a list with one value per run.
+# results['timesteps'] lists the number of timesteps of every run, so runs that
+# were stopped early can be told apart, None for runs that did not record it.
+def load_incidence_results(base_filename):
+	results = {row: {metric: [] for metric in INCIDENCE_METRICS} for row in INCIDENCE_ROWS}
+	results['timesteps'] = list()
+	for table, timesteps in iter_incidence_runs(base_filename):
+		results['timesteps'].append(timesteps)
+		for r, row in enumerate(INCIDENCE_ROWS):
+			for m, metric in enumerate(INCIDENCE_METRICS):
+				value = table[r, m].item()
+				# counts are stored as floats in the shards, give them back as ints
+				if not metric.endswith('_rate'):
+					value = int(value)
+				results[row][metric].append(value)
+	return results
+
+
+# all behaviour metric runs as a list of lists, the layout of the old pickle file
+def load_behaviour_results(base_filename):
+	return list(iter_behaviour_runs(base_filename))
@@ -0,0 +1,345 @@
+import argparse
+import csv
+import logging
+import os
+import random
+from pathlib import Path
+
+import numpy as np
+
+from influence import Population_Arrays, BEHAVIOURS, LEVELS, RELATIONSHIPS, compile_groups, group_index, workplace_index
+from incidence import Age_Histogram, SEX_INDEX, incidence_rows
+from population import Agent_Store, agent_levels
+from random_streams import Random_Streams
+from intervention_groups import read_weights, assign_workplaces
+from intervention import load_parameters, network_agents, write_latest_incidence
+from reporting import configure_logging
+
+# Several scenarios of the same starting population advanced together in one
+# run, e.g. a baseline and a few interventions. The scenarios share the
+# network and the agents; what differs between them is the influence weights
+# of their intervention groups and which agents are in those groups. The state
+# of every scenario is kept in arrays with a scenario axis:
+# 	levels	(scenarios, behaviours, agents)
+# 	alive	(scenarios, agents)
+# The incoming influence of all scenarios is one sparse matrix product per
+# relationship type, and the scenarios draw common random numbers: the same
+# uniforms decide the level changes and the cvd events of an agent in every
+# scenario, so differences between the scenarios are not drowned by noise.
+#
+# The next levels and cvd chances come from a rule, see Agent_Rule and Array_Rule.
+# Spread_Model keeps its state in the agents themselves, so it still runs one
+# scenario at a time; the batch uses the agents as scratch space instead.
+
+logger = logging.getLogger(__name__)
+
+
+class Scenario:
+	# name of the scenario, inter_inf the influence weights of its intervention
+	# groups (see Spread_Model) and groups the group of every agent by id, None
+	# for the groups set in agent.intervention
+	def __init__(self, name, inter_inf=(), groups=None):
+		self.name = name
+		self.inter_inf = list(inter_inf)
+		self.groups = groups
+
+
+# Next levels and cvd chances from the agents' own rules, next_*_level and
+# update_risk_levels. For every scenario the levels of the agents are set from
+# the arrays and the rules are applied one agent at a time, starting from the
+# same state of the global random module, so the scenarios draw common random
+# numbers as long as the agents make the same number of draws in each. The
+# rules run for every agent alive in any scenario, also in the scenarios where
+# it has died, whose results are then dropped, so an agent gets the same draws
+# in every scenario however the deaths differ between them. agent.intervention
+# is set to the agent's group in the scenario, as the levels are.
+class Agent_Rule:
+	def step(self, batch, inc):
+		state = random.getstate()
+		levels = batch.levels.copy()
+		cv_chance = np.zeros(batch.alive.shape)
+		rows = np.flatnonzero(batch.alive.any(axis=0))
+
+		for s in range(len(batch.scenarios)):
+			random.setstate(state)
+			current = batch.levels[s][:, rows].T.tolist()
+			groups = batch.groups[s][rows].tolist()
+			incoming = inc[s][:, rows].transpose(1, 0, 2).tolist()
+			updated = list()
+			chances = list()
+
+			for k, i in enumerate(rows.tolist()):
+				agent = batch.agents[i]
+				agent.smoking_level, agent.alcohol_level, agent.diet_level, agent.inactivity_level = current[k]
+				agent.intervention = groups[k]
+				agent.next_smoking_level(dict(enumerate(incoming[k][0])))
+				agent.next_alcohol_level(dict(enumerate(incoming[k][1])))
+				agent.next_diet_level(dict(enumerate(incoming[k][2])))
+				agent.next_inactivity_level(dict(enumerate(incoming[k][3])))
+				agent.update_risk_levels()
+				updated.append(agent_levels(agent))
+				chances.append(agent.cv_chance)
+
+			if len(rows) > 0:
+				living = batch.alive[s, rows]
+				levels[s][:, rows[living]] = np.array(updated, dtype=levels.dtype).T[:, living]
+				cv_chance[s, rows[living]] = np.array(chances)[living]
+		return levels, cv_chance
+
+
+# Next levels and cvd chances computed on the arrays. level_rule is a
+# vectorised level rule, a function
+#
+# 	level_rule(inc, levels, uniforms, out=None) -> next levels
+#
+# where inc is the incoming influence, shape (scenarios, behaviours, agents, levels),
+# levels the current levels, shape (scenarios, behaviours, agents), and uniforms
+# one uniform draw per behaviour and agent, shape (behaviours, agents), shared by
+# all scenarios. With out, the next levels are written into that array (e.g. the
+# next level buffer of an agent_table.Agent_Table) and it is returned. A level
+# rule only stands in for the agents' own rule when it reproduces it, as the
+# rules for the synthetic agents in benchmarks/level_rules.py do.
+# risk_rule(levels, batch) gives the cvd chances, shape (scenarios, agents), for
+# the next levels, None for no cvd events. The uniforms of the level rule are
+# drawn from the batch's rng.
+class Array_Rule:
+	def __init__(self, level_rule, risk_rule=None):
+		self.level_rule = level_rule
+		self.risk_rule = risk_rule
+
+	def step(self, batch, inc):
+		uniforms = batch.rng.random(batch.levels.shape[1:])
+		levels = self.level_rule(inc, batch.levels, uniforms)
+		if self.risk_rule is None:
+			return levels, np.zeros(batch.alive.shape)
+		return levels, self.risk_rule(levels, batch)
+
+
+class Scenario_Batch:
+	# agents is the shared starting population, inf_by_rel the influence weights
+	# outside the interventions, scenarios a list of Scenario, rule an Agent_Rule
+	# (the default) or Array_Rule and rng the numpy Generator of the common
+	# random numbers
+	def __init__(self, agents, inf_by_rel, scenarios, rule=None, rng=None):
+		self.agents = Agent_Store(agents)
+		self.scenarios = list(scenarios)
+		self.rule = rule if rule is not None else Agent_Rule()
+		self.rng = rng if rng is not None else np.random.default_rng()
+
+		self.arrays = Population_Arrays(self.agents)
+		n = len(self.arrays.agents)
+		count = len(self.scenarios)
+
+		self.levels = np.repeat(self.arrays.levels[None], count, axis=0)
+		self.alive = np.repeat(self.arrays.alive[None], count, axis=0)
+		self.sex = np.zeros(n, dtype=np.intp)
+		self.imd = np.zeros(n, dtype=np.intp)
+		for agent in self.agents:
+			self.sex[agent.uid] = SEX_INDEX[agent.sex]
+			self.imd[agent.uid] = agent.imd
+
+		# the weights of the groups of all scenarios in one table, see compile_groups.
+		# row_index[s, i] is the row of agent i in scenario s in the flattened
+		# [group and workplace type][behaviour * level] tables of weight_rows.
+		wp_index = workplace_index(self.agents)
+		wtype = np.zeros(n, dtype=np.intp)
+		for agent in self.agents:
+			wtype[agent.uid] = wp_index.get(agent.workplace_type, 0)
+
+		# groups[s, i] is the intervention group of agent i in scenario s
+		tables = list()
+		self.groups = np.zeros((count, n), dtype=np.intp)
+		self.row_index = np.zeros((count, n), dtype=np.intp)
+		offset = 0
+		for s, scenario in enumerate(self.scenarios):
+			table = compile_groups(inf_by_rel, scenario.inter_inf, wp_index)
+			self.groups[s] = scenario.groups if scenario.groups is not None else group_index(self.agents, len(table))
+			if np.max(self.groups[s], initial=0) >= len(table):
+				raise ValueError("scenario " + scenario.name + " has agents in groups without weights")
+			self.row_index[s] = (offset + self.groups[s]) * table.shape[2] + wtype
+			tables.append(table)
+			offset = offset + len(table)
+
+		weights = np.concatenate(tables)
+		self.weight_rows = [weights[:, r].reshape(-1, len(BEHAVIOURS) * LEVELS) for r in range(len(RELATIONSHIPS))]
+
+		# per scenario histograms of the cvd events and person years, see incidence
+		self.cvd_hist = [Age_Histogram() for scenario in self.scenarios]
+		self.person_years_hist = [Age_Histogram() for scenario in self.scenarios]
+
+		# per timestep lists with one entry per scenario
+		self.population = list()
+		self.deaths = list()
+		self.behaviour_prevalence = [self.prevalence()]
+
+		self.timestep = 0
+
+	# ages of the agents, shared by all scenarios
+	def ages(self):
+		return np.fromiter((agent.age for agent in self.arrays.agents), dtype=np.intp, count=len(self.arrays.agents))
+
+	# incoming influence of every agent in every scenario, shape (scenarios, behaviours, agents, levels).
+	# The level indicators of all scenarios are stacked as columns, so each
+	# relationship type takes a single sparse product for all of them.
+	def incoming_influence(self):
+		count, behaviours, n = self.levels.shape
+		indicators = (self.levels[..., None] == np.arange(LEVELS)) & self.alive[:, None, :, None]
+		indicators = indicators.transpose(2, 0, 1, 3).reshape(n, count * behaviours * LEVELS).astype(np.float64)
+
+		inc = np.zeros((n, count, behaviours * LEVELS))
+		for r, rel in enumerate(RELATIONSHIPS):
+			counts = (self.arrays.adjacency[rel] @ indicators).reshape(n, count, behaviours * LEVELS)
+			for s in range(count):
+				inc[:, s] += counts[:, s] * self.weight_rows[r][self.row_index[s]]
+		return inc.reshape(n, count, behaviours, LEVELS).transpose(1, 2, 0, 3)
+
+	# share of the living agents at each level, shape (scenarios, behaviours, levels)
+	def prevalence(self):
+		count, behaviours, n = self.levels.shape
+		shares = np.zeros((count, behaviours, LEVELS))
+		for s in range(count):
+			living = self.alive[s].sum()
+			for b in range(behaviours):
+				shares[s, b] = np.bincount(self.levels[s, b, self.alive[s]], minlength=LEVELS) / max(living, 1)
+		return shares
+
+	# advance all scenarios by timestep i
+	def step(self, i):
+		self.population.append(self.alive.sum(axis=1).tolist())
+
+		inc = self.incoming_influence()
+		levels, cv_chance = self.rule.step(self, inc)
+		self.levels = np.where(self.alive[:, None, :], levels, self.levels)
+
+		ages = self.ages()
+		for s in range(len(self.scenarios)):
+			self.person_years_hist[s].add_population(self.sex[self.alive[s]], ages[self.alive[s]])
+
+		# one draw per agent, compared with its cvd chance in every scenario
+		events = self.alive & (self.rng.random(len(ages)) < cv_chance)
+		for s in range(len(self.scenarios)):
+			self.cvd_hist[s].add_population(self.sex[events[s]], ages[events[s]])
+		self.deaths.append(events.sum(axis=1).tolist())
+		self.alive = self.alive & ~events
+
+		# the survivors of any scenario age, age does not depend on the scenario
+		for row in np.flatnonzero(self.alive.any(axis=0)).tolist():
+			self.arrays.agents[row].age_up()
+
+		self.behaviour_prevalence.append(self.prevalence())
+
+	# run the timesteps up to maxLength, returns the number of timesteps completed
+	def run(self, maxLength):
+		for i in range(self.timestep, maxLength):
+			self.step(i)
+			self.timestep = i + 1
+			logger.debug("Timestep %d: population %s, deaths %s", i, self.population[-1], self.deaths[-1])
+		return self.timestep
+
+	# rows of the per timestep results: [scenario, t, population, deaths, prevalence of every behaviour level]
+	def result_rows(self):
+		rows = list()
+		for s, scenario in enumerate(self.scenarios):
+			for t in range(self.timestep):
+				shares = self.behaviour_prevalence[t + 1][s].ravel().tolist()
+				rows.append([scenario.name, t, self.population[t][s], self.deaths[t][s]] + shares)
+		return rows
+
+	# write the per timestep results of all scenarios and the incidence table of each
+	def save(self, base_filename):
+		results_folder = Path("./results/")
+		results_folder.mkdir(exist_ok=True)
+		path = results_folder / (base_filename + "_scenarios.csv")
+		with open(path, 'w', newline='') as file:
+			writer = csv.writer(file)
+			writer.writerow(['scenario', 't', 'population', 'deaths'] +
+				[behaviour + "_" + str(l) for behaviour in BEHAVIOURS for l in range(LEVELS)])
+			writer.writerows(self.result_rows())
+		logger.info("Output file (scenarios): %s", path)
+
+		for s, scenario in enumerate(self.scenarios):
+			write_latest_incidence(base_filename + "_scenario-" + scenario.name,
+				incidence_rows(self.cvd_hist[s], self.person_years_hist[s]))
+
+	# log the total cvd events of every scenario against the first one
+	def print_comparison(self):
+		first = self.cvd_hist[0].counts.sum()
+		for s, scenario in enumerate(self.scenarios):
+			events = self.cvd_hist[s].counts.sum()
+			years = self.person_years_hist[s].counts.sum()
+			logger.info("Scenario %s: %d cvd events in %d person years, %+d against %s", scenario.name, events, years,
+				events - first, self.scenarios[0].name)
+
+
+# intervention group of every agent by id when the workplaces are put in
+# group_count groups with share (see assign_workplaces), drawing from rng. The
+# agents are given back with the groups they had, so the groups of one
+# scenario never leak into the agents shared with the others.
+def assigned_groups(agents, group_count, share, rng):
+	original = [(agent, agent.intervention) for agent in agents]
+	assign_workplaces(agents, group_count, share, rng)
+	groups = group_index(agents, group_count + 1)
+	for agent, group in original:
+		agent.intervention = group
+	return groups
+
+
+# scenario from its command line form NAME=WEIGHTS[+WEIGHTS...], see intervention_groups
+def parse_scenario(option, inf_by_rel):
+	name, separator, files = option.partition('=')
+	if separator == '' or name == '':
+		raise ValueError("expected NAME=WEIGHTS[+WEIGHTS...], not " + option)
+	return Scenario(name, [read_weights(path, inf_by_rel) for path in files.split('+') if path != ''])
+
+
+def main():
+	parser = argparse.ArgumentParser(description="scenarios - run a baseline and intervention scenarios together on one population.")
+	parser.add_argument(dest='parameter_folder', help='folder of csv files with parameter specifications')
+	parser.add_argument('-n', '--size', action='store', default=3500, type=int, help='target population size')
+	parser.add_argument('-t', '--timestep', action='store', default=10, type=int, help='number of timesteps')
+	parser.add_argument('-e', '--exp_id', default='None', help='experiment ID for output file prefix')
+	parser.add_argument('--scenario', dest='scenarios', action='append', default=[], metavar='NAME=WEIGHTS[+WEIGHTS]',
+		help='an intervention scenario with a csv of weights per intervention group; repeat for several scenarios')
+	parser.add_argument('--intervention-share', dest='intervention_share', action='store', default=None, type=float,
+		help='share of the workplaces put in each intervention group (default: the groups set by the network)')
+	parser.add_argument('--seed', action='store', default=None, type=int, help='seed of the run (random if not given)')
+	parser.add_argument('--network-cache', dest='network_cache', action='store_true',
+		help='reuse the network generated for the same parameters, size and seed from ./networks/')
+	parser.add_argument('-q', '--quiet', action='store_true', help='only report warnings and errors')
+	parser.add_argument('-v', '--verbose', action='store_true', help='report every timestep')
+	args = parser.parse_args()
+
+	configure_logging(args.quiet, args.verbose)
+	streams = Random_Streams(args.seed)
+	logger.info("Seed: %d", streams.seed)
+	param = load_parameters(args.parameter_folder)
+	config_name = os.path.basename(os.path.normpath(args.parameter_folder))
+	base_filename = "n-" + str(args.size) + "_t-" + str(args.timestep) + "_config-" + config_name
+	if args.exp_id != 'None':
+		base_filename = "expID-" + args.exp_id + "_" + base_filename
+
+	agents = Agent_Store(network_agents(args.parameter_folder, param, args.size, streams, args.network_cache))
+	inf_by_rel = param.get_inf_by_rel()
+
+	# the baseline has no intervention groups. With a share every scenario draws
+	# its workplaces from the same 'intervention' stream, so scenarios with the
+	# same number of groups put the same workplaces in them.
+	scenarios = [Scenario('baseline', groups=np.zeros(len(agents.slots), dtype=np.intp))]
+	for option in args.scenarios:
+		scenario = parse_scenario(option, inf_by_rel)
+		if args.intervention_share is not None:
+			logger.info("Scenario %s:", scenario.name)
+			scenario.groups = assigned_groups(agents, len(scenario.inter_inf), args.intervention_share,
+				Random_Streams(streams.seed).generator('intervention'))
+		scenarios.append(scenario)
+
+	batch = Scenario_Batch(agents, inf_by_rel, scenarios, rng=streams.generator('model'))
+	streams.seed_global('agents')
+	logger.info("Running %d scenarios on %d agents.", len(scenarios), len(agents))
+	batch.run(args.timestep)
+	batch.print_comparison()
+	batch.save(base_filename)
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,171 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from influence import RELATIONSHIPS, BEHAVIOURS, LEVELS
+
+# Influence step of a single run split over worker processes. The agents are
+# cut into shards of consecutive ids with about the same number of neighbours,
+# and the boundaries are moved so that a household stays in one shard where it
+# can. As all agents move to their next levels at once, the shards are
+# independent: every worker reads the level indicators of the whole population
+# and writes the incoming influence of its own rows, and, with a level rule,
+# the next levels of its own columns. The arrays the workers read and write are
+# kept in multiprocessing.shared_memory blocks:
+# 	indicators	(agents, behaviours * levels) one-hot levels, filled by the main process
+# 	inc		(agents, behaviours * levels) incoming influence, one row range per shard
+# 	levels0/1	the two level buffers of the agent table (see Agent_Table.swap_levels)
+# 	uniforms	(behaviours, agents) draws of the level rule, drawn by the main process
+# The adjacency matrices and the weights do not change during a run and are
+# handed to the workers once when they start. The workers are forked, so level
+# rules do not have to be picklable. The results do not depend on the number
+# of workers: every row is computed exactly as by Influence_Engine, and all
+# random numbers are drawn by the main process from the model's stream.
+
+# shards per worker, so a slow shard does not hold up the whole step
+SHARDS_PER_WORKER = 4
+
+# the arrays of a worker process, set by init_worker
+worker_state = dict()
+
+
+# row bounds [bounds[k], bounds[k + 1]) of about count shards of an influence
+# engine's agents. Every row costs one plus its number of neighbours. A
+# boundary is moved forward to the next row where no spouse or housemate of the
+# rows before it lies at or after it, unless that is past the next boundary.
+def shard_bounds(engine, count):
+	n = len(engine.agents)
+	work = np.ones(n)
+	for adjacency in engine.adjacency.values():
+		work = work + np.diff(adjacency.indptr)
+	targets = np.searchsorted(np.cumsum(work), work.sum() * np.arange(1, count) / count)
+
+	# reach[i] is the highest row a spouse or housemate of rows 0 to i has
+	reach = np.arange(n)
+	for rel in ['Spouse', 'Household']:
+		adjacency = engine.adjacency[rel]
+		filled = np.flatnonzero(np.diff(adjacency.indptr) > 0)
+		if len(filled) > 0:
+			reach[filled] = np.maximum(reach[filled], np.maximum.reduceat(adjacency.indices, adjacency.indptr[filled]))
+	reach = np.maximum.accumulate(reach)
+	clean = np.flatnonzero(reach[:-1] < np.arange(1, n)) + 1
+
+	bounds = targets
+	if len(clean) > 0:
+		snapped = clean[np.minimum(np.searchsorted(clean, targets), len(clean) - 1)]
+		limits = np.append(targets[1:], n)
+		bounds = np.where((snapped >= targets) & (snapped < limits), snapped, targets)
+	return np.unique(np.concatenate([[0], bounds, [n]]))
+
+
+# attach the shared arrays and keep the static arrays of a run in this worker
+def init_worker(specs, adjacency, weights, level_rule):
+	worker_state['blocks'] = [shared_memory.SharedMemory(name=name) for name, shape, dtype in specs.values()]
+	worker_state['arrays'] = {key: np.ndarray(shape, dtype=dtype, buffer=block.buf)
+		for (key, (name, shape, dtype)), block in zip(specs.items(), worker_state['blocks'])}
+	worker_state['adjacency'] = adjacency
+	worker_state['weights'] = weights
+	worker_state['level_rule'] = level_rule
+
+
+# incoming influence of the rows start to stop, computed as in
+# Influence_Engine.incoming_influence, and with current (0 or 1, the current
+# level buffer) their next levels from the level rule
+def shard_step(start, stop, current=None):
+	arrays = worker_state['arrays']
+	indicators = arrays['indicators']
+	inc = arrays['inc'][start:stop]
+	inc[...] = 0.0
+	for adjacency, weights in zip(worker_state['adjacency'], worker_state['weights']):
+		inc += (adjacency[start:stop] @ indicators) * weights[start:stop]
+
+	if current is not None:
+		levels = arrays['levels' + str(current)]
+		next_levels = arrays['levels' + str(1 - current)]
+		shard_inc = inc.reshape(stop - start, len(BEHAVIOURS), LEVELS).transpose(1, 0, 2)
+		worker_state['level_rule'](shard_inc[None], levels[:, start:stop][None], arrays['uniforms'][:, start:stop],
+			out=next_levels[:, start:stop][None])
+	return stop - start
+
+
+class Sharded_Influence:
+	# engine is the Influence_Engine of the run and workers the number of worker
+	# processes. With a level rule (see scenarios.Array_Rule) the workers also compute the
+	# next levels, into the level buffers of table, an agent_table.Agent_Table
+	# whose level arrays are moved to shared memory until close.
+	def __init__(self, engine, workers, level_rule=None, table=None):
+		self.engine = engine
+		self.table = table
+		self.bounds = shard_bounds(engine, workers * SHARDS_PER_WORKER)
+		n = len(engine.agents)
+
+		self.blocks = dict()
+		self.indicators = self.share('indicators', np.zeros((n, len(BEHAVIOURS) * LEVELS)))
+		self.inc = self.share('inc', np.zeros((n, len(BEHAVIOURS) * LEVELS)))
+		self.buffers = None
+		if level_rule is not None:
+			self.buffers = [self.share('levels0', table.levels), self.share('levels1', table.next_levels)]
+			self.uniforms = self.share('uniforms', np.zeros(table.levels.shape))
+			table.levels, table.next_levels = self.buffers
+			table.scalar_views()
+			engine.sync_levels()
+
+		specs = {key: (block.name, shape, dtype) for key, (block, shape, dtype) in self.blocks.items()}
+		self.executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork'),
+			initializer=init_worker, initargs=(specs, [engine.adjacency[rel] for rel in RELATIONSHIPS],
+				[engine.weights[rel] for rel in RELATIONSHIPS], level_rule))
+
+	# copy of array in a new shared memory block
+	def share(self, key, array):
+		block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+		self.blocks[key] = (block, array.shape, array.dtype.str)
+		shared = np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)
+		shared[...] = array
+		return shared
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
+
+	# run shard_step on every shard, returns once all shards are done
+	def run_shards(self, current=None):
+		starts = self.bounds[:-1].tolist()
+		stops = self.bounds[1:].tolist()
+		for rows in self.executor.map(shard_step, starts, stops, [current] * len(starts)):
+			pass
+
+	# incoming influence of every agent, shape (n, behaviours, levels), the same
+	# as Influence_Engine.incoming_influence
+	def incoming_influence(self):
+		self.indicators[...] = self.engine.level_indicators()
+		self.run_shards()
+		return self.inc.reshape(len(self.inc), len(BEHAVIOURS), LEVELS)
+
+	# next levels of all agents from the level rule, with one uniform per
+	# behaviour and agent id drawn from rng, then swapped in (see
+	# Spread_Model.buffered_levels, which this computes shard by shard)
+	def next_levels(self, rng):
+		current = 0 if self.table.levels is self.buffers[0] else 1
+		rng.random(out=self.uniforms)
+		self.indicators[...] = self.engine.level_indicators()
+		self.run_shards(current)
+		self.table.swap_levels()
+
+	# stop the workers and free the shared memory, the level buffers of the
+	# table are copied back to private arrays first
+	def close(self):
+		self.executor.shutdown()
+		if self.buffers is not None:
+			self.table.levels = np.array(self.table.levels)
+			self.table.next_levels = np.array(self.table.next_levels)
+			self.table.scalar_views()
+			self.engine.sync_levels()
+		self.indicators = self.inc = self.buffers = self.uniforms = None
+		for block, shape, dtype in self.blocks.values():
+			block.close()
+			block.unlink()
+		self.blocks = dict()
@@ -0,0 +1,158 @@
+import csv
+import json
+import math
+import os
+from collections import namedtuple
+
+from influence import BEHAVIOURS, LEVELS
+
+# Lightweight record of an agent that died, kept instead of the Agent object
+Death_Record = namedtuple('Death_Record', ['uid', 't', 'age', 'sex', 'imd', 'cv_chance',
+	'smoking_level', 'alcohol_level', 'diet_level', 'inactivity_level'])
+
+CVD_METRICS = ['M', 'F', 'imd1', 'imd2', 'imd3', 'imd4', 'imd5', 'avg_age', 'total']
+
+
+def death_record(agent, t):
+	return Death_Record(agent.uid, t, agent.age, agent.sex, agent.imd, agent.cv_chance,
+		agent.smoking_level, agent.alcohol_level, agent.diet_level, agent.inactivity_level)
+
+
+# Streaming output for the per-timestep analytics and the death records of a
+# simulation. Spread_Model hands every timestep to the sink as soon as it is
+# finished, so nothing has to be kept in memory until the end of the run.
+# The base sink discards everything.
+class Output_Sink:
+	# timestep is a dictionary with the keys t, population, avg_cvd,
+	# prevalence ([behaviour][level]) and cvd (the cvd_demographics of the step)
+	def write_timestep(self, timestep):
+		pass
+
+	def write_deaths(self, records):
+		pass
+
+	def close(self):
+		pass
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
+
+
+# flat row of a timestep dictionary, in the order of timestep_fields
+def timestep_row(timestep):
+	row = [timestep['t'], timestep['population'], timestep['avg_cvd']]
+	for behaviour in BEHAVIOURS:
+		row.extend(timestep['prevalence'][behaviour])
+	row.extend(timestep['cvd'].get(metric, 0) for metric in CVD_METRICS)
+	return row
+
+
+def timestep_fields():
+	fields = ['t', 'population', 'avg_cvd']
+	for behaviour in BEHAVIOURS:
+		fields.extend(behaviour + '_' + str(l) for l in range(LEVELS))
+	fields.extend('cvd_' + metric for metric in CVD_METRICS)
+	return fields
+
+
+# drop the rows of timesteps from timestep on from a csv stream file, which has
+# the timestep in its column t. The file is rewritten through a temporary file,
+# so a crash never leaves it half written.
+def truncate_csv(path, timestep):
+	tmp_path = str(path) + ".tmp"
+	with open(path, newline='') as file, open(tmp_path, 'w', newline='') as tmp_file:
+		reader = csv.reader(file)
+		writer = csv.writer(tmp_file)
+		header = next(reader)
+		column = header.index('t')
+		writer.writerow(header)
+		writer.writerows(row for row in reader if int(row[column]) < timestep)
+	os.replace(tmp_path, path)
+
+
+# drop the records of timesteps from timestep on from a jsonl stream file, as truncate_csv
+def truncate_jsonl(path, timestep):
+	tmp_path = str(path) + ".tmp"
+	with open(path) as file, open(tmp_path, 'w') as tmp_file:
+		tmp_file.writelines(line for line in file if json.loads(line)['t'] < timestep)
+	os.replace(tmp_path, path)
+
+
+# writes the timesteps to <base_path>_timesteps.csv and the deaths to <base_path>_deaths.csv.
+# with append, existing files are continued (e.g. when resuming from a checkpoint)
+# after dropping the rows of timestep and later, which a run that went on past
+# its last checkpoint has already written and the resumed run writes again
+class Csv_Sink(Output_Sink):
+	def __init__(self, base_path, append=False, timestep=None):
+		timestep_path = str(base_path) + "_timesteps.csv"
+		death_path = str(base_path) + "_deaths.csv"
+		new_files = not (append and os.path.isfile(timestep_path) and os.path.isfile(death_path))
+		if not new_files and timestep is not None:
+			truncate_csv(timestep_path, timestep)
+			truncate_csv(death_path, timestep)
+
+		self.timestep_file = open(timestep_path, 'w' if new_files else 'a', newline='')
+		self.death_file = open(death_path, 'w' if new_files else 'a', newline='')
+		self.timestep_writer = csv.writer(self.timestep_file)
+		self.death_writer = csv.writer(self.death_file)
+		if new_files:
+			self.timestep_writer.writerow(timestep_fields())
+			self.death_writer.writerow(Death_Record._fields)
+
+	def write_timestep(self, timestep):
+		self.timestep_writer.writerow(timestep_row(timestep))
+		self.timestep_file.flush()
+
+	def write_deaths(self, records):
+		self.death_writer.writerows(records)
+		self.death_file.flush()
+
+	def close(self):
+		self.timestep_file.close()
+		self.death_file.close()
+
+
+# value with nan replaced by None (null) in it and in the lists and dictionaries
+# in it, e.g. the metrics of a timestep that were not computed (see Spread_Model.analytics)
+def json_value(value):
+	if isinstance(value, float) and math.isnan(value):
+		return None
+	if isinstance(value, dict):
+		return {key: json_value(item) for key, item in value.items()}
+	if isinstance(value, (list, tuple)):
+		return [json_value(item) for item in value]
+	return value
+
+
+# writes one JSON object per line, {"type": "timestep", ...} or {"type": "death", ...}.
+# Metrics that were not computed for a timestep are null, so every line is
+# strict JSON. append and timestep as for Csv_Sink
+class Jsonl_Sink(Output_Sink):
+	def __init__(self, path, append=False, timestep=None):
+		if append and timestep is not None and os.path.isfile(path):
+			truncate_jsonl(path, timestep)
+		self.file = open(path, 'a' if append else 'w')
+
+	def write_timestep(self, timestep):
+		self.file.write(json.dumps(json_value(dict(type='timestep', **timestep)), allow_nan=False) + "\n")
+		self.file.flush()
+
+	def write_deaths(self, records):
+		for record in records:
+			self.file.write(json.dumps(json_value(dict(type='death', **record._asdict())), allow_nan=False) + "\n")
+		self.file.flush()
+
+	def close(self):
+		self.file.close()
+
+
+# sink for an output path: .jsonl files get a Jsonl_Sink, anything else is
+# used as the base path of a Csv_Sink. A run resumed at a timestep appends
+# with that timestep, so the records of it and later timesteps are replaced.
+def open_sink(path, append=False, timestep=None):
+	if str(path).endswith('.jsonl'):
+		return Jsonl_Sink(path, append=append, timestep=timestep)
+	return Csv_Sink(path, append=append, timestep=timestep)
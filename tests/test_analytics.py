@@ -0,0 +1,89 @@
+import argparse
+import json
+import math
+import random
+import subprocess
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / "benchmarks"))
+
+from synthetic import load_config, synthetic_population
+from analytics import Analytics_Schedule, parse_cadence, parse_cadences, cadence_option, STEP, END, OFF
+from intervention import Spread_Model, ANALYTICS_METRICS
+from reporting import quiet_logging
+from sinks import open_sink
+
+CONFIG = load_config()
+
+
+def test_parse_cadence():
+	assert [parse_cadence(cadence) for cadence in ['step', 'end', 'off', '1', '10']] == [STEP, END, OFF, 1, 10]
+	for cadence in ['0', '-2', 'x', '']:
+		with pytest.raises(ValueError):
+			parse_cadence(cadence)
+	assert parse_cadences(['prevalence=end', 'avg_cvd=10']) == {'prevalence': END, 'avg_cvd': 10}
+
+
+# the timesteps (-1 for the initial population) a cadence is due in a run of 10 timesteps
+def due_timesteps(cadence):
+	schedule = Analytics_Schedule()
+	schedule.register('metric', None, cadence)
+	return [i for i in range(-1, 10) if schedule.due('metric', i, final=(i == 9))]
+
+
+def test_cadences():
+	assert due_timesteps('step') == list(range(-1, 10))
+	assert due_timesteps(3) == [-1, 2, 5, 8, 9]
+	assert due_timesteps('end') == [9]
+	assert due_timesteps('off') == []
+
+
+def test_cadence_option():
+	parse = cadence_option(ANALYTICS_METRICS)
+	assert parse('avg_cvd=5') == ('avg_cvd', 5)
+	for option in ['bogus=2', 'avg_cvd=0', 'avg_cvd', 'prevalence=sometimes']:
+		with pytest.raises(argparse.ArgumentTypeError):
+			parse(option)
+
+
+# bad --analytics options are rejected while the command line is parsed,
+# before the parameters are loaded or the network is built
+@pytest.mark.parametrize('option', ['bogus=2', 'avg_cvd=0'])
+def test_command_line_rejects(tmp_path, option):
+	result = subprocess.run([sys.executable, str(ROOT / "intervention.py"), str(tmp_path), '--analytics', option],
+		capture_output=True, text=True, cwd=tmp_path)
+	assert result.returncode == 2
+	assert "argument --analytics" in result.stderr
+
+
+# metrics are computed at their cadence and always at the end. The timesteps
+# a metric is not computed for are nan in the histories and null in a jsonl
+# stream, which is strict JSON.
+def test_model_cadences(tmp_path):
+	path = tmp_path / "run.jsonl"
+	with quiet_logging():
+		agents = synthetic_population(600, CONFIG, np.random.default_rng(1))
+		model = Spread_Model(agents, CONFIG['inf_by_rel'], None, "test", rng=np.random.default_rng(2), sink=open_sink(path),
+			analytics={'avg_cvd': 2, 'prevalence': 'end'})
+		random.seed(3)
+		model.analytics(-1)
+		model.simulation(5)
+		model.sink.close()
+
+	computed = [not math.isnan(value) for value in model.avg_cvd]
+	assert computed == [True, False, True, False, True, True]
+	assert [not math.isnan(value['smoking'][0]) for value in model.behaviour_prevalence] == [False] * 5 + [True]
+
+	def reject(constant):
+		raise ValueError(constant)
+	records = [json.loads(line, parse_constant=reject) for line in path.read_text().splitlines()]
+	timesteps = [record for record in records if record['type'] == 'timestep']
+	assert [record['avg_cvd'] is not None for record in timesteps] == [False, True, False, True, True]
+	assert timesteps[0]['prevalence']['smoking'] == [None, None, None]
+	assert timesteps[-1]['prevalence']['smoking'][0] is not None
@@ -0,0 +1,88 @@
+import sys
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from calibration import Calibration, weight_keys, weights_to_vector, vector_to_weights, latin_hypercube
+
+# The search logic of Calibration on scripted scores: the runs of a candidate
+# are replaced by a score per replicate, so the tests do not need a network.
+
+TIMESTEP = 10
+
+
+# Calibration whose runs score a candidate by its first weight plus the
+# replicate's offset, and stop at timestep 1 when that is above the threshold
+class Scripted_Calibration(Calibration):
+	def __init__(self, replicates=3, reject_factor=2.0):
+		self.template = {'Spouse': {'Smoking': {0: 0.1, 1: 0.2}}}
+		self.keys = weight_keys(self.template)
+		self.replicates = replicates
+		self.timestep = TIMESTEP
+		self.reject_factor = reject_factor
+		self.seeds = list(range(replicates))
+		self.executor = None
+		self.cache = dict()
+		self.best_score = float('inf')
+		self.best_vector = None
+		self.tasks = list()
+
+	def run(self, tasks, stop_score):
+		self.tasks.extend(tasks)
+		results = list()
+		for vector, seed in tasks:
+			score = vector[0] + 0.01 * seed
+			results.append((score, 1 if score > stop_score else TIMESTEP))
+		return results
+
+
+def test_weight_vectors_round_trip():
+	template = {'Spouse': {'Smoking': {0: 0.1, 1: 0.2}}, 'Friendship': {'Diet': {2: 0.3}}}
+	keys = weight_keys(template)
+	assert keys == [('Spouse', 'Smoking', 0), ('Spouse', 'Smoking', 1), ('Friendship', 'Diet', 2)]
+	vector = weights_to_vector(template, keys)
+	assert vector.tolist() == [0.1, 0.2, 0.3]
+	assert vector_to_weights(vector * 2, keys, template) == {'Spouse': {'Smoking': {0: 0.2, 1: 0.4}}, 'Friendship': {'Diet': {2: 0.6}}}
+	assert template['Spouse']['Smoking'][0] == 0.1
+
+
+def test_latin_hypercube_strata():
+	points = latin_hypercube(8, np.zeros(3), np.ones(3), np.random.default_rng(0))
+	for d in range(3):
+		assert sorted(np.floor(points[:, d] * 8).astype(int).tolist()) == list(range(8))
+
+
+# evaluated vectors come from the cache, repeated vectors are run once
+def test_cache():
+	calibration = Scripted_Calibration()
+	assert calibration.evaluate([[1.0, 0.0], [1.0, 0.0]]) == [1.01, 1.01]
+	assert len(calibration.tasks) == 3
+	assert calibration.evaluate([[1.0, 0.0], [2.0, 0.0]])[0] == 1.01
+	assert calibration.tasks[3:] == [((2.0, 0.0), seed) for seed in range(3)]
+	assert calibration.cache[(1.0, 0.0)] == (1.01, 3, TIMESTEP)
+
+
+# candidates scoring worse than reject_factor times the best score on their
+# first replicate are not run on the others, and never become the best
+def test_reject_factor():
+	calibration = Scripted_Calibration(reject_factor=2.0)
+	calibration.evaluate([[1.0, 0.0]])
+	assert calibration.best_score == 1.01
+
+	calibration.tasks = list()
+	calibration.evaluate([[1.5, 0.0], [3.0, 0.0]])
+	assert [seed for vector, seed in calibration.tasks if vector == (1.5, 0.0)] == [0, 1, 2]
+	assert [seed for vector, seed in calibration.tasks if vector == (3.0, 0.0)] == [0]
+	assert calibration.cache[(3.0, 0.0)] == (3.0, 1, 1)
+	assert calibration.best_vector == (1.0, 0.0)
+
+
+# the threshold of a batch uses the best complete score of the batch itself
+def test_reject_within_first_batch():
+	calibration = Scripted_Calibration(reject_factor=1.5)
+	calibration.evaluate([[1.0, 0.0], [2.0, 0.0]])
+	assert [seed for vector, seed in calibration.tasks if vector == (2.0, 0.0)] == [0]
+	assert calibration.best_vector == (1.0, 0.0)
+	assert calibration.best_weights() == {'Spouse': {'Smoking': {0: 1.0, 1: 0.0}}}
@@ -0,0 +1,70 @@
+import random
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / "benchmarks"))
+
+from synthetic import load_config, synthetic_population, synthetic_risk
+from intervention import Spread_Model
+from influence import BEHAVIOURS
+from population import agent_levels
+from scenarios import Array_Rule
+from level_rules import proportional_rule
+from reporting import quiet_logging
+
+# The running level counts and cvd sum of Spread_Model against counts taken
+# from the whole population after every timestep. Runs with an array rule move
+# the counts by the level changes between the two level buffers.
+
+CONFIG = load_config()
+
+
+# level counts and cvd sum of the living agents of a model
+def population_counts(model):
+	counts = [[0] * 3 for behaviour in BEHAVIOURS]
+	cvd_sum = 0.0
+	for agent in model.agents:
+		for b, level in enumerate(agent_levels(agent)):
+			counts[b][level] += 1
+		cvd_sum += agent.cv_chance
+	return counts, cvd_sum
+
+
+# run a model for 6 timesteps, checking its counts after every timestep
+def check_counts(**options):
+	checked = list()
+
+	def check(model):
+		counts, cvd_sum = population_counts(model)
+		assert model.level_counts == counts
+		assert model.cvd_sum == pytest.approx(cvd_sum, rel=1e-9)
+		checked.append(model.timestep)
+		return False
+
+	with quiet_logging():
+		agents = synthetic_population(1500, CONFIG, np.random.default_rng(1))
+		model = Spread_Model(agents, CONFIG['inf_by_rel'], None, "test", rng=np.random.default_rng(2), **options)
+		random.seed(3)
+		model.analytics(-1)
+		model.simulation(7, score_callback=check)
+	assert checked == list(range(1, 7))
+	assert model.total_deaths > 0
+
+
+@pytest.mark.parametrize('options', [dict(), dict(compact=True), dict(compact=True, batch_cvd=True)])
+def test_counts_agent_rules(options):
+	check_counts(**options)
+
+
+@pytest.mark.parametrize('batch_cvd', [False, True])
+def test_counts_array_rule(batch_cvd):
+	check_counts(rule=Array_Rule(proportional_rule(CONFIG['resistance']), synthetic_risk(CONFIG)), batch_cvd=batch_cvd)
+
+
+def test_counts_array_rule_without_risk_rule():
+	check_counts(rule=Array_Rule(proportional_rule(CONFIG['resistance'])), batch_cvd=True)
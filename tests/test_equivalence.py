@@ -0,0 +1,115 @@
+import random
+import sys
+from pathlib import Path
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / "benchmarks"))
+
+from synthetic import load_config, synthetic_population, synthetic_risk
+from intervention import Spread_Model
+from checkpoint import read_checkpoint, restore_model, latest_checkpoint
+from influence import BEHAVIOURS
+from scenarios import Array_Rule
+from level_rules import proportional_rule
+from reporting import quiet_logging
+
+# The different ways of running Spread_Model give the same results: the array
+# engine and the per-agent loop, compact and default agents, any number of
+# influence workers, and a run resumed from a checkpoint and a straight run.
+# All runs are on small synthetic populations (see benchmarks/synthetic.py).
+
+SIZE = 1500
+STEPS = 5
+CONFIG = load_config()
+
+
+def population():
+	return synthetic_population(SIZE, CONFIG, np.random.default_rng(1))
+
+
+def array_rule():
+	return Array_Rule(proportional_rule(CONFIG['resistance']), synthetic_risk(CONFIG))
+
+
+def new_model(agents, **options):
+	return Spread_Model(agents, CONFIG['inf_by_rel'], None, "test", rng=np.random.default_rng(2), **options)
+
+
+# a model of the synthetic population run for steps timesteps from a fixed seed
+def run(steps=STEPS, **options):
+	with quiet_logging():
+		model = new_model(population(), **options)
+		random.seed(3)
+		model.analytics(-1)
+		model.simulation(steps)
+	return model
+
+
+# everything a run reports
+def results(model):
+	return {'population': list(model.population), 'avg_cvd': list(model.avg_cvd),
+		'prevalence': [[prevalence[behaviour] for behaviour in BEHAVIOURS] for prevalence in model.behaviour_prevalence],
+		'cvd': model.cvd_hist.counts.tolist(), 'person_years': model.person_years_hist.counts.tolist(),
+		'deaths': model.total_deaths}
+
+
+def test_array_engine_incoming_influence_matches_loop_totals():
+	model = new_model(population(), array_engine=True)
+	inc = model.engine.incoming_influence()
+	for agent in model.agents:
+		expected = np.zeros((len(BEHAVIOURS), 3))
+		neighbours = [(0, [agent.spouse] if agent.spouse is not None else []), (1, agent.household),
+			(2, agent.workplace), (3, agent.friends)]
+		for r, others in neighbours:
+			for other in others:
+				for b, behaviour in enumerate(BEHAVIOURS):
+					level = getattr(other, behaviour + '_level')
+					expected[b, level] = expected[b, level] + model.group_weights[0, r, 0, b, level]
+		np.testing.assert_allclose(inc[agent.uid], expected, rtol=1e-12, atol=1e-15)
+
+
+def test_array_engine_matches_loop():
+	assert results(run(array_engine=True)) == results(run())
+
+
+def test_array_engine_matches_loop_with_batch_cvd():
+	assert results(run(array_engine=True, batch_cvd=True)) == results(run(batch_cvd=True))
+
+
+def test_compact_matches_default():
+	assert results(run(compact=True)) == results(run(array_engine=True))
+	assert results(run(compact=True, batch_cvd=True)) == results(run(array_engine=True, batch_cvd=True))
+
+
+def test_influence_workers_match_one_worker():
+	assert results(run(array_engine=True, influence_workers=3)) == results(run(array_engine=True))
+
+
+def test_influence_workers_match_one_worker_with_array_rule():
+	single = results(run(rule=array_rule(), batch_cvd=True))
+	assert results(run(rule=array_rule(), batch_cvd=True, influence_workers=3)) == single
+
+
+def resumed(tmp_path, **options):
+	with quiet_logging():
+		model = new_model(population(), **options)
+		random.seed(3)
+		model.analytics(-1)
+		model.simulation(STEPS, checkpoint_every=2, checkpoint_folder=tmp_path)
+
+		agents, arrays = read_checkpoint(latest_checkpoint(tmp_path))
+		model = new_model(agents, **options)
+		restore_model(model, arrays)
+		model.simulation(STEPS)
+	return model
+
+
+def test_resume_matches_straight_run(tmp_path):
+	assert results(resumed(tmp_path)) == results(run())
+
+
+def test_resume_matches_straight_run_compact(tmp_path):
+	assert results(resumed(tmp_path, compact=True, batch_cvd=True)) == results(run(compact=True, batch_cvd=True))
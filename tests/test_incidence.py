@@ -0,0 +1,52 @@
+import sys
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from incidence import Age_Histogram, AGE_BINS, SEXES, age_bin
+
+# The age bins of Age_Histogram are those of the if/elif ladder they replaced:
+# 25-29 up to 80-84 in steps of five years, anything younger or older untracked.
+
+
+# the age bin of the original ladder, None for an untracked age
+def ladder_bin(age):
+	for low in range(25, 85, 5):
+		if low <= age <= low + 4:
+			return str(low) + "-" + str(low + 4)
+	return None
+
+
+def test_age_bin_matches_ladder():
+	for age in range(0, 200):
+		k = age_bin(age)
+		assert (AGE_BINS[k] if k >= 0 else None) == ladder_bin(age)
+
+
+def test_add_and_add_population_agree():
+	rng = np.random.default_rng(1)
+	sexes = rng.integers(0, len(SEXES), 5000)
+	ages = rng.integers(0, 200, 5000)
+
+	one_by_one = Age_Histogram()
+	for s, age in zip(sexes.tolist(), ages.tolist()):
+		one_by_one.add(SEXES[s], age)
+	at_once = Age_Histogram()
+	at_once.add_population(sexes, ages)
+
+	assert np.array_equal(one_by_one.counts, at_once.counts)
+	expected = sum(1 for age in ages.tolist() if ladder_bin(age) is not None)
+	assert at_once.counts.sum() == expected
+
+
+def test_as_dict_layout():
+	histogram = Age_Histogram()
+	histogram.add('F', 27)
+	histogram.add('F', 84)
+	histogram.add('M', 85)
+	counts = histogram.as_dict()
+	assert counts['F']['25-29'] == 1 and counts['F']['80-84'] == 1
+	assert sum(counts['M'].values()) == 0
+	assert histogram.total('F') == 2
@@ -0,0 +1,79 @@
+import copy
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / "benchmarks"))
+
+from synthetic import load_config, synthetic_population
+from agent_table import Agent_Table
+from intervention_groups import read_weights, assign_workplaces, workplaces
+
+CONFIG = load_config()
+
+
+def weights_file(tmp_path, text):
+	path = tmp_path / "weights.csv"
+	path.write_text("relationship,workplace_type,behaviour,level,weight\n" + text)
+	return path
+
+
+def test_read_weights(tmp_path):
+	inf_by_rel = CONFIG['inf_by_rel']
+	before = copy.deepcopy(inf_by_rel)
+	path = weights_file(tmp_path, "Workplace,office,Smoking,2,0.9\nfriendship,,diet,*,0.2\nworkplace,*,Alcohol,0,0.7\n")
+	weights = read_weights(path, inf_by_rel)
+
+	expected = copy.deepcopy(before)
+	expected['Workplace']['office']['Smoking'][2] = 0.9
+	expected['Friendship']['Diet'] = {0: 0.2, 1: 0.2, 2: 0.2}
+	for wtype in expected['Workplace']:
+		expected['Workplace'][wtype]['Alcohol'][0] = 0.7
+	assert weights == expected
+	assert inf_by_rel == before
+
+
+@pytest.mark.parametrize('text', ["Workplace,office,Smoking,2\n", "Neighbour,,Smoking,2,0.5\n",
+	"Spouse,,Sleep,2,0.5\n", "Workplace,farm,Smoking,2,0.5\n"])
+def test_read_weights_errors(tmp_path, text):
+	path = weights_file(tmp_path, text)
+	if text.count(',') < 4:
+		path.write_text("relationship,workplace_type,behaviour,level\n" + text)
+	with pytest.raises(ValueError):
+		read_weights(path, CONFIG['inf_by_rel'])
+
+
+# whole workplaces are put in a group, the agents without one are in none
+def test_assign_workplaces():
+	agents = synthetic_population(2000, CONFIG, np.random.default_rng(1))
+	sizes = assign_workplaces(agents, 2, 0.3, np.random.default_rng(5))
+
+	for members in workplaces(agents):
+		assert len(set(agent.intervention for agent in members)) == 1
+	assert all(agent.intervention == 0 for agent in agents if len(agent.workplace) == 0)
+	assert sizes[1:] == [sum(agent.intervention == g for agent in agents) for g in range(1, 3)]
+	assert sum(sizes) == sum(len(members) for members in workplaces(agents))
+	assert sizes[1] > 0 and sizes[2] > 0
+
+	again = synthetic_population(2000, CONFIG, np.random.default_rng(1))
+	assign_workplaces(again, 2, 0.3, np.random.default_rng(5))
+	assert [agent.intervention for agent in again] == [agent.intervention for agent in agents]
+
+
+# a new assignment replaces the groups of an earlier one, also on compact agents
+def test_assign_workplaces_replaces_groups():
+	table = Agent_Table.from_agents(synthetic_population(1000, CONFIG, np.random.default_rng(1)))
+	assign_workplaces(table, 1, 0.5, np.random.default_rng(5))
+	assert table.columns['intervention'].max() == 1
+	assert assign_workplaces(table, 1, 0.0, np.random.default_rng(5))[1] == 0
+	assert table.columns['intervention'].max() == 0
+
+
+@pytest.mark.parametrize('share', [-0.1, 0.6])
+def test_assign_workplaces_share(share):
+	with pytest.raises(ValueError):
+		assign_workplaces(synthetic_population(100, CONFIG, np.random.default_rng(1)), 2, share, np.random.default_rng(5))
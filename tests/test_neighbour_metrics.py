@@ -0,0 +1,153 @@
+import random
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / "benchmarks"))
+
+from synthetic import load_config, synthetic_population
+from intervention import Spread_Model
+from reporting import quiet_logging
+
+# Spread_Model.neighbour_metrics against the per-agent loop it replaced. The
+# loop counted an inactive agent with an inactive spouse into
+# inactive_spouse_exercises (inactive_spouse_exercises = inactive_spouse_inactive + 1),
+# which neighbour_metrics fixes, so the loop is run with and without that bug.
+
+CONFIG = load_config()
+
+
+def proportion(part, whole):
+	return part / whole if whole > 0 else float('nan')
+
+
+# the counts of the original loop over the agents
+def loop_counts(agents, spouse_bug=False):
+	c = dict.fromkeys(['hm_a', 'hm_b', 'hm_c', 'hm_d', 'hm_eq', 'hm_es', 'hm_sq', 'hm_ss',
+		'sp_a', 'sp_b', 'sp_c', 'sp_d', 'sp_eq', 'sp_es', 'sp_sq', 'sp_ss', 'fr_eq', 'fr_es', 'fr_sq', 'fr_ss',
+		'sp_ae', 'sp_ie', 'sp_ai', 'sp_ii', 'fr_ae', 'fr_ie', 'fr_ai', 'fr_ii'], 0)
+
+	for agent in agents:
+		hm_lvl2_alc = any(hm.alcohol_level == 2 for hm in agent.household)
+		hm_lvl1_smo = any(hm.smoking_level == 1 for hm in agent.household)
+		hm_lvl2_smo = any(hm.smoking_level == 2 for hm in agent.household)
+
+		if hm_lvl2_alc and agent.alcohol_level > 0:
+			c['hm_a'] += 1
+		elif hm_lvl2_alc and agent.alcohol_level == 0:
+			c['hm_b'] += 1
+		elif not hm_lvl2_alc and agent.alcohol_level > 0:
+			c['hm_c'] += 1
+		else:
+			c['hm_d'] += 1
+
+		if hm_lvl1_smo and agent.smoking_level == 1:
+			c['hm_eq'] += 1
+		elif hm_lvl1_smo and agent.smoking_level == 2:
+			c['hm_es'] += 1
+		elif hm_lvl2_smo and agent.smoking_level == 1:
+			c['hm_sq'] += 1
+		elif hm_lvl2_smo and agent.smoking_level == 2:
+			c['hm_ss'] += 1
+
+		spouse = agent.spouse
+		if spouse is not None:
+			if spouse.alcohol_level == 2 and agent.alcohol_level > 0:
+				c['sp_a'] += 1
+			elif spouse.alcohol_level == 2 and agent.alcohol_level == 0:
+				c['sp_b'] += 1
+			elif spouse.alcohol_level < 2 and agent.alcohol_level > 0:
+				c['sp_c'] += 1
+			else:
+				c['sp_d'] += 1
+
+			if spouse.smoking_level == 1 and agent.smoking_level == 1:
+				c['sp_eq'] += 1
+			elif spouse.smoking_level == 2 and agent.smoking_level == 1:
+				c['sp_es'] += 1
+			elif spouse.smoking_level == 1 and agent.smoking_level == 2:
+				c['sp_sq'] += 1
+			elif spouse.smoking_level == 2 and agent.smoking_level == 2:
+				c['sp_ss'] += 1
+
+			if spouse.inactivity_level < 2 and agent.inactivity_level < 2:
+				c['sp_ae'] += 1
+			elif spouse.inactivity_level == 2 and agent.inactivity_level < 2:
+				c['sp_ai'] += 1
+			elif spouse.inactivity_level < 2 and agent.inactivity_level == 2:
+				c['sp_ie'] += 1
+			elif spouse_bug:
+				c['sp_ie'] = c['sp_ii'] + 1
+			else:
+				c['sp_ii'] += 1
+
+		friend_lvl1_smo = any(f.smoking_level == 1 for f in agent.friends)
+		friend_lvl2_smo = any(f.smoking_level == 2 for f in agent.friends)
+		friend_lvl2_act = any(f.inactivity_level == 2 for f in agent.friends)
+
+		if friend_lvl1_smo and agent.smoking_level == 1:
+			c['fr_eq'] += 1
+		elif friend_lvl1_smo and agent.smoking_level == 2:
+			c['fr_es'] += 1
+		elif friend_lvl2_smo and agent.smoking_level == 1:
+			c['fr_sq'] += 1
+		elif friend_lvl2_smo and agent.smoking_level == 2:
+			c['fr_ss'] += 1
+
+		if not friend_lvl2_act and agent.inactivity_level < 2:
+			c['fr_ae'] += 1
+		elif not friend_lvl2_act and agent.inactivity_level == 2:
+			c['fr_ie'] += 1
+		elif friend_lvl2_act and agent.inactivity_level < 2:
+			c['fr_ai'] += 1
+		else:
+			c['fr_ii'] += 1
+	return c
+
+
+# the rates of the original loop, in the order of neighbour_metrics
+def loop_metrics(agents, spouse_bug=False):
+	c = loop_counts(agents, spouse_bug)
+	values = list()
+	for r in ['hm', 'sp']:
+		a, b, d, e = c[r + '_a'], c[r + '_b'], c[r + '_c'], c[r + '_d']
+		values += [proportion(a, a + b), proportion(d, d + e), proportion(b, a + b), proportion(e, d + e)]
+	for r in ['hm', 'sp', 'fr']:
+		eq, es, sq, ss = c[r + '_eq'], c[r + '_es'], c[r + '_sq'], c[r + '_ss']
+		values += [proportion(eq, eq + es), proportion(sq, sq + ss), proportion(es, eq + es), proportion(ss, sq + ss)]
+	for r in ['sp', 'fr']:
+		ae, ai, ie, ii = c[r + '_ae'], c[r + '_ai'], c[r + '_ie'], c[r + '_ii']
+		values += [proportion(ae, ae + ai), proportion(ie, ie + ii), proportion(ai, ae + ai), proportion(ii, ie + ii)]
+	return values
+
+
+# a model after a few timesteps, so some agents have died
+def model_after(steps, **options):
+	random.seed(3)
+	agents = synthetic_population(1500, CONFIG, np.random.default_rng(1))
+	model = Spread_Model(agents, CONFIG['inf_by_rel'], None, "test", rng=np.random.default_rng(2), **options)
+	model.analytics(-1)
+	with quiet_logging():
+		model.simulation(steps)
+	return model
+
+
+@pytest.mark.parametrize('options', [dict(), dict(array_engine=True), dict(compact=True)])
+def test_matches_loop(options):
+	model = model_after(5, **options)
+	values = [value for label, value in model.neighbour_metrics()]
+	assert np.array_equal(values, loop_metrics(model.agents), equal_nan=True)
+
+
+# the loop with its spouse inactivity bug differs only in the two rates of
+# inactive agents with a spouse
+def test_spouse_inactivity_fix():
+	model = model_after(0)
+	values = [value for label, value in model.neighbour_metrics()]
+	buggy = loop_metrics(model.agents, spouse_bug=True)
+	differ = [k for k in range(len(values)) if not np.array_equal(values[k], buggy[k], equal_nan=True)]
+	assert differ == [21, 23]
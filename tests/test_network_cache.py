@@ -0,0 +1,90 @@
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / "benchmarks"))
+
+from synthetic import load_config, synthetic_population
+from population import Agent_Store
+from checkpoint import agent_arrays
+from agent_table import Agent_Table
+import network_cache
+from network_cache import network_path, write_network, cached_network, cached_agents, cached_table
+
+CONFIG = load_config()
+
+
+@pytest.fixture
+def parameter_folder(tmp_path):
+	folder = tmp_path / "cfg"
+	folder.mkdir()
+	(folder / "params.csv").write_text("a,1\n")
+	return folder
+
+
+# cache a synthetic population as the network of parameter_folder, size 500 and network seed 7
+def cache_population(folder, parameter_folder):
+	agents = synthetic_population(500, CONFIG, np.random.default_rng(1))
+	arrays = agent_arrays(Agent_Store(agents))
+	write_network(arrays, network_path(folder, parameter_folder, 500, 7))
+	return arrays
+
+
+# the key changes with everything that changes the network
+def test_key(tmp_path, parameter_folder, monkeypatch):
+	path = network_path(tmp_path, parameter_folder, 500, 7)
+	assert network_path(tmp_path, parameter_folder, 500, 7) == path
+	assert network_path(tmp_path, parameter_folder, 501, 7) != path
+	assert network_path(tmp_path, parameter_folder, 500, 8) != path
+
+	(parameter_folder / "params.csv").write_text("a,2\n")
+	changed = network_path(tmp_path, parameter_folder, 500, 7)
+	assert changed != path
+
+	monkeypatch.setattr(network_cache, 'GENERATOR_MODULES', ['synthetic'])
+	assert network_path(tmp_path, parameter_folder, 500, 7) != changed
+	monkeypatch.setattr(network_cache, 'CACHE_FORMAT', network_cache.CACHE_FORMAT + 1)
+	assert network_path(tmp_path, parameter_folder, 500, 7) != changed
+
+
+# a cached network is used without generating it again, as agents or as a table
+def test_hit(tmp_path, parameter_folder):
+	arrays = cache_population(tmp_path, parameter_folder)
+	assert cached_network(parameter_folder, None, 500, 7, tmp_path) == network_path(tmp_path, parameter_folder, 500, 7)
+
+	agents = Agent_Store(cached_agents(parameter_folder, None, 500, 7, tmp_path))
+	assert all(np.array_equal(agent_arrays(agents)[key], arrays[key]) for key in arrays)
+	table = cached_table(parameter_folder, None, 500, 7, tmp_path)
+	assert all(np.array_equal(table.arrays()[key], arrays[key]) for key in arrays)
+
+
+# a table cloned from the cache is copy-on-write: changing it does not change
+# the cache or the other clones
+def test_table_copy_on_write(tmp_path, parameter_folder):
+	cache_population(tmp_path, parameter_folder)
+	first = cached_table(parameter_folder, None, 500, 7, tmp_path)
+	levels = first.levels.copy()
+	ages = first.columns['age'].copy()
+
+	first.levels[...] = 2
+	first.columns['age'] += 1
+	first.remove(first[0])
+
+	second = cached_table(parameter_folder, None, 500, 7, tmp_path)
+	assert np.array_equal(second.levels, levels)
+	assert np.array_equal(second.columns['age'], ages)
+	assert second[0] is not None and len(second) == 500
+
+
+# the table arrays give back the same table
+def test_table_arrays_round_trip():
+	agents = synthetic_population(300, CONFIG, np.random.default_rng(1))
+	table = Agent_Table.from_agents(agents)
+	clone = Agent_Table.from_table_arrays(table.table_arrays())
+	arrays = table.arrays()
+	assert all(np.array_equal(clone.arrays()[key], arrays[key]) for key in arrays)
+	assert {view.uid for view in clone[5].friends} == {view.uid for view in table[5].friends}
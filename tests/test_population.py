@@ -0,0 +1,53 @@
+import sys
+from pathlib import Path
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / "benchmarks"))
+
+from synthetic import load_config, synthetic_population
+from population import Agent_Store, neighbour_sets
+from intervention import Spread_Model
+
+CONFIG = load_config()
+
+
+def population():
+	return synthetic_population(300, CONFIG, np.random.default_rng(1))
+
+
+# neighbour_sets changes the agents it is given: every neighbour list becomes
+# a set of the same agents
+def test_neighbour_sets_in_place():
+	agents = population()
+	before = [(list(agent.household), list(agent.workplace), list(agent.friends)) for agent in agents]
+	neighbour_sets(agents)
+	for agent, (household, workplace, friends) in zip(agents, before):
+		assert isinstance(agent.household, set) and agent.household == set(household)
+		assert isinstance(agent.workplace, set) and agent.workplace == set(workplace)
+		assert isinstance(agent.friends, set) and agent.friends == set(friends)
+
+
+# a model owns the agents it is given: their neighbours are sets after it is
+# built, and a dead agent leaves the neighbour sets of the caller's agents
+def test_model_owns_agents():
+	agents = population()
+	model = Spread_Model(agents, CONFIG['inf_by_rel'], None, "test", rng=np.random.default_rng(2))
+	assert all(isinstance(agent.friends, set) for agent in agents)
+
+	agent = next(agent for agent in agents if len(agent.friends) > 0)
+	friends = list(agent.friends)
+	model.deceased[0] = list()
+	model.remove_agent(agent, 0)
+	assert agent not in model.agents
+	assert all(agent not in friend.friends for friend in friends)
+
+
+def test_store_tombstones():
+	agents = population()
+	store = Agent_Store(agents)
+	store.remove(agents[5])
+	assert len(store) == len(agents) - 1 and store[5] is None and store[6] is agents[6]
+	assert [agent.uid for agent in store] == [uid for uid in range(len(agents)) if uid != 5]
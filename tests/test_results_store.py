@@ -0,0 +1,99 @@
+import pickle
+import random
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / "benchmarks"))
+
+from synthetic import load_config, synthetic_population
+from intervention import Spread_Model, score_threshold
+from reporting import quiet_logging
+import results_store
+from results_store import INCIDENCE_ROWS, INCIDENCE_METRICS
+
+
+@pytest.fixture(autouse=True)
+def results_folder(tmp_path, monkeypatch):
+	monkeypatch.setattr(results_store, 'RESULTS_FOLDER', tmp_path)
+	return tmp_path
+
+
+# incidence rows of a run as returned by incidence_rows, with made up values
+def incidence_rows(run):
+	return [[row, run + r, 1000 * (r + 1), (run + r) / (r + 1), 2 * run + r, 2000 * (r + 1), (2 * run + r) / (2 * r + 2)]
+		for r, row in enumerate(INCIDENCE_ROWS)]
+
+
+# results in the layout of the old _all.pkl file of the given runs
+def legacy_results(runs):
+	results = {row: {metric: [] for metric in INCIDENCE_METRICS} for row in INCIDENCE_ROWS}
+	for run in runs:
+		for r, values in enumerate(incidence_rows(run)):
+			for metric, value in zip(INCIDENCE_METRICS, values[1:]):
+				results[values[0]][metric].append(value)
+	return results
+
+
+def test_incidence_round_trip():
+	for run in range(3):
+		results_store.write_incidence_run("exp", incidence_rows(run), 10 - run)
+	results = results_store.load_incidence_results("exp")
+	assert results.pop('timesteps') == [10, 9, 8]
+	assert results == legacy_results(range(3))
+	assert isinstance(results['total']['f_incidents'][0], int)
+
+
+def test_behaviour_round_trip():
+	results_store.write_behaviour_run("exp", [0.5, 0.25, 0.125])
+	results_store.write_behaviour_run("exp", [1.0, 2.0, 3.0])
+	assert results_store.load_behaviour_results("exp") == [[0.5, 0.25, 0.125], [1.0, 2.0, 3.0]]
+
+
+def test_shards_are_separate_and_complete(results_folder):
+	for run in range(4):
+		results_store.write_behaviour_run("exp", [run])
+	folder = results_store.shard_folder("exp", 'behaviour')
+	assert len(results_store.shard_paths("exp", 'behaviour')) == 4
+	assert not any(path.name.endswith('.tmp') for path in folder.iterdir())
+
+
+# runs of an old style pickle come before the runs in the shards
+def test_legacy_pickles_read_first(results_folder):
+	with open(results_folder / "exp_all.pkl", 'wb') as file:
+		pickle.dump(legacy_results([10, 11]), file)
+	with open(results_folder / "expbehaviour_metrics_all.pkl", 'wb') as file:
+		pickle.dump([[7.0, 8.0]], file)
+	results_store.write_incidence_run("exp", incidence_rows(0), 10)
+	results_store.write_behaviour_run("exp", [9.0, 10.0])
+
+	results = results_store.load_incidence_results("exp")
+	assert results.pop('timesteps') == [None, None, 10]
+	assert results == legacy_results([10, 11, 0])
+	assert results_store.load_behaviour_results("exp") == [[7.0, 8.0], [9.0, 10.0]]
+
+
+def test_no_results():
+	assert results_store.load_behaviour_results("missing") == []
+	assert results_store.load_incidence_results("missing")['total']['f_rate'] == []
+	assert results_store.load_incidence_results("missing")['timesteps'] == []
+
+
+# a run stopped early by its running score records how far it got
+def test_early_stop_records_timesteps(results_folder, monkeypatch):
+	monkeypatch.chdir(results_folder)
+	(results_folder / "results").mkdir()
+	config = load_config()
+	with quiet_logging():
+		for stop_score in [float('inf'), 0.0]:
+			agents = synthetic_population(800, config, np.random.default_rng(1))
+			model = Spread_Model(agents, config['inf_by_rel'], None, "exp", rng=np.random.default_rng(2))
+			random.seed(3)
+			model.analytics(-1)
+			model.simulation(5, score_callback=score_threshold(stop_score, min_timesteps=2))
+			model.save_simulation_metrics()
+	assert results_store.load_incidence_results("exp")['timesteps'] == [5, 2]
@@ -0,0 +1,93 @@
+import random
+import sys
+from pathlib import Path
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / "benchmarks"))
+
+from synthetic import load_config, synthetic_population, Synthetic_Agent
+from scenarios import Scenario, Scenario_Batch, assigned_groups
+from intervention_groups import workplaces
+from population import Agent_Store
+
+CONFIG = load_config()
+STEPS = 8
+
+
+# an agent that quits smoking in any intervention group, so its rules depend on agent.intervention
+class Quitting_Agent(Synthetic_Agent):
+	def next_smoking_level(self, inc_inf):
+		super().next_smoking_level(inc_inf)
+		if self.intervention:
+			self.next_levels[0] = 0
+
+
+def population(agent_class=Synthetic_Agent):
+	agents = synthetic_population(1500, CONFIG, np.random.default_rng(1))
+	for agent in agents:
+		agent.__class__ = agent_class
+	return Agent_Store(agents)
+
+
+# weights of an intervention group with every weight times factor
+def scaled_weights(factor):
+	def scale(weights):
+		if isinstance(weights, dict):
+			return {key: scale(value) for key, value in weights.items()}
+		return weights * factor
+	return scale(CONFIG['inf_by_rel'])
+
+
+def run(agents, scenarios):
+	batch = Scenario_Batch(agents, CONFIG['inf_by_rel'], scenarios, rng=np.random.default_rng(2))
+	random.seed(3)
+	batch.run(STEPS)
+	return batch
+
+
+# rows of result_rows of one scenario, without its name
+def trajectory(batch, name):
+	return [row[1:] for row in batch.result_rows() if row[0] == name]
+
+
+# the groups of a scenario are its own, the shared agents keep theirs
+def test_assigned_groups_leave_agents():
+	agents = population()
+	groups = assigned_groups(agents, 1, 0.4, np.random.default_rng(5))
+	assert all(agent.intervention is False for agent in agents)
+	for members in workplaces(agents):
+		assert len(set(groups[agent.uid] for agent in members)) == 1
+	assert groups.max() == 1
+	assert np.array_equal(assigned_groups(agents, 1, 0.4, np.random.default_rng(5)), groups)
+
+
+# scenarios with the same parameters have the same trajectories, also when
+# the deaths of another scenario have gone their own way
+def test_identical_scenarios_agree():
+	agents = population()
+	groups = assigned_groups(agents, 1, 0.4, np.random.default_rng(5))
+	strong = [scaled_weights(20.0)]
+	batch = run(agents, [Scenario('baseline'), Scenario('a', strong, groups), Scenario('other', [scaled_weights(0.0)], groups),
+		Scenario('b', strong, groups.copy())])
+
+	assert trajectory(batch, 'a') == trajectory(batch, 'b')
+	deaths = np.array(batch.deaths)
+	assert (deaths[:, 1] != deaths[:, 2]).any()
+	assert (batch.alive[1] != batch.alive[2]).any()
+	assert np.array_equal(batch.alive[1], batch.alive[3])
+
+
+# the agents' own rules see the group of the agent in the scenario they run for
+def test_agent_rules_see_scenario_groups():
+	agents = population(Quitting_Agent)
+	groups = assigned_groups(agents, 1, 0.4, np.random.default_rng(5))
+	weights = [CONFIG['inf_by_rel']]
+	batch = run(agents, [Scenario('baseline', groups=np.zeros(len(groups), dtype=np.intp)),
+		Scenario('intervention', weights, groups)])
+
+	members = groups == 1
+	assert (batch.levels[1, 0, members & batch.alive[1]] == 0).all()
+	assert (batch.levels[0, 0, members & batch.alive[0]] > 0).any()
@@ -0,0 +1,82 @@
+import random
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / "benchmarks"))
+
+from synthetic import load_config, synthetic_population
+from intervention import Spread_Model
+from checkpoint import read_checkpoint, restore_model, latest_checkpoint
+from reporting import quiet_logging
+from sinks import open_sink
+
+# A run resumed from a checkpoint appends to the stream of the run it resumes,
+# after dropping the records of the timesteps it runs again. Its stream must be
+# the same as that of an uninterrupted run.
+
+CONFIG = load_config()
+STEPS = 5
+
+
+def new_model(agents, sink, **options):
+	return Spread_Model(agents, CONFIG['inf_by_rel'], None, "test", sink=sink, rng=np.random.default_rng(2), **options)
+
+
+# run the synthetic population for STEPS timesteps, streamed to path
+def straight(path, **options):
+	with quiet_logging():
+		model = new_model(synthetic_population(800, CONFIG, np.random.default_rng(1)), open_sink(path), **options)
+		random.seed(3)
+		model.analytics(-1)
+		model.simulation(STEPS)
+		model.sink.close()
+
+
+# a run that went on past its checkpoint at timestep 2 before it stopped, and
+# its resumption from that checkpoint, both streamed to path
+def interrupted(path, checkpoints, **options):
+	with quiet_logging():
+		model = new_model(synthetic_population(800, CONFIG, np.random.default_rng(1)), open_sink(path), **options)
+		random.seed(3)
+		model.analytics(-1)
+		model.simulation(STEPS - 1, checkpoint_every=2, checkpoint_folder=checkpoints)
+		model.sink.close()
+
+		agents, arrays = read_checkpoint(latest_checkpoint(checkpoints))
+		timestep = int(arrays['timestep'])
+		model = new_model(agents, open_sink(path, append=True, timestep=timestep), **options)
+		restore_model(model, arrays)
+		model.simulation(STEPS)
+		model.sink.close()
+
+
+# the stream files of path, csv streams are two files
+def stream_files(path):
+	if str(path).endswith('.jsonl'):
+		return [Path(path)]
+	return [Path(str(path) + "_timesteps.csv"), Path(str(path) + "_deaths.csv")]
+
+
+@pytest.mark.parametrize('name', ['run.jsonl', 'run'])
+@pytest.mark.parametrize('compact', [False, True])
+def test_resumed_stream_matches_straight_run(tmp_path, name, compact):
+	straight(tmp_path / ("straight_" + name), compact=compact)
+	interrupted(tmp_path / ("resumed_" + name), tmp_path / "checkpoints", compact=compact)
+	for a, b in zip(stream_files(tmp_path / ("straight_" + name)), stream_files(tmp_path / ("resumed_" + name))):
+		assert a.read_bytes() == b.read_bytes()
+
+
+# appending without a timestep keeps every record, e.g. a new run
+def test_append_without_timestep_keeps_records(tmp_path):
+	path = tmp_path / "run.jsonl"
+	straight(path)
+	lines = path.read_text().splitlines()
+	open_sink(path, append=True).close()
+	assert path.read_text().splitlines() == lines
+	open_sink(path, append=True, timestep=3).close()
+	assert all('"t": 3' not in line and '"t": 4' not in line for line in path.read_text().splitlines())
@@ -0,0 +1,180 @@
+import cProfile
+import json
+import pstats
+import sys
+import threading
+import time
+from pathlib import Path
+
+# Instrumentation of Spread_Model.simulation. A Phase_Timer splits the wall
+# clock time of every timestep between named phases, switching from one phase
+# to the next, and keeps counters such as the number of agents processed, the
+# neighbours visited and the deaths. The totals can be shown as a table at
+# the end of a run and written as a JSON report with one entry per timestep.
+# Spread_Model uses a Null_Timer unless timing is asked for, whose methods do
+# nothing.
+
+
+class Null_Timer:
+	enabled = False
+
+	def switch(self, phase):
+		pass
+
+	def stop(self):
+		pass
+
+	def count(self, name, n):
+		pass
+
+	def end_step(self, t):
+		pass
+
+
+class Phase_Timer(Null_Timer):
+	enabled = True
+
+	def __init__(self):
+		# totals over the run, phases in the order they first ran
+		self.seconds = dict()
+		self.counters = dict()
+		# per timestep: {'t': t, 'seconds': {phase: s}, 'counters': {name: n}}
+		self.steps = list()
+
+		self.step_seconds = dict()
+		self.step_counters = dict()
+		self.phase = None
+		self.started = None
+
+	# end the current phase (if any) and start the next one, None for no phase
+	def switch(self, phase):
+		now = time.perf_counter()
+		if self.phase is not None:
+			self.step_seconds[self.phase] = self.step_seconds.get(self.phase, 0.0) + (now - self.started)
+		self.phase = phase
+		self.started = now
+
+	def stop(self):
+		self.switch(None)
+
+	def count(self, name, n):
+		self.step_counters[name] = self.step_counters.get(name, 0) + n
+
+	# close timestep t and add it to the totals
+	def end_step(self, t):
+		self.stop()
+		self.steps.append({'t': t, 'seconds': self.step_seconds, 'counters': self.step_counters})
+		for phase, seconds in self.step_seconds.items():
+			self.seconds[phase] = self.seconds.get(phase, 0.0) + seconds
+		for name, n in self.step_counters.items():
+			self.counters[name] = self.counters.get(name, 0) + n
+		self.step_seconds = dict()
+		self.step_counters = dict()
+
+	def total_seconds(self):
+		return sum(self.seconds.values())
+
+	# agent-steps per second over the timed phases
+	def throughput(self):
+		total = self.total_seconds()
+		return self.counters.get('agents', 0) / total if total > 0 else float('nan')
+
+	# lines of a table of the phases and counters
+	def table(self):
+		total = self.total_seconds()
+		steps = max(len(self.steps), 1)
+		lines = ["phase          \t total (s) \t per step (s) \t share"]
+		for phase, seconds in self.seconds.items():
+			share = seconds / total if total > 0 else float('nan')
+			lines.append("%-15s\t %9.3f \t %12.4f \t %5.1f%%" % (phase, seconds, seconds / steps, 100 * share))
+		lines.append("%-15s\t %9.3f \t %12.4f" % ('total', total, total / steps))
+		for name, n in self.counters.items():
+			lines.append("%-15s\t %d" % (name, n))
+		lines.append("%-15s\t %.0f" % ('agent-steps/s', self.throughput()))
+		return lines
+
+	def report(self):
+		return {'timesteps': len(self.steps), 'seconds': self.seconds, 'counters': self.counters,
+			'throughput': self.throughput(), 'steps': self.steps}
+
+	def write_json(self, path):
+		with open(path, 'w') as file:
+			json.dump(self.report(), file, indent=1)
+
+
+# Statistical profiler: a background thread takes a sample of the call stack
+# of one thread every interval seconds. The samples are written as folded
+# stacks (one "outer;...;inner count" line per stack), the input format of
+# flame graph tools.
+class Sampling_Profiler:
+	def __init__(self, interval=0.005, thread_id=None):
+		self.interval = interval
+		self.thread_id = thread_id if thread_id is not None else threading.get_ident()
+		self.samples = dict()
+		self.running = False
+		self.thread = None
+
+	def start(self):
+		self.running = True
+		self.thread = threading.Thread(target=self.sample, daemon=True)
+		self.thread.start()
+
+	def stop(self):
+		self.running = False
+		if self.thread is not None:
+			self.thread.join()
+
+	def sample(self):
+		while self.running:
+			frame = sys._current_frames().get(self.thread_id)
+			stack = list()
+			while frame is not None:
+				code = frame.f_code
+				stack.append(Path(code.co_filename).name + ":" + code.co_name)
+				frame = frame.f_back
+			if len(stack) > 0:
+				stack = ';'.join(reversed(stack))
+				self.samples[stack] = self.samples.get(stack, 0) + 1
+			time.sleep(self.interval)
+
+	def write_folded(self, path):
+		with open(path, 'w') as file:
+			for stack, count in sorted(self.samples.items(), key=lambda item: -item[1]):
+				file.write(stack + " " + str(count) + "\n")
+
+
+# run function() under cProfile and the sampling profiler, writing
+# <prefix>.prof (for pstats/snakeviz) and <prefix>.folded. Returns the
+# result of function and the lines of the top cProfile entries.
+def profile_run(function, prefix, top=25):
+	prefix = str(prefix)
+	sampler = Sampling_Profiler()
+	profiler = cProfile.Profile()
+
+	sampler.start()
+	profiler.enable()
+	try:
+		result = function()
+	finally:
+		profiler.disable()
+		sampler.stop()
+
+	profiler.dump_stats(prefix + ".prof")
+	sampler.write_folded(prefix + ".folded")
+
+	lines = list()
+	stats = pstats.Stats(profiler, stream=Line_Stream(lines))
+	stats.sort_stats('cumulative').print_stats(top)
+	return result, lines
+
+
+# file-like object collecting written text as lines, for pstats output
+class Line_Stream:
+	def __init__(self, lines):
+		self.lines = lines
+
+	def write(self, text):
+		self.lines.extend(line for line in text.splitlines() if line.strip() != '')
+
+	def flush(self):
+		pass